@@ -0,0 +1,543 @@
+"""
+Download benchmark suite.
+
+A local HTTP server stands in for the video host and serves synthetic videos of a configurable size, with an optional
+latency before every response, a per-connection bandwidth cap, Range support and a failure rate. Failed requests
+either get a 503 or have their connection cut half way through the body, chosen deterministically per URL and attempt,
+so every run of the same configuration fails the same requests.
+
+Every engine is run in a fresh process with a fresh catalogue and download folder:
+    - green: `download_video` of the Green manager, one video after another;
+    - green-segmented: the same with resumable byte-range downloads;
+    - blue-threads: `download_videos` of the Blue manager, once for every thread count asked for;
+    - blue-asyncio: `download_videos` with the asyncio backend;
+    - blue-segmented: `download_videos` with resumable byte-range downloads;
+    - blue-cache: `download_videos` revalidating a warm download cache;
+    - red-scheduler: the DownloadScheduler set up the way the Red downloader uses it.
+
+For every run it reports MB/s, files/s, the p50/p99 time each download took in the downloading process, from the
+start of its first request to the end of its last retry, the CPU time and peak RSS of that process, and how many files
+arrived complete. The results are written as JSON, which can be passed
+back with --compare to report the change against an earlier run, e.g. of the previous release.
+
+Usage: python download_benchmark.py --files 32 --size 4 --latency 20 --output results.json
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from video_download import STATE_SUFFIX
+
+RESULTS_VERSION = 2
+ENGINES = ('green', 'green-segmented', 'blue-threads', 'blue-asyncio', 'blue-segmented', 'blue-cache',
+           'red-scheduler')
+THREADS = (1, 4, 8, 16)
+SEGMENTS = 4
+# Same limits as the Red downloader
+RED_DOWNLOADS = 4
+RED_SEGMENTS = 4
+DOWNLOAD_FOLDER = 'files'
+MB = 1024 * 1024
+SEND_CHUNK_SIZE = 64 * 1024
+# Every synthetic video is this byte pattern repeated, so any byte range can be served without building the file
+PATTERN = bytes(range(256)) * (4 * SEND_CHUNK_SIZE // 256)
+
+
+def _fails(seed: int, path: str, attempt: int, failure_rate: float):
+    """
+    Decide whether the given attempt at a URL fails, and how: None, 'status' or 'cut'.
+    """
+    if failure_rate <= 0:
+        return None
+    digest = hashlib.sha256(f'{seed} {path} {attempt}'.encode('utf-8')).digest()
+    if int.from_bytes(digest[:8], 'big') / 2 ** 64 >= failure_rate:
+        return None
+    return 'status' if digest[8] % 2 else 'cut'
+
+
+class VideoRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serve synthetic videos at /<name>.mp4 as configured on the server, plus /_stats and /_reset for the benchmark.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.serve(body=False)
+
+    def do_GET(self):
+        self.serve(body=True)
+
+    def send_json(self, data):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def serve(self, body: bool):
+        server = self.server
+        path = urlsplit(self.path).path
+        if path == '/_stats':
+            self.send_json(server.snapshot())
+            return
+        if path == '/_reset':
+            server.reset()
+            self.send_json({})
+            return
+        if not path.endswith('.mp4'):
+            self.send_error(404)
+            return
+
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+            failure = _fails(server.seed, path, server.attempt(path), server.failure_rate) if body else None
+            if failure == 'status':
+                self.send_response(503)
+                self.send_header('Retry-After', '1')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_video(path, body, failure == 'cut')
+        finally:
+            server.add_request()
+
+    def send_video(self, path: str, body: bool, cut: bool):
+        server = self.server
+        size = server.size
+        etag = f'"{size}-{os.path.basename(path)}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        start, end = 0, size
+        byte_range = self.headers.get('Range')
+        if byte_range and server.ranges and byte_range.startswith('bytes='):
+            first, _, last = byte_range[len('bytes='):].partition('-')
+            if first:
+                start, end = int(first), min(size, int(last) + 1 if last else size)
+            else:
+                start, end = max(0, size - int(last)), size
+            if start >= end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('ETag', etag)
+        if server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if not body:
+            return
+
+        # A cut connection sends half of the promised body and then closes
+        stop = start + (end - start) // 2 if cut else end
+        view = memoryview(PATTERN)
+        sent = 0
+        began = time.monotonic()
+        pos = start
+        while pos < stop:
+            n_bytes = min(SEND_CHUNK_SIZE, stop - pos)
+            offset = pos % 256
+            self.wfile.write(view[offset:offset + n_bytes])
+            pos += n_bytes
+            sent += n_bytes
+            server.add_bytes(n_bytes)
+            if server.bandwidth:
+                ahead = sent / server.bandwidth - (time.monotonic() - began)
+                if ahead > 0:
+                    time.sleep(ahead)
+        if cut:
+            self.close_connection = True
+
+
+class VideoServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server keeping the configuration and per-file timings of the synthetic video host.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, size: int, latency: float = 0.0, bandwidth: float = None, ranges: bool = True,
+                 failure_rate: float = 0.0, seed: int = 0):
+        super().__init__(address, VideoRequestHandler)
+        self.size = size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.ranges = ranges
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Every run starts counting attempts again, so repeated runs fail the same requests
+        with self.lock:
+            self.attempts = {}
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def attempt(self, path: str) -> int:
+        with self.lock:
+            self.attempts[path] = self.attempts.get(path, 0) + 1
+            return self.attempts[path]
+
+    def add_bytes(self, n_bytes: int):
+        with self.lock:
+            self.bytes_sent += n_bytes
+
+    def add_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'bytes_sent': self.bytes_sent,
+            }
+
+
+def serve(config: dict, conn) -> None:
+    """
+    Run a video server until the process is terminated, sending its port back through the connection first.
+    """
+    server = VideoServer(('127.0.0.1', 0), **config)
+    conn.send(server.server_address[1])
+    conn.close()
+    server.serve_forever()
+
+
+def _get_json(url: str) -> dict:
+    with urlopen(url) as res:
+        return json.load(res)
+
+
+def percentile(values: list, percent: float):
+    """
+    Nearest-rank percentile of the values, or None if there are none.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+@contextlib.contextmanager
+def _silenced():
+    """
+    Send everything the engines print, including progress bars written straight to the descriptors, to nowhere.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), 1)
+        os.dup2(devnull.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            for fd in saved:
+                os.close(fd)
+
+
+def _peak_rss():
+    """
+    Peak resident set size of this process in bytes, or None where the platform cannot tell.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _complete_files(folder: str, video_ids: list, size: int) -> int:
+    """
+    Count the videos with a file of the right size in the download folder. Preallocated files of unfinished
+    resumable downloads have the right size too, so files with a state file next to them do not count.
+    """
+    if not os.path.isdir(folder):
+        return 0
+    names = os.listdir(folder)
+    unfinished = {name[:-len(STATE_SUFFIX)] for name in names if name.endswith(STATE_SUFFIX)}
+    names = [name for name in names if name not in unfinished and os.path.isfile(os.path.join(folder, name))
+             and os.path.getsize(os.path.join(folder, name)) == size]
+    return sum(any(name.startswith(f'{video_id}-') and name.endswith('.mp4') for name in names)
+               for video_id in video_ids)
+
+
+def _download(engine: str, threads: int, video_ids: list, videos, metrics):
+    """
+    Run one engine over all the videos, swallowing the errors it raises so the incomplete files get counted instead.
+    """
+    if engine in ('green', 'green-segmented'):
+        import video_manager_green
+
+        for video_id in video_ids:
+            try:
+                video_manager_green.download_video(video_id, segments=SEGMENTS if engine == 'green-segmented' else 0,
+                                                   cache=False)
+            except Exception:
+                pass
+    elif engine == 'red-scheduler':
+        from download_scheduler import DownloadScheduler
+
+        os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+        with DownloadScheduler(workers=RED_DOWNLOADS, per_host=RED_DOWNLOADS * RED_SEGMENTS,
+                               metrics=metrics) as scheduler:
+            for video_id in video_ids:
+                dest_path = os.path.join(DOWNLOAD_FOLDER, f'{video_id}-red.mp4')
+                scheduler.submit(videos.get(video_id)[2], dest_path, segments=RED_SEGMENTS)
+            scheduler.join()
+    else:
+        import video_manager_blue
+
+        options = {
+            'blue-threads': {'cache': False},
+            'blue-asyncio': {'backend': 'asyncio', 'cache': False},
+            'blue-segmented': {'segments': SEGMENTS, 'cache': False},
+            'blue-cache': {'cache': True},
+        }[engine]
+        try:
+            video_manager_blue.download_videos(video_ids, threads_num=threads, **options)
+        except Exception:
+            pass
+
+
+def run_case(case: dict) -> dict:
+    """
+    Time one engine in this process, which must be a fresh one: the peak RSS covers its whole life.
+    """
+    os.chdir(case['workdir'])
+    sys.path.insert(0, case['repo'])
+    from video_catalogue import load_catalogue
+    from video_core import metrics
+
+    videos = load_catalogue('video.csv')
+    engine, threads, video_ids = case['engine'], case['threads'], case['video_ids']
+    file_times = []
+    with _silenced():
+        if engine == 'blue-cache':
+            # Fill the cache first; only the revalidating run is timed
+            _download(engine, threads, video_ids, videos, metrics)
+            time.sleep(1)
+            _get_json(case['server'] + '/_reset')
+        # Every engine tracks each download in the metrics, and the record times it on this side of the connection
+        metrics.add_observer(lambda record: file_times.append(record.duration))
+        cpu = time.process_time()
+        started = time.perf_counter()
+        _download(engine, threads, video_ids, videos, metrics)
+        wall = time.perf_counter() - started
+        cpu = time.process_time() - cpu
+    return {
+        'wall': wall,
+        'cpu': cpu,
+        'peak_rss': _peak_rss(),
+        'complete': _complete_files(DOWNLOAD_FOLDER, video_ids, case['size']),
+        'p50_latency': percentile(file_times, 50),
+        'p99_latency': percentile(file_times, 99),
+    }
+
+
+def _summary(runs: list, files: int, size: int) -> dict:
+    """
+    Median of every metric over the repeated runs of a case.
+    """
+    def median(key):
+        values = [run[key] for run in runs if run[key] is not None]
+        return statistics.median(values) if values else None
+
+    wall = median('wall')
+    return {
+        'mb_per_s': files * size / MB / wall if wall else None,
+        'files_per_s': files / wall if wall else None,
+        'wall': wall,
+        'p50_latency': median('p50_latency'),
+        'p99_latency': median('p99_latency'),
+        'cpu': median('cpu'),
+        'peak_rss': median('peak_rss'),
+        'complete': min(run['complete'] for run in runs),
+        'requests': median('requests'),
+    }
+
+
+def _git_commit(repo: str):
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(engines=ENGINES, threads=THREADS, files: int = 16, size: int = 4 * MB, latency: float = 0.0,
+                   bandwidth: float = None, ranges: bool = True, failure_rate: float = 0.0, repeat: int = 3,
+                   seed: int = 0, log=print) -> dict:
+    """
+    Run every engine against a fresh video server and return the results, ready to be dumped as JSON.
+    """
+    for engine in engines:
+        if engine not in ENGINES:
+            raise Exception(f"The engine {engine} is INVALID! Please choose from {', '.join(ENGINES)}")
+
+    repo = os.path.dirname(os.path.abspath(__file__))
+    config = {'size': size, 'latency': latency, 'bandwidth': bandwidth, 'ranges': ranges,
+              'failure_rate': failure_rate, 'seed': seed}
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    server_process = context.Process(target=serve, args=(config, sender), daemon=True)
+    server_process.start()
+    server = f'http://127.0.0.1:{receiver.recv()}'
+
+    video_ids = [f'bench{i}' for i in range(files)]
+    results = []
+    try:
+        for engine in engines:
+            for threads_num in (threads if engine.startswith('blue-') and engine != 'blue-asyncio' else (None,)):
+                name = engine if threads_num is None else f'{engine}-{threads_num}'
+                runs = []
+                for _ in range(repeat):
+                    workdir = tempfile.mkdtemp(prefix='video-bench-')
+                    try:
+                        with open(os.path.join(workdir, 'video.csv'), 'w', encoding='utf-8') as f:
+                            for video_id in video_ids:
+                                f.write(f'{video_id},Benchmark video {video_id},{server}/{video_id}.mp4\n')
+                        _get_json(server + '/_reset')
+                        case = {'engine': engine, 'threads': threads_num or 8, 'video_ids': video_ids, 'size': size,
+                                'workdir': workdir, 'repo': repo, 'server': server}
+                        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                            run = executor.submit(run_case, case).result()
+                    finally:
+                        shutil.rmtree(workdir, ignore_errors=True)
+                    stats = _get_json(server + '/_stats')
+                    run['requests'] = stats['requests']
+                    runs.append(run)
+                result = {'case': name, 'engine': engine, 'threads': threads_num, 'runs': runs,
+                          'summary': _summary(runs, files, size)}
+                log(format_row(result['case'], result['summary'], files))
+                results.append(result)
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': _git_commit(repo),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpus': os.cpu_count()},
+        'config': dict(config, files=files, repeat=repeat),
+        'results': results,
+    }
+
+
+HEADER_ROW = f"{'case':<20} {'MB/s':>8} {'files/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'CPU s':>7} {'RSS MB':>7} " \
+             f"{'complete':>9}"
+
+
+def format_row(case: str, summary: dict, files: int) -> str:
+    def number(value, scale=1.0, digits=1):
+        return '-' if value is None else f'{value * scale:.{digits}f}'
+
+    return f"{case:<20} {number(summary['mb_per_s']):>8} {number(summary['files_per_s']):>8} " \
+           f"{number(summary['p50_latency'], 1000):>8} {number(summary['p99_latency'], 1000):>8} " \
+           f"{number(summary['cpu'], digits=2):>7} {number(summary['peak_rss'], 1 / MB):>7} " \
+           f"{summary['complete']:>4}/{files:<4}"
+
+
+def compare(baseline: dict, results: dict, tolerance: float = 0.1, log=print) -> list:
+    """
+    Print the throughput change of every case found in both results, and return the cases slower by more than the
+    tolerance.
+    """
+    if baseline.get('config') != results.get('config'):
+        log('Warning: the baseline was run with another configuration, so the comparison may be meaningless.')
+    old = {result['case']: result['summary'] for result in baseline.get('results', [])}
+    regressions = []
+    for result in results['results']:
+        before = old.get(result['case'], {}).get('mb_per_s')
+        after = result['summary']['mb_per_s']
+        if not before or after is None:
+            continue
+        change = after / before - 1
+        log(f"{result['case']:<20} {before:8.1f} -> {after:8.1f} MB/s ({change:+.1%})")
+        if change < -tolerance:
+            regressions.append(result['case'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the video downloaders against a local HTTP server.')
+    parser.add_argument('--engines', default=','.join(ENGINES), help='comma-separated engines to run')
+    parser.add_argument('--threads', default=','.join(map(str, THREADS)), help='thread counts for the blue engines')
+    parser.add_argument('--files', type=int, default=16, help='number of videos per run')
+    parser.add_argument('--size', type=float, default=4, help='size of every video in MB')
+    parser.add_argument('--latency', type=float, default=0, help='delay before every response in milliseconds')
+    parser.add_argument('--bandwidth', type=float, default=0, help='cap per connection in MB/s, 0 for none')
+    parser.add_argument('--no-ranges', action='store_true', help='make the server ignore Range requests')
+    parser.add_argument('--failure-rate', type=float, default=0, help='fraction of video requests that fail')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case; the median is reported')
+    parser.add_argument('--seed', type=int, default=0, help='seed choosing the failed requests')
+    parser.add_argument('--output', default='bench_results.json', help='where to write the JSON results')
+    parser.add_argument('--compare', help='earlier JSON results to compare the throughput with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='fraction of throughput a case may lose against --compare before the run fails')
+    args = parser.parse_args()
+
+    print(HEADER_ROW)
+    results = run_benchmarks(
+        engines=[engine.strip() for engine in args.engines.split(',') if engine.strip()],
+        threads=[int(threads) for threads in args.threads.split(',') if threads.strip()],
+        files=args.files, size=int(args.size * MB), latency=args.latency / 1000,
+        bandwidth=args.bandwidth * MB or None, ranges=not args.no_ranges, failure_rate=args.failure_rate,
+        repeat=args.repeat, seed=args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f'The results were saved as {args.output}.')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        if regressions:
+            print(f"Slower than the baseline: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
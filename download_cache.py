@@ -0,0 +1,192 @@
+"""
+Content-addressed cache for downloaded videos.
+
+Every download is stored once under the SHA-256 of its content in a hidden folder inside the download folder, and the
+requested file is a hard link to it, so downloading the same video again costs no extra disk space. Entries are keyed
+by video ID and URL and keep the ETag/Last-Modified of the response: a repeated download first asks the server with
+If-None-Match/If-Modified-Since and skips the transfer when it answers 304 Not Modified. Content still linked to by a
+downloaded file takes no space of its own, and removing it would free none, so only content the cache alone holds
+counts towards its size limit. When that grows over the limit, the least recently used of it is evicted. Downloaded
+files are never removed.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from video_download import REQUEST_TIMEOUT, HashingWriter, check_response, stream_to_file
+from video_integrity import StreamVerifier, expected_length
+
+CACHE_FOLDER = '.cache'
+CACHE_SIZE = 10 * 1024 ** 3
+
+
+class DownloadCache:
+    """
+    Size-bounded LRU cache of downloaded files, deduplicated by content hash.
+    """
+
+    def __init__(self, folder: str = 'files', max_size: int = CACHE_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        self.root = os.path.join(folder, CACHE_FOLDER)
+        self.objects = os.path.join(self.root, 'objects')
+        self.index_path = os.path.join(self.root, 'index.json')
+        os.makedirs(self.objects, exist_ok=True)
+        self.lock = threading.Lock()
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects, digest)
+
+    def _save(self):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def _link(object_path: str, dest_path: str):
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(object_path, dest_path)
+        except OSError:
+            # Hard links are not available on every file system
+            shutil.copyfile(object_path, dest_path)
+
+    def fetch(self, video_id: str, url: str, dest_path: str, session=None, on_chunk=None,
+              checksum: str = None) -> bool:
+        """
+        Save the video at the URL to dest_path, from the cache if the server says it has not changed.
+        Return True if no body had to be transferred. With a checksum, the body is verified before it is cached and
+        IntegrityError is raised if it does not match. An error status raises DownloadError and nothing is saved.
+        """
+        import requests
+
+        session = session or requests
+        key = f"{video_id} {url}"
+        with self.lock:
+            entry = self.entries.get(key)
+        verifier = StreamVerifier(checksum)
+        # Content stored under another SHA-256 than the expected one cannot be reused
+        stale = verifier.algorithm == 'sha256' and entry and entry['sha256'] != verifier.digest
+        headers = {}
+        if entry and not stale and os.path.exists(self._object_path(entry['sha256'])):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        res = session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT)
+        if res.status_code == 304 and headers:
+            with self.lock:
+                # Another thread may have evicted the content since it was looked up
+                if self.entries.get(key) is entry and os.path.exists(self._object_path(entry['sha256'])):
+                    self._link(self._object_path(entry['sha256']), dest_path)
+                    self._touch(entry)
+                    self._save()
+                    return True
+            res.close()
+            res = session.get(url, stream=True, timeout=REQUEST_TIMEOUT)
+        check_response(res, url)
+        if res.status_code != 200:
+            # Do not cache partial or other unusual content, just save what came back like before
+            with open(dest_path, 'wb') as f:
+                size = stream_to_file(res, verifier.wrap(f), on_chunk)
+            verifier.check(dest_path, size, expected_length(res.headers))
+            return False
+
+        import uuid
+
+        tmp_path = os.path.join(self.root, f"tmp-{uuid.uuid4().hex}")
+        hasher = hashlib.sha256()
+        try:
+            with open(tmp_path, 'wb') as f:
+                size = stream_to_file(res, verifier.wrap(HashingWriter(f, hasher)), on_chunk)
+            # A bad body is quarantined and never enters the cache
+            verifier.check(tmp_path, size, expected_length(res.headers))
+            digest = hasher.hexdigest()
+            with self.lock:
+                object_path = self._object_path(digest)
+                if os.path.exists(object_path):
+                    # Identical content is already stored under another ID or URL
+                    os.remove(tmp_path)
+                else:
+                    os.replace(tmp_path, object_path)
+                self._link(object_path, dest_path)
+                entry = {'sha256': digest, 'size': size, 'etag': res.headers.get('ETag'),
+                         'last_modified': res.headers.get('Last-Modified')}
+                self.entries[key] = entry
+                self._touch(entry)
+                self._evict(keep=digest)
+                self._save()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return False
+
+    def unchanged(self, video_id: str, url: str, etag: str = None, last_modified: str = None) -> bool:
+        """
+        Tell whether the cache holds the video with the given ETag or Last-Modified, e.g. from a probe, so fetching it
+        should be answered with 304 and take no disk space.
+        """
+        with self.lock:
+            entry = self.entries.get(f"{video_id} {url}")
+        if not entry or not os.path.exists(self._object_path(entry['sha256'])):
+            return False
+        return bool(etag and entry.get('etag') == etag
+                    or last_modified and entry.get('last_modified') == last_modified)
+
+    @staticmethod
+    def _touch(entry: dict):
+        entry['used'] = time.time()
+
+    def _own_size(self, digest: str) -> int:
+        """
+        Get the bytes only the cache holds for the content: none while a downloaded file still links to it.
+        """
+        try:
+            stat = os.stat(self._object_path(digest))
+        except OSError:
+            return 0
+        return stat.st_size if stat.st_nlink <= 1 else 0
+
+    def size(self) -> int:
+        """
+        Get the number of bytes on disk that only the cache holds, counting shared content once.
+        """
+        return sum(self._own_size(digest) for digest in {entry['sha256'] for entry in self.entries.values()})
+
+    def _evict(self, keep: str = None):
+        """
+        Remove the least recently used content only the cache holds until it fits the size limit. Content a downloaded
+        file links to stays, and the downloaded files themselves are never removed.
+        """
+        objects = {}
+        for key, entry in self.entries.items():
+            item = objects.setdefault(entry['sha256'], {'used': 0, 'keys': []})
+            item['used'] = max(item['used'], entry.get('used', 0))
+            item['keys'].append(key)
+        sizes = {digest: self._own_size(digest) for digest in objects}
+        total = sum(sizes.values())
+
+        for digest, item in sorted(objects.items(), key=lambda pair: pair[1]['used']):
+            if total <= self.max_size:
+                break
+            if digest == keep or not sizes[digest]:
+                continue
+            for key in item['keys']:
+                del self.entries[key]
+            os.remove(self._object_path(digest))
+            total -= sizes[digest]
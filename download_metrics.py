@@ -0,0 +1,335 @@
+"""
+Instrumentation for the download engines.
+
+Every download is tracked as a DownloadRecord holding its time to first byte, duration, bytes, throughput, retries,
+last HTTP status and outcome. Finished records are added to the histograms and counters of a DownloadMetrics
+registry and handed to its observers, e.g. a JsonLinesWriter logging one JSON object per download.
+
+The registry can be exported as Prometheus text, to be served or written where a node exporter picks it up, or as a
+JSON snapshot. Engines using a `requests` session get their HTTP status codes through a response hook carrying the
+token of the record, added to every request made through `record.session(session)`, so the download code itself only
+has to report bytes and errors.
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Bucket upper bounds: seconds, bytes and bytes per second
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 2 ** i for i in range(12))
+METRIC_PREFIX = 'video_download'
+# Tokens telling apart the records of downloads running at the same time, even of the same URL
+_tokens = itertools.count()
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, cumulative like a Prometheus one when exported.
+    """
+
+    def __init__(self, buckets: tuple):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """
+        Get (upper bound, count of values up to it) pairs, ending with the +Inf bucket.
+        """
+        pairs = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class DownloadRecord:
+    """
+    Timings and outcome of one download. Use it as a context manager around the download so it is finished and
+    handed to the registry whether the download succeeds or raises.
+    """
+
+    def __init__(self, metrics, url: str, engine: str, key: str = None):
+        self.metrics = metrics
+        self.url = url
+        self.engine = engine
+        self.key = key or url
+        self.token = next(_tokens)
+        self.started_at = time.time()
+        self.started = time.monotonic()
+        self.ttfb = None
+        self.duration = None
+        self.bytes = 0
+        self.retries = 0
+        self.status = None
+        self.error = None
+        self.outcome = None
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.metrics.start(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(exc)
+        return False
+
+    def session(self, session):
+        """
+        Get a view of a `requests` session whose responses reach this record, whatever URL they end up at.
+        """
+        return TrackedSession(session, self.metrics, self.token)
+
+    def response(self, status: int) -> None:
+        """
+        Note a response's status; the first response also ends the time to first byte.
+        """
+        self.status = status
+        if self.ttfb is None:
+            self.ttfb = time.monotonic() - self.started
+
+    def chunk(self, n_bytes: int) -> None:
+        with self.lock:
+            if self.ttfb is None:
+                self.ttfb = time.monotonic() - self.started
+            self.bytes += n_bytes
+
+    def wrap(self, on_chunk=None):
+        """
+        Get an on_chunk callback counting the bytes into the record before passing them on to `on_chunk`.
+        """
+        def counted(n_bytes):
+            self.chunk(n_bytes)
+            if on_chunk:
+                on_chunk(n_bytes)
+
+        return counted
+
+    def retry(self) -> None:
+        """
+        Start the download over, e.g. after a failed attempt; bytes count again from zero.
+        """
+        with self.lock:
+            self.retries += 1
+            self.bytes = 0
+
+    @property
+    def throughput(self):
+        return self.bytes / self.duration if self.duration else None
+
+    def finish(self, error: BaseException = None, outcome: str = None) -> None:
+        """
+        Stop the clock and hand the record to the registry. The outcome is worked out from the error and the status
+        unless given, e.g. as 'cancelled'.
+        """
+        if self.duration is not None:
+            return
+        self.duration = time.monotonic() - self.started
+        self.error = error
+        if outcome is not None:
+            self.outcome = outcome
+        elif error is not None:
+            self.outcome = 'error'
+        elif self.status is not None and self.status >= 400:
+            self.outcome = 'http_error'
+        else:
+            self.outcome = 'ok'
+        self.metrics.observe(self)
+
+    def as_dict(self) -> dict:
+        return {
+            'time': self.started_at,
+            'key': self.key,
+            'url': self.url,
+            'engine': self.engine,
+            'outcome': self.outcome,
+            'status': self.status,
+            'ttfb': self.ttfb,
+            'duration': self.duration,
+            'bytes': self.bytes,
+            'throughput': self.throughput,
+            'retries': self.retries,
+            'error': None if self.error is None else f'{type(self.error).__name__}: {self.error}',
+        }
+
+
+class TrackedSession:
+    """
+    A `requests` session adding a response hook with the token of one download to each of its requests. Anything
+    else is passed through to the session.
+    """
+
+    def __init__(self, session, metrics, token: int):
+        self.session = session
+        self.metrics = metrics
+        self.token = token
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def _on_response(self, res, *args, **kwargs):
+        self.metrics.on_response(self.token, res)
+
+    def request(self, method: str, url: str, **kwargs):
+        kwargs['hooks'] = {'response': self._on_response}
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url: str, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+
+class DownloadMetrics:
+    """
+    Thread-safe registry of download histograms and counters, labelled by engine.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {'ttfb_seconds': {}, 'duration_seconds': {}, 'size_bytes': {},
+                           'throughput_bytes_per_second': {}}
+        self.buckets = {'ttfb_seconds': TIME_BUCKETS, 'duration_seconds': TIME_BUCKETS, 'size_bytes': SIZE_BUCKETS,
+                        'throughput_bytes_per_second': THROUGHPUT_BUCKETS}
+        # Counters are keyed by their label values: (engine, outcome), (engine, status) and (engine,)
+        self.downloads = {}
+        self.responses = {}
+        self.retries = {}
+        self.bytes = {}
+        self.active = {}
+        self.observers = []
+
+    def track(self, url: str, engine: str, key: str = None) -> DownloadRecord:
+        return DownloadRecord(self, url, engine, key)
+
+    def add_observer(self, observer) -> None:
+        """
+        Call `observer(record)` with every finished DownloadRecord.
+        """
+        self.observers.append(observer)
+
+    def remove_observer(self, observer) -> None:
+        self.observers.remove(observer)
+
+    def on_response(self, token: int, res) -> None:
+        with self.lock:
+            record = self.active.get(token)
+        if record is not None:
+            record.response(res.status_code)
+
+    def start(self, record: DownloadRecord) -> None:
+        with self.lock:
+            self.active[record.token] = record
+
+    def observe(self, record: DownloadRecord) -> None:
+        engine = record.engine
+        values = {'ttfb_seconds': record.ttfb, 'duration_seconds': record.duration, 'size_bytes': record.bytes,
+                  'throughput_bytes_per_second': record.throughput}
+        with self.lock:
+            self.active.pop(record.token, None)
+            for name, value in values.items():
+                if value is None:
+                    continue
+                histograms = self.histograms[name]
+                if engine not in histograms:
+                    histograms[engine] = Histogram(self.buckets[name])
+                histograms[engine].observe(value)
+            _add(self.downloads, (engine, record.outcome))
+            if record.status is not None:
+                _add(self.responses, (engine, str(record.status)))
+            _add(self.retries, (engine,), record.retries)
+            _add(self.bytes, (engine,), record.bytes)
+        for observer in list(self.observers):
+            observer(record)
+
+    def snapshot(self) -> dict:
+        """
+        Get every metric as plain data, ready to be dumped as JSON.
+        """
+        with self.lock:
+            return {
+                'histograms': {name: {engine: {'buckets': [[bound, count] for bound, count in hist.cumulative()[:-1]],
+                                               'sum': hist.sum, 'count': hist.count}
+                                      for engine, hist in histograms.items()}
+                               for name, histograms in self.histograms.items()},
+                'downloads': [{'engine': engine, 'outcome': outcome, 'count': count}
+                              for (engine, outcome), count in self.downloads.items()],
+                'responses': [{'engine': engine, 'status': status, 'count': count}
+                              for (engine, status), count in self.responses.items()],
+                'retries': {engine: count for (engine,), count in self.retries.items()},
+                'bytes': {engine: count for (engine,), count in self.bytes.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        Export every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for name, histograms in self.histograms.items():
+                metric = f'{METRIC_PREFIX}_{name}'
+                lines.append(f'# TYPE {metric} histogram')
+                for engine, hist in sorted(histograms.items()):
+                    for bound, count in hist.cumulative():
+                        le = '+Inf' if bound == float('inf') else repr(float(bound))
+                        lines.append(f'{metric}_bucket{{engine="{_escape(engine)}",le="{le}"}} {count}')
+                    lines.append(f'{metric}_sum{{engine="{_escape(engine)}"}} {hist.sum!r}')
+                    lines.append(f'{metric}_count{{engine="{_escape(engine)}"}} {hist.count}')
+            for name, counters, labels in (('total', self.downloads, ('engine', 'outcome')),
+                                           ('responses_total', self.responses, ('engine', 'status')),
+                                           ('retries_total', self.retries, ('engine',)),
+                                           ('bytes_total', self.bytes, ('engine',))):
+                metric = f'{METRIC_PREFIX}_{name}'
+                lines.append(f'# TYPE {metric} counter')
+                for values, count in sorted(counters.items()):
+                    label_text = ','.join(f'{label}="{_escape(value)}"' for label, value in zip(labels, values))
+                    lines.append(f'{metric}{{{label_text}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str) -> None:
+        """
+        Write the Prometheus text to a file atomically, e.g. for the node exporter's textfile collector.
+        """
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+class JsonLinesWriter:
+    """
+    Observer appending every finished download to a file as one line of JSON.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, record: DownloadRecord) -> None:
+        line = json.dumps(record.as_dict(), ensure_ascii=False)
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+def _add(counters: dict, key: tuple, amount: int = 1) -> None:
+    counters[key] = counters.get(key, 0) + amount
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,159 @@
+"""
+Pre-flight metadata probe for batch downloads.
+
+Before a batch starts, every URL is asked for its size, byte range support and ETag with a concurrent HEAD request,
+falling back to a GET of the first byte for servers that do not answer HEAD properly. The answers are kept per URL in
+a small JSON file inside the download folder, so probing the same videos again within PROBE_MAX_AGE costs nothing.
+
+With the sizes known up front, a batch can check there is enough free disk space, show its progress in bytes and
+start the smallest videos first.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+
+from download_cache import CACHE_FOLDER
+
+PROBE_WORKERS = 32
+PROBE_TIMEOUT = 10
+# Seconds a probe result is trusted for
+PROBE_MAX_AGE = 3600
+# Space to leave free on the disk on top of the batch
+DISK_MARGIN = 64 * 1024 * 1024
+
+
+class DiskSpaceError(OSError):
+    """
+    Raised when the disk cannot hold a batch of downloads.
+    """
+
+    def __init__(self, folder: str, needed: int, free: int, margin: int = 0):
+        super().__init__(f"There is NOT enough free disk space in {folder}: {needed / 1024 ** 2:.1f} MB are needed "
+                         f"with {margin / 1024 ** 2:.1f} MB to spare, but only {free / 1024 ** 2:.1f} MB are free!")
+        self.folder = folder
+        self.needed = needed
+        self.free = free
+
+
+def probe_url(url: str, session=None) -> dict:
+    """
+    Get the size, byte range support, ETag and Last-Modified of the file behind the URL, without its body.
+    The size is 0 when the server does not tell, and 'error' is set when the URL cannot be reached.
+    """
+    import requests
+
+    session = session or requests
+    info = {'size': 0, 'accepts_ranges': False, 'etag': None, 'last_modified': None, 'status': None,
+            'error': None, 'probed': time.time()}
+    try:
+        res = session.head(url, allow_redirects=True, timeout=PROBE_TIMEOUT)
+        size = int(res.headers.get('Content-Length') or 0) if res.status_code < 400 else 0
+        accepts_ranges = res.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        if not size:
+            # Some servers refuse HEAD or leave the length out; the first byte of a range tells the full size
+            res = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=PROBE_TIMEOUT)
+            res.close()
+            if res.status_code == 206:
+                total = res.headers.get('Content-Range', '').rpartition('/')[2]
+                size = int(total) if total.isdigit() else 0
+                accepts_ranges = True
+            elif res.status_code == 200:
+                size = int(res.headers.get('Content-Length') or 0)
+                accepts_ranges = False
+    except Exception as e:
+        info['error'] = f'{type(e).__name__}: {e}'
+        return info
+    info.update(size=size, accepts_ranges=accepts_ranges and size > 0, etag=res.headers.get('ETag'),
+                last_modified=res.headers.get('Last-Modified'), status=res.status_code)
+    return info
+
+
+class ProbeCache:
+    """
+    Probe results per URL, saved as JSON in the hidden cache folder of the download folder.
+    """
+
+    def __init__(self, folder: str = 'files', max_age: float = PROBE_MAX_AGE):
+        self.path = os.path.join(folder, CACHE_FOLDER, 'probe.json')
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, url: str):
+        """
+        Get the probe result of the URL, or None if it was never probed or is too old to trust.
+        """
+        with self.lock:
+            info = self.entries.get(url)
+        if info is None or info.get('error') or time.time() - info.get('probed', 0) > self.max_age:
+            return None
+        return info
+
+    def put(self, url: str, info: dict) -> None:
+        with self.lock:
+            self.entries[url] = info
+
+    def save(self) -> None:
+        with self.lock:
+            # Drop stale results so the file does not grow with every batch ever probed
+            now = time.time()
+            self.entries = {url: info for url, info in self.entries.items()
+                            if now - info.get('probed', 0) <= self.max_age}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+
+
+def probe_all(urls: list, session=None, workers: int = PROBE_WORKERS, cache: ProbeCache = None) -> dict:
+    """
+    Probe the URLs concurrently and map each one to its probe_url result. URLs with a fresh result in the cache are
+    not probed again, and the new results are saved to it.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    import requests
+
+    results = {}
+    todo = []
+    for url in dict.fromkeys(urls):
+        info = cache.get(url) if cache is not None else None
+        if info is None:
+            todo.append(url)
+        else:
+            results[url] = info
+    if not todo:
+        return results
+
+    workers = max(1, min(workers, len(todo)))
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    with ThreadPool(processes=workers) as pool:
+        for url, info in zip(todo, pool.imap(lambda url: probe_url(url, session), todo)):
+            results[url] = info
+            if cache is not None:
+                cache.put(url, info)
+    if cache is not None:
+        cache.save()
+    return results
+
+
+def check_disk_space(folder: str, needed: int, margin: int = DISK_MARGIN) -> None:
+    """
+    Raise DiskSpaceError if the disk holding the folder has less than the needed bytes free, keeping a margin.
+    """
+    os.makedirs(folder, exist_ok=True)
+    free = shutil.disk_usage(folder).free
+    if needed + margin > free:
+        raise DiskSpaceError(folder, needed, free, margin)
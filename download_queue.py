@@ -0,0 +1,340 @@
+"""
+Headless bulk downloader with a persistent job queue.
+
+Video IDs are read from a manifest file, or from stdin, and queued in a local SQLite database together with their URL
+and destination path. Every job is pending, running, done or failed, and counts its attempts:
+    - a failed attempt puts the job back to pending with an exponentially growing delay, until it runs out of attempts;
+    - running jobs keep a heartbeat, so the jobs of a process that died are picked up again once it goes stale;
+    - segmented downloads keep their state files next to the destination, so a restarted job resumes its bytes.
+Stopping with Ctrl+C hands the running jobs back straight away. Running the same command again carries on where the
+last run stopped, so a large pull can run unattended and survive restarts; several processes can share one queue.
+
+Usage: python download_queue.py manifest.txt --db downloads.db --workers 16 --segments 4
+"""
+
+import argparse
+import os
+import queue
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+from download_metrics import DownloadMetrics
+from download_scheduler import DownloadScheduler
+from video_catalogue import load_catalogue
+from video_integrity import CHECKSUM_SUFFIX, checksum_of, load_checksums
+
+STATES = ('pending', 'running', 'done', 'failed')
+# Seconds after which a running job without a heartbeat is given to another runner
+LEASE = 60
+HEARTBEAT_INTERVAL = 15
+REPORT_INTERVAL = 10
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    video_id TEXT PRIMARY KEY,
+    url TEXT,
+    dest_path TEXT,
+    checksum TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    owner TEXT,
+    heartbeat REAL,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, next_attempt);
+'''
+
+
+def read_manifest(f) -> list:
+    """
+    Get the video IDs from a manifest: one or more per line, separated by commas. Blank lines and lines starting with
+    '#' are skipped, and so are repeated IDs.
+    """
+    video_ids = {}
+    for line in f:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        for video_id in line.split(','):
+            video_id = video_id.strip()
+            if video_id:
+                video_ids[video_id] = None
+    return list(video_ids)
+
+
+class JobQueue:
+    """
+    Download jobs kept in SQLite. Only use an instance from the thread that created it.
+    """
+
+    def __init__(self, path: str = 'downloads.db'):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        # WAL lets other runners and status checks read while a runner writes
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        # Queues created before checksums were verified lack their column
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(jobs)')]
+        if 'checksum' not in columns:
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN checksum TEXT')
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def add(self, jobs: list, missing: list = ()) -> int:
+        """
+        Queue (video_id, url, dest_path, checksum) jobs, and record the IDs not found in the catalogue as failed. IDs
+        already in the queue are left as they are. Return the number of jobs added.
+        """
+        now = time.time()
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.executemany('INSERT OR IGNORE INTO jobs (video_id, url, dest_path, checksum, updated) '
+                                  'VALUES (?, ?, ?, ?, ?)', [job + (now,) for job in jobs])
+            self.conn.executemany("INSERT OR IGNORE INTO jobs (video_id, state, error, updated) "
+                                  "VALUES (?, 'failed', 'Video ID NOT found!', ?)",
+                                  [(video_id, now) for video_id in missing])
+            return self.conn.total_changes - before
+
+    def claim(self, limit: int, owner: str) -> list:
+        """
+        Mark up to `limit` pending jobs that are due as running for the owner, in manifest order, and return them as
+        (video_id, url, dest_path, checksum, attempts) rows.
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            rows = self.conn.execute("SELECT video_id, url, dest_path, checksum, attempts + 1 FROM jobs "
+                                     "WHERE state = 'pending' AND next_attempt <= ? ORDER BY rowid LIMIT ?",
+                                     (now, limit)).fetchall()
+            self.conn.executemany("UPDATE jobs SET state = 'running', attempts = attempts + 1, owner = ?, "
+                                  "heartbeat = ?, updated = ? WHERE video_id = ?",
+                                  [(owner, now, now, row[0]) for row in rows])
+        return rows
+
+    def finish(self, video_id: str, error: str = None, max_attempts: int = 5, backoff: float = 2.0,
+               max_backoff: float = 600.0) -> str:
+        """
+        Record the end of an attempt and return the new state of the job. A failed attempt is retried after
+        backoff * 2 ** (attempts - 1) seconds, capped at max_backoff, until max_attempts is reached.
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            attempts, = self.conn.execute('SELECT attempts FROM jobs WHERE video_id = ?', (video_id,)).fetchone()
+            if error is None:
+                state, next_attempt = 'done', 0
+            elif attempts >= max_attempts:
+                state, next_attempt = 'failed', 0
+            else:
+                state, next_attempt = 'pending', now + min(max_backoff, backoff * 2 ** (attempts - 1))
+            self.conn.execute('UPDATE jobs SET state = ?, next_attempt = ?, error = ?, owner = NULL, updated = ? '
+                              'WHERE video_id = ?', (state, next_attempt, error, now, video_id))
+        return state
+
+    def heartbeat(self, owner: str) -> None:
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET heartbeat = ? WHERE state = 'running' AND owner = ?",
+                              (time.time(), owner))
+
+    def release(self, owner: str) -> None:
+        """
+        Hand the running jobs of the owner back to the queue without counting their attempts.
+        """
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET state = 'pending', attempts = MAX(0, attempts - 1), owner = NULL "
+                              "WHERE state = 'running' AND owner = ?", (owner,))
+
+    def recover(self, lease: float = LEASE) -> int:
+        """
+        Put running jobs whose heartbeat is older than the lease back to pending, e.g. after their runner crashed.
+        Return the number of jobs recovered.
+        """
+        with self.conn:
+            return self.conn.execute("UPDATE jobs SET state = 'pending', owner = NULL "
+                                     "WHERE state = 'running' AND heartbeat < ?", (time.time() - lease,)).rowcount
+
+    def retry_failed(self) -> int:
+        """
+        Give the failed jobs a fresh set of attempts. IDs missing from the catalogue stay failed.
+        """
+        with self.conn:
+            return self.conn.execute("UPDATE jobs SET state = 'pending', attempts = 0, next_attempt = 0, error = NULL "
+                                     "WHERE state = 'failed' AND url IS NOT NULL").rowcount
+
+    def counts(self) -> dict:
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self.conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+        return counts
+
+    def next_due(self):
+        """
+        Get the time the next pending job is due, or None if nothing is pending.
+        """
+        due, = self.conn.execute("SELECT MIN(next_attempt) FROM jobs WHERE state = 'pending'").fetchone()
+        return due
+
+    def failures(self, limit: int = 20) -> list:
+        return self.conn.execute("SELECT video_id, attempts, error FROM jobs WHERE state = 'failed' ORDER BY rowid "
+                                 "LIMIT ?", (limit,)).fetchall()
+
+
+def enqueue(job_queue: JobQueue, video_ids: list, videos, download_folder: str, checksums: dict = None) -> int:
+    """
+    Queue the videos under timestamped destination paths, like the interactive managers name their downloads,
+    together with their expected checksums.
+    """
+    found, missing = videos.get_many(video_ids)
+    os.makedirs(download_folder, exist_ok=True)
+    stamp = time.strftime('%Y-%m-%d-%H-%M-%S')
+    jobs = [(video_id, video_info[2], os.path.join(download_folder, f"{video_id}-{stamp}.mp4"),
+             checksum_of(video_info, checksums)) for video_id, video_info in found.items()]
+    return job_queue.add(jobs, missing)
+
+
+def run_queue(job_queue: JobQueue, workers: int = 8, per_host: int = 4, segments: int = 0, max_attempts: int = 5,
+              backoff: float = 2.0, max_backoff: float = 600.0, metrics: DownloadMetrics = None, log=print,
+              report_interval: float = REPORT_INTERVAL) -> dict:
+    """
+    Download queued jobs until none are pending or running, and return the final counts.
+    """
+    owner = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+    metrics = metrics or DownloadMetrics()
+    results = queue.Queue()
+    in_flight = {}
+    last_heartbeat = last_report = time.monotonic()
+
+    def record_results(wait: float = 0):
+        """
+        Record every job the scheduler has ended since the last call, waiting up to `wait` seconds for the first one.
+        """
+        while True:
+            try:
+                job = results.get(timeout=wait) if wait else results.get_nowait()
+            except queue.Empty:
+                return
+            wait = 0
+            # A cancelled job is still running in the queue and is handed back below
+            if job.status == 'cancelled':
+                continue
+            error = f'{type(job.error).__name__}: {job.error}' if job.error else None
+            state = job_queue.finish(job.key, error, max_attempts, backoff, max_backoff)
+            del in_flight[job.key]
+            if error and log:
+                log(f"Failed to download video {job.key} ({state}): {error}")
+
+    job_queue.recover()
+    scheduler = DownloadScheduler(workers=workers, per_host=per_host, metrics=metrics)
+    try:
+        while True:
+            # Keep the workers busy with a small backlog of claimed jobs, leaving the rest to other runners
+            free = 2 * workers - len(in_flight)
+            if free > 0:
+                for video_id, url, dest_path, checksum, attempts in job_queue.claim(free, owner):
+                    in_flight[video_id] = scheduler.submit(url, dest_path, segments=segments, key=video_id,
+                                                           on_done=results.put, checksum=checksum)
+
+            if not in_flight:
+                due = job_queue.next_due()
+                if due is None:
+                    job_queue.recover()
+                    if job_queue.next_due() is None and not job_queue.counts()['running']:
+                        break
+                    due = time.time() + HEARTBEAT_INTERVAL
+                time.sleep(min(max(0.0, due - time.time()), HEARTBEAT_INTERVAL))
+            else:
+                record_results(wait=1)
+
+            now = time.monotonic()
+            if now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                job_queue.heartbeat(owner)
+                last_heartbeat = now
+            if log and now - last_report >= report_interval:
+                log(_format_counts(job_queue.counts()))
+                last_report = now
+    finally:
+        for job in in_flight.values():
+            job.cancel()
+        scheduler.close()
+        # Jobs that ended before they were recorded must not go back to pending and be downloaded again
+        record_results()
+        job_queue.release(owner)
+    return job_queue.counts()
+
+
+def _format_counts(counts: dict) -> str:
+    return ', '.join(f'{state}: {counts[state]}' for state in STATES)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Download the videos listed in a manifest through a persistent queue.')
+    parser.add_argument('manifest', nargs='?', default='-',
+                        help="file of video IDs, one or more per line separated by ','; '-' reads stdin")
+    parser.add_argument('--db', default='downloads.db', help='SQLite file holding the job queue')
+    parser.add_argument('--catalogue', default='video.csv', help='CSV file of the video catalogue')
+    parser.add_argument('--catalogue-db', help='SQLite catalogue imported from the CSV by video_db.py, to use instead')
+    parser.add_argument('--folder', default='files', help='folder to save the videos in')
+    parser.add_argument('--workers', type=int, default=8, help='number of concurrent downloads')
+    parser.add_argument('--per-host', type=int, default=4, help='connections allowed to any one host')
+    parser.add_argument('--segments', type=int, default=0, help='byte ranges per video; resumable when set')
+    parser.add_argument('--max-attempts', type=int, default=5, help='attempts before a video counts as failed')
+    parser.add_argument('--backoff', type=float, default=2.0, help='seconds to wait before the first retry')
+    parser.add_argument('--max-backoff', type=float, default=600.0, help='longest wait between retries in seconds')
+    parser.add_argument('--retry-failed', action='store_true', help='give failed videos a fresh set of attempts')
+    parser.add_argument('--status', action='store_true', help='only show the state of the queue')
+    parser.add_argument('--metrics', help='write Prometheus metrics of the run to this file when it ends')
+    args = parser.parse_args()
+
+    job_queue = JobQueue(args.db)
+    try:
+        if args.status:
+            print(_format_counts(job_queue.counts()))
+            return
+        if args.retry_failed:
+            print(f'{job_queue.retry_failed()} failed videos will be tried again.')
+        # A resumed run needs no manifest: the queue remembers what is left
+        if args.manifest != '-' or not sys.stdin.isatty():
+            if args.manifest == '-':
+                video_ids = read_manifest(sys.stdin)
+            else:
+                with open(args.manifest, 'r', encoding='utf-8') as f:
+                    video_ids = read_manifest(f)
+            if video_ids:
+                if args.catalogue_db:
+                    from video_db import load_catalogue_db
+
+                    videos = load_catalogue_db(args.catalogue_db, args.catalogue)
+                else:
+                    videos = load_catalogue(args.catalogue)
+                added = enqueue(job_queue, video_ids, videos, args.folder,
+                                load_checksums(args.catalogue + CHECKSUM_SUFFIX))
+                print(f'{added} of {len(video_ids)} videos were added to the queue.')
+
+        metrics = DownloadMetrics()
+        try:
+            counts = run_queue(job_queue, args.workers, args.per_host, args.segments, args.max_attempts,
+                               args.backoff, args.max_backoff, metrics)
+        except KeyboardInterrupt:
+            print('Stopped. Run the same command again to carry on.')
+            sys.exit(130)
+        finally:
+            if args.metrics:
+                metrics.write_prometheus(args.metrics)
+        print(_format_counts(counts))
+        for video_id, attempts, error in job_queue.failures():
+            print(f"Failed to download video {video_id} after {attempts} attempts: {error}")
+        if counts['failed']:
+            sys.exit(1)
+    finally:
+        job_queue.close()
+
+
+if __name__ == '__main__':
+    main()
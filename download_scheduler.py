@@ -0,0 +1,346 @@
+"""
+Download scheduler shared by the Blue and Red video managers.
+
+Jobs wait in a priority queue and are started by a fixed set of worker threads:
+    - lower priority numbers go first, and within a priority the smallest known size goes first;
+    - no host gets more than `per_host` connections at a time;
+    - token buckets cap the total bandwidth and the bandwidth of every single host;
+    - with a DownloadCache, single-stream jobs are revalidated against and stored in the cache;
+    - failed jobs are retried up to `retries` times, waiting twice as long before every new attempt;
+    - jobs with a checksum are verified as they stream, and a file failing verification is quarantined and fetched
+      again even without retries;
+    - with a DownloadMetrics registry, every job is recorded with its timings, bytes, retries and HTTP status.
+Running jobs can be paused, resumed and cancelled from any thread.
+"""
+
+import heapq
+import itertools
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from video_download import download_resumable
+from video_integrity import REFETCH_ATTEMPTS, IntegrityError, fetch_verified, verify_file
+
+# Seconds to wait before the first retry of a failed job
+RETRY_DELAY = 1.0
+
+
+class DownloadCancelled(Exception):
+    """
+    Raised inside a download when its job has been cancelled.
+    """
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket handing out `rate` bytes per second with bursts of up to `burst` bytes.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n_bytes: int) -> None:
+        """
+        Take n_bytes from the bucket, sleeping until enough have been refilled.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Go into debt instead of refusing chunks larger than the burst, then sleep it off
+            self.tokens -= n_bytes
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class DownloadJob:
+    """
+    One file to download, as queued in a DownloadScheduler.
+    """
+
+    def __init__(self, url: str, dest_path: str, priority: int = 0, size: int = None, segments: int = 0,
+                 on_chunk=None, on_done=None, key: str = None, checksum: str = None):
+        self.url = url
+        self.checksum = checksum
+        self.key = key or url
+        self.dest_path = dest_path
+        self.priority = priority
+        self.size = size
+        self.segments = segments
+        self.on_chunk = on_chunk
+        self.on_done = on_done
+        self.host = urlsplit(url).netloc
+        self.status = 'pending'
+        self.attempts = 0
+        self.error = None
+        self.bytes_done = 0
+        self.cached = False
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.unpaused = threading.Event()
+        self.unpaused.set()
+        self.finished = threading.Event()
+
+    def __repr__(self):
+        return f"DownloadJob({self.url!r}, {self.status})"
+
+    @property
+    def connections(self) -> int:
+        return max(1, self.segments)
+
+    def pause(self) -> None:
+        """
+        Hold the transfer after its current chunk until it is resumed. The connection is kept open meanwhile.
+        """
+        self.unpaused.clear()
+
+    def resume(self) -> None:
+        self.unpaused.set()
+
+    def cancel(self) -> None:
+        """
+        Stop the job at its next chunk, or drop it if it has not started yet.
+        """
+        self.cancelled = True
+        self.unpaused.set()
+
+    def wait(self, timeout: float = None) -> str:
+        """
+        Block until the job ends. Return the destination path or raise the error the download failed with.
+        """
+        self.finished.wait(timeout)
+        if self.error:
+            raise self.error
+        return self.dest_path
+
+
+class DownloadScheduler:
+    """
+    Run download jobs on worker threads under per-host connection limits and bandwidth caps.
+    """
+
+    def __init__(self, workers: int = 8, per_host: int = 4, bandwidth: float = None, host_bandwidth: float = None,
+                 session=None, cache=None, retries: int = 0, metrics=None):
+        import requests
+
+        self.workers = workers
+        self.per_host = per_host
+        self.bandwidth = TokenBucket(bandwidth) if bandwidth else None
+        self.host_bandwidth = host_bandwidth
+        self.host_buckets = {}
+        self.host_connections = {}
+        if session is None:
+            # Keep enough pooled connections for every worker so none are thrown away after use
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=max(workers, per_host))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.cache = cache
+        self.retries = retries
+        self.metrics = metrics
+        self.queue = []
+        self.running = 0
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, url: str, dest_path: str, priority: int = 0, size: int = None, segments: int = 0,
+               on_chunk=None, on_done=None, key: str = None, checksum: str = None) -> DownloadJob:
+        """
+        Queue a download and start the workers if needed. `on_done(job)` is called when it ends, failed or not.
+        `on_chunk(n_bytes)` is called as bytes arrive, and with a negative count to take back the bytes of an attempt
+        that failed and is retried from the start.
+        `key` names the job in the download cache, e.g. the video ID; it defaults to the URL.
+        `checksum` is the expected checksum of the file, as understood by video_integrity.parse_checksum.
+        """
+        job = DownloadJob(url, dest_path, priority, size, segments, on_chunk, on_done, key, checksum)
+        # Shortest job first within a priority; unknown sizes go after the known ones, in submission order
+        key = (priority, size if size is not None else float('inf'), next(self.counter))
+        with self.condition:
+            heapq.heappush(self.queue, (key, job))
+            self.condition.notify()
+        self._start_workers()
+        return job
+
+    def join(self) -> None:
+        """
+        Wait until every queued job has ended.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: not self.queue and not self.running)
+
+    def close(self) -> None:
+        """
+        Stop the workers once they finish their current jobs. Jobs still queued are dropped and end as cancelled.
+        """
+        with self.condition:
+            self.closed = True
+            dropped = [job for _, job in self.queue]
+            self.queue = []
+            self.condition.notify_all()
+        for job in dropped:
+            job.cancelled = True
+            job.status = 'cancelled'
+            job.error = DownloadCancelled(f'The download of {job.url} was dropped when the scheduler closed!')
+            job.finished.set()
+        for job in dropped:
+            self._done(job)
+        for thread in self.threads:
+            thread.join()
+
+    @staticmethod
+    def _done(job: DownloadJob) -> None:
+        """
+        Call the job's on_done callback. An error it raises is reported but does not stop the worker.
+        """
+        if job.on_done:
+            try:
+                job.on_done(job)
+            except Exception:
+                sys.excepthook(*sys.exc_info())
+
+    def _start_workers(self):
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _next_job(self):
+        """
+        Pop the best queued job whose host has a free connection, or None if no job can start yet.
+        """
+        skipped = []
+        job = None
+        while self.queue:
+            key, candidate = heapq.heappop(self.queue)
+            # A segmented job wanting more connections than the limit may still run alone on its host
+            used = self.host_connections.get(candidate.host, 0)
+            if used == 0 or used + candidate.connections <= self.per_host:
+                job = candidate
+                break
+            skipped.append((key, candidate))
+        for item in skipped:
+            heapq.heappush(self.queue, item)
+        return job
+
+    def _work(self):
+        while True:
+            with self.condition:
+                job = None
+                while not self.closed:
+                    job = self._next_job()
+                    if job:
+                        break
+                    self.condition.wait()
+                if self.closed:
+                    return
+                self.running += 1
+                self.host_connections[job.host] = self.host_connections.get(job.host, 0) + job.connections
+                if self.host_bandwidth and job.host not in self.host_buckets:
+                    self.host_buckets[job.host] = TokenBucket(self.host_bandwidth)
+
+            try:
+                self._run(job)
+                self._done(job)
+            finally:
+                with self.condition:
+                    self.running -= 1
+                    self.host_connections[job.host] -= job.connections
+                    self.condition.notify_all()
+
+    def _run(self, job: DownloadJob):
+        host_bucket = self.host_buckets.get(job.host)
+
+        def on_size(size):
+            job.size = size
+
+        def on_resume(n_bytes):
+            # Bytes a resumed download already has count towards the progress, but were not transferred now
+            with job.lock:
+                job.bytes_done += n_bytes
+            if job.on_chunk:
+                job.on_chunk(n_bytes)
+
+        def on_chunk(n_bytes):
+            if not job.unpaused.is_set():
+                job.status = 'paused'
+                job.unpaused.wait()
+                job.status = 'running'
+            if job.cancelled:
+                raise DownloadCancelled(f'The download of {job.url} was cancelled!')
+            with job.lock:
+                job.bytes_done += n_bytes
+            if record:
+                record.chunk(n_bytes)
+            if self.bandwidth:
+                self.bandwidth.consume(n_bytes)
+            if host_bucket:
+                host_bucket.consume(n_bytes)
+            if job.on_chunk:
+                job.on_chunk(n_bytes)
+
+        if job.cancelled:
+            job.status = 'cancelled'
+            job.error = DownloadCancelled(f'The download of {job.url} was cancelled!')
+            job.finished.set()
+            return
+
+        use_cache = self.cache is not None and not job.segments
+        engine = 'cache' if use_cache else 'segmented' if job.segments else 'stream'
+        record = self.metrics.track(job.url, engine, job.key) if self.metrics is not None else None
+        session = self.session
+        if record:
+            self.metrics.start(record)
+            session = record.session(session)
+        job.status = 'running'
+        try:
+            while True:
+                job.attempts += 1
+                try:
+                    self._attempt(job, session, use_cache, on_chunk, on_size, on_resume)
+                    job.error = None
+                    break
+                except Exception as e:
+                    job.error = e
+                    limit = max(self.retries, REFETCH_ATTEMPTS) if isinstance(e, IntegrityError) else self.retries
+                    if job.cancelled or job.attempts > limit:
+                        break
+                # Back off before trying again; a resumable download carries on from its completed bytes
+                time.sleep(RETRY_DELAY * 2 ** (job.attempts - 1))
+                # The attempt starts counting from zero, so take back the bytes already reported to the caller
+                with job.lock:
+                    reported, job.bytes_done = job.bytes_done, 0
+                if reported and job.on_chunk:
+                    job.on_chunk(-reported)
+                if record:
+                    record.retry()
+            job.status = 'cancelled' if job.cancelled and job.error else 'failed' if job.error else 'done'
+        finally:
+            if record:
+                record.finish(job.error, 'cancelled' if job.status == 'cancelled' else None)
+            job.finished.set()
+
+    def _attempt(self, job: DownloadJob, session, use_cache: bool, on_chunk, on_size, on_resume):
+        if use_cache:
+            job.cached = self.cache.fetch(job.key, job.url, job.dest_path, session, on_chunk, job.checksum)
+        elif job.segments:
+            download_resumable(job.url, job.dest_path, job.segments, session, on_chunk, on_size, on_resume)
+            if job.checksum:
+                verify_file(job.dest_path, job.checksum)
+        else:
+            fetch_verified(job.url, job.dest_path, job.checksum, session, on_chunk, on_size)
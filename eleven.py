@@ -2,20 +2,36 @@
 # -*- coding: utf-8 -*-
 
 import random
+from array import array
+from collections import namedtuple
+from collections.abc import MutableSequence
+
+# A step of a game: kind is 'start', 'draw', 'bust', 'hit', 'stand' or 'end'. The data is the list of players at the
+# start, the card drawn, the score a player stands on, or the sorted scores at the end
+Event = namedtuple('Event', ['kind', 'player', 'data'])
+
+
+SUITS = ('Diamonds', 'Clubs', 'Hearts', 'Spades')
+RANKS = tuple(str(i) for i in range(2, 11)) + ('J', 'Q', 'K', 'A')
+COLOURS = ('Red', 'Black')
+VALID_SUITS = frozenset(SUITS + ('',))
+VALID_RANKS = frozenset(RANKS + ('Joker',))
+VALID_COLOURS = frozenset(COLOURS)
+RANK_VALUES = {**{str(i): i for i in range(2, 11)}, 'J': 0.5, 'Q': 0.5, 'K': 0.5, 'Joker': 0.5, 'A': 1}
 
 
 class Card:
+    """
+    A playing card. The 54 in CARDS are shared by every deck, so they cannot be changed; any other card can.
+    """
+    __slots__ = ('_suit', '_rank', '_val', '_name', '_shared')
 
     def __init__(self, suit: str, rank: str):
+        self._shared = False
         self.suit = suit
         self.rank = rank
-        if self.rank in ['J', 'Q', 'K', 'Joker']:
-            self.val = 0.5
-        elif self.rank == 'A':
-            self.val = 1
-        else:
-            self.val = int(self.rank)
-        self.name = self.suit + ' ' + self.rank
+        self._val = RANK_VALUES[self._rank]
+        self._name = self._suit + ' ' + self._rank
 
     def __repr__(self):
         return f'Card(\'{self.name}\', Value: {self.val})'
@@ -26,17 +42,20 @@ class Card:
     def show(self):
         print(self.__repr__())
 
+    def _check_shared(self):
+        if self._shared:
+            raise AttributeError(f"The card '{self._name}' is shared by every deck and cannot be changed")
+
     @property
     def suit(self):
         return self._suit
 
     @suit.setter
     def suit(self, suit):
-        if suit.capitalize() in ['Diamonds', 'Clubs', 'Hearts', 'Spades', '']:
-            self._suit = suit.capitalize()
-        else:
+        self._check_shared()
+        if suit.capitalize() not in VALID_SUITS:
             raise Exception('The suit is INVALID!')
-        return self._suit
+        self._suit = suit.capitalize()
 
     @property
     def rank(self):
@@ -44,19 +63,37 @@ class Card:
 
     @rank.setter
     def rank(self, rank):
-        valid_rank = [str(i) for i in list(range(2, 11))] + ['J', 'Q', 'K', 'A', 'Joker']
-        if str(rank) in valid_rank:
-            self._rank = str(rank)
-        else:
+        self._check_shared()
+        if str(rank) not in VALID_RANKS:
             raise Exception('The rank is INVALID!')
-        return self._rank
+        self._rank = str(rank)
+
+    @property
+    def val(self):
+        return self._val
+
+    @val.setter
+    def val(self, val):
+        self._check_shared()
+        self._val = val
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._check_shared()
+        self._name = name
 
 
 class JokerCard(Card):
+    __slots__ = ('_colour',)
+
     def __init__(self, colour):
-        self.colour = colour
         super().__init__('', "Joker")
-        self.name = f'Joker {self.colour}'
+        self.colour = colour
+        self._name = f'Joker {self._colour}'
 
     @property
     def colour(self):
@@ -64,17 +101,98 @@ class JokerCard(Card):
 
     @colour.setter
     def colour(self, colour):
-        if colour.capitalize() in ['Red', 'Black']:
-            self._colour = colour.capitalize()
-        else:
+        self._check_shared()
+        if colour.capitalize() not in VALID_COLOURS:
             raise Exception('The colour is INVALID!')
-        return self._colour
+        self._colour = colour.capitalize()
+
+
+# The 54 cards, created once and shared by every deck, which only shuffles their indices
+CARDS = tuple([Card(suit, rank) for suit in SUITS for rank in RANKS] + [JokerCard(colour) for colour in COLOURS])
+for _card in CARDS:
+    _card._shared = True
+del _card
+CARD_VALUES = tuple(card.val for card in CARDS)
+CARD_INDEX = {card.name: index for index, card in enumerate(CARDS)}
+FULL_DECK = array('B', range(len(CARDS)))
+
+
+class DeckCards(MutableSequence):
+    """
+    Live list of the cards left in a deck, the top one last. Changing it changes the deck, e.g. deck.cards.pop()
+    takes the top card, as it did when the deck kept its cards in a list.
+    """
+    __slots__ = ('deck',)
+
+    def __init__(self, deck):
+        self.deck = deck
+
+    def __len__(self):
+        return self.deck.count
+
+    def __iter__(self):
+        return (CARDS[index] for index in self.deck.order[:self.deck.count])
+
+    def __eq__(self, other):
+        if isinstance(other, (DeckCards, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def _position(self, index: int) -> int:
+        if index < 0:
+            index += self.deck.count
+        if not 0 <= index < self.deck.count:
+            raise IndexError('deck index out of range')
+        return index
+
+    def _edit(self, change) -> None:
+        """
+        Apply a change to a copy of the indices left and put it back, for the slice operations.
+        """
+        order = self.deck.order[:self.deck.count]
+        change(order)
+        self.deck.order[:self.deck.count] = order
+        self.deck.count = len(order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [CARDS[i] for i in self.deck.order[:self.deck.count][index]]
+        return CARDS[self.deck.order[self._position(index)]]
+
+    def __setitem__(self, index, card):
+        if isinstance(index, slice):
+            indices = array('B', (CARD_INDEX[c.name] for c in card))
+            self._edit(lambda order: order.__setitem__(index, indices))
+        else:
+            self.deck.order[self._position(index)] = CARD_INDEX[card.name]
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            self._edit(lambda order: order.__delitem__(index))
+        else:
+            del self.deck.order[self._position(index)]
+            self.deck.count -= 1
+
+    def insert(self, index: int, card) -> None:
+        index = min(max(index + self.deck.count if index < 0 else index, 0), self.deck.count)
+        self.deck.order.insert(index, CARD_INDEX[card.name])
+        self.deck.count += 1
 
 
 class Deck:
+    """
+    A deck is a permutation of indices into CARDS with a count of the cards left: the top card is the last one left,
+    so dealing only moves the count and a new round shuffles the same array again.
+    It shuffles with its own random.Random if given one, e.g. a seeded one for reproducible games, or else with the
+    global generator of the random module.
+    """
 
-    def __init__(self):
-        self.cards = []
+    def __init__(self, rng: random.Random = None):
+        self.rng = random if rng is None else rng
+        self.order = array('B', FULL_DECK)
         self.count = 0
         self.populate()
         self.shuffle()
@@ -83,26 +201,60 @@ class Deck:
         return f"Deck({self.count} cards)"
 
     def __len__(self):
-        return len(self.cards)
+        return self.count
+
+    @property
+    def cards(self) -> DeckCards:
+        """
+        The cards left, the top one last, as a live list.
+        """
+        return DeckCards(self)
+
+    @cards.setter
+    def cards(self, cards):
+        self.order = array('B', (CARD_INDEX[card.name] for card in cards))
+        self.count = len(self.order)
 
     def populate(self):
-        card_suits = ['Diamonds', 'Clubs', 'Hearts', 'Spades']
-        card_ranks = [str(i) for i in list(range(2, 11))] + ['J', 'Q', 'K', 'A']
-        self.cards = [Card(card_suit, card_rank) for card_suit in card_suits for card_rank in card_ranks]
-        self.cards.extend([JokerCard('Red'), JokerCard('Black')])  # add two jokers
-        self.count = len(self.cards)
+        self.order[:] = FULL_DECK
+        self.count = len(self.order)
 
     def show(self):
         for card in self.cards:
             card.show()
 
     def shuffle(self):
-        random.shuffle(self.cards)
+        # Shuffle the cards left in place; random.shuffle draws the same numbers as it did for the old list of cards
+        self.rng.shuffle(self.order if self.count == len(self.order) else memoryview(self.order)[:self.count])
+
+    def reshuffle(self):
+        """
+        Put every card back and shuffle, reusing the deck for another game.
+        """
+        self.populate()
+        self.shuffle()
+
+    def draw_index(self) -> int:
+        """
+        Take the top card as its index into CARDS.
+        """
+        if not self.count:
+            raise IndexError('draw from an empty deck')
+        self.count -= 1
+        return self.order[self.count]
+
+    def draw(self):
+        """
+        Take the top card without showing it.
+        """
+        if not self.count:
+            raise IndexError('draw from an empty deck')
+        self.count -= 1
+        return CARDS[self.order[self.count]]
 
     def deal(self):
-        card_drawn = self.cards.pop()
+        card_drawn = self.draw()
         card_drawn.show()
-        self.count -= 1
         return card_drawn
 
 
@@ -118,13 +270,22 @@ class Player:
 
     def draw(self, deck):
         print(f"{self.name} is drawing a card...")
-        self.hand.append(deck.deal())
+        self.take(deck.deal())
         self.show_hand()
-        self.calculate_score()
+        if not self.status:
+            print(f"{self.name} busts and is out with final score 0. Better luck next time.")
+
+    def take(self, card):
+        """
+        Add a card to the hand quietly. Return True if the player busts with it.
+        """
+        self.hand.append(card)
+        self.score += card.val
         if self.score > 11:
             self.status = False
             self.score = 0  # reset score to 0
-            print(f"{self.name} busts and is out with final score 0. Better luck next time.")
+            return True
+        return False
 
     def show_hand(self):
         print(f"{self.name}'s hand: {self.hand}")
@@ -133,45 +294,95 @@ class Player:
         self.score = sum(card.val for card in self.hand)
 
     def wants_card(self):
-        while True:
-            cont_to_play = input(f"{self.name}, do you want another card? (Y/N)").lower()
-            if cont_to_play == 'y':
-                print(f"{self.name} wants another card.")
-                return True
-            elif cont_to_play == 'n':
-                self.status = False
-                self.calculate_score()
-                print(f"{self.name} does not want any more cards. {self.name}'s score is {self.score}.")
-                self.show_hand()
-                return False
-            else:
-                print('The choice is not defined! Please try again.')
-                continue
+        if ask_console(self):
+            print(f"{self.name} wants another card.")
+            return True
+        # take() keeps the score up to date, so the hand need not be summed again
+        self.status = False
+        print(f"{self.name} does not want any more cards. {self.name}'s score is {self.score}.")
+        self.show_hand()
+        return False
 
 
-def play_game(player_names: list = ["Alex", "Peppa"]) -> dict:
+def ask_console(player) -> bool:
     """
-    This is a simple poker game.
-    The game's rules are as follows: We deal one card to each player at a time in turn. The value of Jack, Queen, King
-    and Joker worth 0.5 while other cards worth their face value. The player can decide if he/she wants another card or
-    not. When the sum of all cards is greater than 11, the player busts and his score is set to  0. The game continues
-    till only one player is left or nobody wants more cards. Then we calculate the scores and print the final results.
-    :param player_names: a list of players' names
-    :return: a dictionary of players' final scores
+    Strategy asking the player at the console whether to take another card.
+    """
+    while True:
+        cont_to_play = input(f"{player.name}, do you want another card? (Y/N)").lower()
+        if cont_to_play == 'y':
+            return True
+        elif cont_to_play == 'n':
+            return False
+        else:
+            print('The choice is not defined! Please try again.')
+
+
+def stand_on(points: float):
+    """
+    Strategy taking another card while the hand is worth less than the given points.
+    """
+    def wants_card(player):
+        return player.score < points
+
+    return wants_card
+
+
+def print_event(event: Event) -> None:
+    """
+    Print a game event the way the console game always has.
+    """
+    kind, player, data = event
+    if kind == 'start':
+        print("The game has started".center(72, '-'))
+        print(f"There are {len(data)} players in this game: {', '.join(p.name for p in data)}.")
+    elif kind == 'draw':
+        print(f"{player.name} is drawing a card...")
+        data.show()
+        player.show_hand()
+    elif kind == 'bust':
+        print(f"{player.name} busts and is out with final score 0. Better luck next time.")
+    elif kind == 'hit':
+        print(f"{player.name} wants another card.")
+    elif kind == 'stand':
+        print(f"{player.name} does not want any more cards. {player.name}'s score is {data}.")
+        player.show_hand()
+    elif kind == 'end':
+        winner = [name for name, score in data if score == data[0][1]]
+        print(f"Here is the leaderboard: \n {dict(data)}")
+        print(f"The {'winner is' if len(winner)==1 else 'winners are'} {', '.join(winner)}! Congrats!")
+        print("The game has ended".center(72, '-'))
+
+
+def run_game(player_names: list, strategies: list, deck=None, on_event=None) -> list:
+    """
+    Play a game without any console I/O, following the same rules and turn order as play_game.
+    :param player_names: a list of 2-6 players' names
+    :param strategies: one strategy per player, deciding whether the player takes another card: a callable taking the
+        Player, or an object with such a wants_card method
+    :param deck: the deck to deal from, a freshly shuffled one by default
+    :param on_event: called with every Event of the game, e.g. print_event; nothing is reported without it
+    :return: a list of (name, score) sorted from the highest score
     """
     if (type(player_names) == str) or (len(player_names) < 2) or (len(player_names) > 6):
         raise Exception("This game is designed for 2-6 players. Please try again with valid number of players")
+    if len(strategies) != len(player_names):
+        raise Exception("The number of strategies is INVALID! Please give one strategy per player")
 
-    # set up the game
-    deck = Deck()
+    deck = Deck() if deck is None else deck
     players = [Player(name) for name in player_names]
+    decide = {player: getattr(strategy, 'wants_card', strategy) for player, strategy in zip(players, strategies)}
     losers = []
 
     # start the game by giving each player one card
-    print("The game has started".center(72, '-'))
-    print(f"There are {len(players)} players in this game: {', '.join(player_names)}.")
+    if on_event:
+        on_event(Event('start', None, list(players)))
     for player in players:
-        player.draw(deck)
+        busted = player.take(deck.draw())
+        if on_event:
+            on_event(Event('draw', player, player.hand[-1]))
+            if busted:
+                on_event(Event('bust', player, None))
 
     # carry on playing till there is no more player
     while len(players) > 0:
@@ -180,22 +391,41 @@ def play_game(player_names: list = ["Alex", "Peppa"]) -> dict:
                 losers.append(player)
                 players.remove(player)
                 continue
+            if decide[player](player):
+                busted = player.take(deck.draw())
+                if on_event:
+                    on_event(Event('hit', player, None))
+                    on_event(Event('draw', player, player.hand[-1]))
+                    if busted:
+                        on_event(Event('bust', player, None))
             else:
-                if player.wants_card():
-                    player.draw(deck)
+                player.status = False
+                if on_event:
+                    on_event(Event('stand', player, player.score))
 
     # calculate the leaderboard and take into account when there is a tie
-    scores = {player.name: player.score for player in (players + losers)}
+    scores = {player.name: player.score for player in losers}
     sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    max_score = sorted_scores[0][1]
-    winner = {k: v for k, v in sorted_scores if v == max_score}
+    if on_event:
+        on_event(Event('end', None, sorted_scores))
+    return sorted_scores
 
-    # end the game and print the results
-    print(f"Here is the leaderboard: \n {dict(sorted_scores)}")
-    print(f"The {'winner is' if len(winner)==1 else 'winners are'} {', '.join(list(winner.keys()))}! Congrats!")
-    print("The game has ended".center(72, '-'))
 
-    return sorted_scores
+def play_game(player_names: list = ["Alex", "Peppa"], strategies: list = None, quiet: bool = False) -> dict:
+    """
+    This is a simple poker game.
+    The game's rules are as follows: We deal one card to each player at a time in turn. The value of Jack, Queen, King
+    and Joker worth 0.5 while other cards worth their face value. The player can decide if he/she wants another card or
+    not. When the sum of all cards is greater than 11, the player busts and his score is set to  0. The game continues
+    till only one player is left or nobody wants more cards. Then we calculate the scores and print the final results.
+    :param player_names: a list of players' names
+    :param strategies: one strategy per player instead of asking them at the console, see run_game
+    :param quiet: play without printing anything
+    :return: a dictionary of players' final scores
+    """
+    if strategies is None:
+        strategies = [ask_console] * (0 if type(player_names) == str else len(player_names))
+    return run_game(player_names, strategies, on_event=None if quiet else print_event)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,235 @@
+"""
+Optimal hit/stand policy for the eleven card game in eleven.py.
+
+A player who stands keeps their hand's value and a player who busts scores 0, so the best a player can do on their
+own is to take another card exactly when that raises the expected final score. What the next card may be depends only
+on the cards that are not in the player's hand: the cards dealt to the other players are unseen and just as likely to
+be any of them. A state is therefore the hand total with the multiset of cards left, and only card values matter, so
+the multiset is the count of cards left of each of the 11 values.
+
+The solver works out the expected score of every state by dynamic programming: standing is worth the total, and
+hitting the mean over the cards left of the state it leads to, or 0 on a bust. Each state is solved once and memoized
+under a compact key, one integer packing the total in half points and the counts in a mixed radix. Solving the full
+deck fills the table of every state a player can reach with their own cards, under a thousand of them, in a tenth of
+a second. The table is saved as a small binary file and loaded into a dict, so the policy decides with one lookup.
+
+Use it as a strategy of eleven.run_game, or in a tournament as eleven_policy:OptimalPolicy:
+    python eleven_policy.py build
+    python eleven_policy.py show
+"""
+
+import os
+import struct
+import sys
+from array import array
+
+from eleven import CARD_VALUES
+
+POLICY_FILE = 'eleven_policy.bin'
+POLICY_MAGIC = b'ELVP'
+POLICY_VERSION = 1
+HEADER = struct.Struct('<4sHBxq')
+# Card values in half points, and the number of cards of each in the deck
+VALUES = tuple(sorted({int(value * 2) for value in CARD_VALUES}))
+FULL_COUNTS = tuple(sum(1 for value in CARD_VALUES if int(value * 2) == half) for half in VALUES)
+MAX_TOTAL = 11 * 2
+# Expected scores closer than this are taken as equal, and the player stands
+TOLERANCE = 1e-9
+
+
+def _place_values() -> tuple:
+    places = []
+    weight = 1
+    for count in reversed(FULL_COUNTS):
+        places.append(weight)
+        weight *= count + 1
+    return tuple(reversed(places)), weight
+
+
+# Weight of each value's count in a key, and the weight of the total
+PLACES, TOTAL_PLACE = _place_values()
+# How taking a card of each value changes the key: the total goes up and the count of the value down
+CARD_STEPS = tuple(half * TOTAL_PLACE - place for half, place in zip(VALUES, PLACES))
+STEP_OF_VALUE = {half / 2: step for half, step in zip(VALUES, CARD_STEPS)}
+
+
+def state_key(total: int, counts: tuple) -> int:
+    """
+    Pack a hand total in half points and the counts of the cards left into one integer.
+    """
+    if len(counts) != len(VALUES) or any(not 0 <= count <= full for count, full in zip(counts, FULL_COUNTS)):
+        raise Exception(f'The card counts {counts} are INVALID!')
+    return total * TOTAL_PLACE + sum(count * place for count, place in zip(counts, PLACES))
+
+
+# Key of an empty hand with the full deck left
+FULL_KEY = state_key(0, FULL_COUNTS)
+
+
+def unpack_key(key: int) -> tuple:
+    total, rest = divmod(key, TOTAL_PLACE)
+    return total, tuple(rest // place % (full + 1) for place, full in zip(PLACES, FULL_COUNTS))
+
+
+class PolicySolver:
+    """
+    Expected final scores of hitting and standing, in half points, memoized per state key.
+    """
+
+    def __init__(self):
+        self.memo = {}
+
+    def expected_value(self, total: int, counts: tuple) -> float:
+        """
+        Get the expected final score of a state when playing it optimally.
+        """
+        key = state_key(total, counts)
+        if key not in self.memo:
+            self.memo[key] = max(total, self.hit_value(total, counts))
+        return self.memo[key]
+
+    def hit_value(self, total: int, counts: tuple) -> float:
+        """
+        Get the expected final score of taking one more card, then playing optimally. An empty deck cannot be hit.
+        """
+        left = sum(counts)
+        if not left:
+            return -1.0
+        value = 0.0
+        for i, count in enumerate(counts):
+            if count and total + VALUES[i] <= MAX_TOTAL:
+                rest = counts[:i] + (count - 1,) + counts[i + 1:]
+                value += count * self.expected_value(total + VALUES[i], rest)
+        return value / left
+
+    def wants_card(self, total: int, counts: tuple) -> bool:
+        return self.hit_value(total, counts) > total + TOLERANCE
+
+
+class OptimalPolicy:
+    """
+    Strategy taking another card exactly when it raises the expected final score, looked up in a table of every
+    state reachable from the full deck. Unlike the other strategies of eleven.py it only needs the player's hand.
+    States missing from the table, e.g. the hand of a rigged deck, are solved when first met and then remembered.
+    """
+
+    def __init__(self, path: str = POLICY_FILE):
+        """
+        Load the table from the file if it exists, or else solve it.
+        """
+        self.solver = None
+        if path and os.path.exists(path):
+            self.decisions = read_table(path)
+        else:
+            self.decisions = build_table(self._solver())
+
+    def __repr__(self):
+        return f"OptimalPolicy({len(self.decisions)} states)"
+
+    def _solver(self) -> PolicySolver:
+        if self.solver is None:
+            self.solver = PolicySolver()
+        return self.solver
+
+    def decide(self, key: int) -> bool:
+        """
+        Tell whether to hit in the state with the given key.
+        """
+        hit = self.decisions.get(key)
+        if hit is None:
+            hit = self.decisions[key] = self._solver().wants_card(*unpack_key(key))
+        return hit
+
+    def wants_card(self, player) -> bool:
+        key = FULL_KEY
+        for card in player.hand:
+            key += STEP_OF_VALUE[card.val]
+        return self.decide(key)
+
+    def save(self, path: str = POLICY_FILE) -> None:
+        write_table(path, self.decisions)
+
+
+def build_table(solver: PolicySolver = None, counts: tuple = FULL_COUNTS) -> dict:
+    """
+    Solve every state a player can reach with their own cards from the given deck, the full one by default, and map
+    each state key to whether to hit.
+    """
+    solver = solver or PolicySolver()
+    decisions = {}
+    stack = [(0, counts)]
+    while stack:
+        total, counts = stack.pop()
+        key = state_key(total, counts)
+        if key in decisions:
+            continue
+        decisions[key] = solver.wants_card(total, counts)
+        for i, count in enumerate(counts):
+            if count and total + VALUES[i] <= MAX_TOTAL:
+                stack.append((total + VALUES[i], counts[:i] + (count - 1,) + counts[i + 1:]))
+    return decisions
+
+
+def write_table(path: str, decisions: dict) -> None:
+    """
+    Write the table atomically: the header, the sorted state keys as little-endian 64-bit integers, then one byte per
+    state, 1 to hit.
+    """
+    keys = array('q', sorted(decisions))
+    hits = bytes(decisions[key] for key in keys)
+    if sys.byteorder != 'little':
+        keys.byteswap()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(POLICY_MAGIC, POLICY_VERSION, len(VALUES), len(hits)))
+        f.write(keys.tobytes())
+        f.write(hits)
+    os.replace(tmp_path, path)
+
+
+def read_table(path: str) -> dict:
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise Exception(f'The policy file {path} is INVALID!')
+    magic, version, num_values, num_states = HEADER.unpack_from(data)
+    if (magic, version, num_values) != (POLICY_MAGIC, POLICY_VERSION, len(VALUES)) \
+            or len(data) != HEADER.size + 9 * num_states:
+        raise Exception(f'The policy file {path} is INVALID!')
+    keys = array('q', data[HEADER.size:HEADER.size + 8 * num_states])
+    if sys.byteorder != 'little':
+        keys.byteswap()
+    return dict(zip(keys, map(bool, data[HEADER.size + 8 * num_states:])))
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Solve the optimal hit/stand policy of eleven.')
+    parser.add_argument('command', choices=('build', 'show'))
+    parser.add_argument('--file', default=POLICY_FILE, help='the policy table file')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        started = time.perf_counter()
+        solver = PolicySolver()
+        decisions = build_table(solver)
+        write_table(args.file, decisions)
+        print(f"Solved {len(decisions)} states in {time.perf_counter() - started:.2f} seconds and saved them to "
+              f"{args.file}. The expected score from a full deck is {solver.expected_value(0, FULL_COUNTS) / 2:.4f}.")
+        return
+
+    decisions = read_table(args.file)
+    print(f"{len(decisions)} states, {sum(decisions.values())} of them hit.")
+    print(f"{'Total':>6}{'Hit':>10}{'Stand':>10}")
+    by_total = {}
+    for key, hit in decisions.items():
+        counts = by_total.setdefault(unpack_key(key)[0], [0, 0])
+        counts[0 if hit else 1] += 1
+    for total in sorted(by_total):
+        print(f"{total / 2:>6g}{by_total[total][0]:>10}{by_total[total][1]:>10}")
+
+
+if __name__ == '__main__':
+    main()
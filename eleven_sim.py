@@ -0,0 +1,178 @@
+"""
+Vectorised Monte Carlo simulator for the eleven card game in eleven.py.
+
+Cards are counted in half points so that every value is a small integer: J, Q, K and Joker are worth 1, A is worth 2
+and the other cards twice their face value. A hand busts above 22 half points, i.e. 11 points. The values are taken
+from the card table of eleven.py, so the simulator cannot drift away from the game's rules.
+
+Every player follows a threshold policy: draw while the hand is worth less than the threshold, then stand. The first
+card is always dealt. A player's decisions depend only on their own hand, so the order the cards go round the table
+does not change the odds of any outcome: a given set of final hands needs the same number of cards off the top of the
+deck whatever the order, and every run of cards is equally likely. The simulator therefore deals each player's whole
+hand in turn. A batch of games is then played with one cumulative sum over the decks and one comparison per player,
+instead of a loop over turns.
+
+Decks are shuffled a batch at a time with a vectorised partial Fisher-Yates shuffle over a (54, batch) array. Only the
+positions the hands are likely to reach are shuffled, and the few games that need more cards have the rest of their
+deck shuffled afterwards. All the randomness comes from one seeded NumPy generator, so a run is reproducible.
+
+Usage: python eleven_sim.py 8 9.5 --games 1000000 --seed 42
+"""
+
+import math
+import time
+
+import numpy as np
+
+from eleven import CARD_VALUES
+
+# Card values in half points, taken from the game's own table
+DECK_VALUES = np.array(sorted(int(value * 2) for value in CARD_VALUES), dtype=np.int8)
+DECK_SIZE = len(DECK_VALUES)
+BUST_SCORE = 11 * 2
+BATCH_SIZE = 1 << 16
+
+
+def to_half_points(thresholds: list) -> list:
+    """
+    Check the number of players and convert their thresholds from points to half points.
+    """
+    if isinstance(thresholds, str) or len(thresholds) < 2 or len(thresholds) > 6:
+        raise Exception("This game is designed for 2-6 players. Please try again with valid number of players")
+    half_points = []
+    for threshold in thresholds:
+        if threshold * 2 != int(threshold * 2):
+            raise Exception(f'The threshold {threshold} is INVALID! Thresholds go in steps of 0.5')
+        half_points.append(int(threshold * 2))
+    return half_points
+
+
+def _shuffle(decks: np.ndarray, rng: np.random.Generator, start: int, stop: int) -> None:
+    """
+    Run the Fisher-Yates steps for positions [start, stop) of every deck, the columns of `decks`, in place.
+    """
+    batch = decks.shape[1]
+    flat = decks.reshape(-1)
+    columns = np.arange(batch, dtype=np.intp)
+    for k in range(start, stop):
+        # float32 is plenty for 54 choices; the clip guards the rare rounding up to the upper bound
+        picks = (rng.random(batch, dtype=np.float32) * np.float32(DECK_SIZE - k)).astype(np.intp)
+        np.minimum(picks, DECK_SIZE - k - 1, out=picks)
+        picks += k
+        picks *= batch
+        picks += columns
+        card = flat[picks]
+        flat[picks] = decks[k]
+        decks[k] = card
+
+
+def _deal(decks: np.ndarray, thresholds: np.ndarray, positions: int) -> tuple:
+    """
+    Deal every player's hand in turn from the shuffled top `positions` cards of the decks.
+    Return the hand values (players, batch), bust or not, and which games ran past the shuffled cards.
+    """
+    batch = decks.shape[1]
+    totals = np.cumsum(decks[:positions], axis=0, dtype=np.int16)
+    columns = np.arange(batch, dtype=np.intp)
+    scores = np.empty((len(thresholds), batch), dtype=np.int16)
+    base = np.zeros(batch, dtype=np.int16)
+    overflow = np.zeros(batch, dtype=bool)
+    for player, threshold in enumerate(thresholds):
+        # Totals only grow, so the number of them below the target is the index of the card the player stands on
+        last = (totals < base + np.maximum(threshold, 1)).sum(axis=0)
+        overflow |= last >= positions
+        np.minimum(last, positions - 1, out=last)
+        end = totals[last, columns]
+        scores[player] = end - base
+        base = end
+    return scores, overflow
+
+
+def play_batch(half_points, batch: int, rng: np.random.Generator) -> tuple:
+    """
+    Play a batch of games with the given thresholds in half points: one per seat, or an array of one per seat and
+    game, shaped (players, batch), for tables of different players.
+    Return the final hand values in half points, shaped (players, batch), and whether each hand went bust.
+    """
+    thresholds = np.asarray(half_points, dtype=np.int16)
+    if thresholds.ndim == 1:
+        thresholds = thresholds[:, None]
+    # A card is worth about 8 half points on average; with a quarter more than the expected number of cards, only
+    # about one game in a hundred at worst needs the rest of its deck shuffled
+    positions = min(DECK_SIZE, math.ceil(sum(threshold / 8 + 1 for threshold in thresholds.max(axis=1)) * 1.25) + 2)
+    decks = np.empty((DECK_SIZE, batch), dtype=np.int8)
+    decks[:] = DECK_VALUES[:, None]
+    _shuffle(decks, rng, 0, positions)
+    scores, overflow = _deal(decks, thresholds, positions)
+    if overflow.any() and positions < DECK_SIZE:
+        rest = np.ascontiguousarray(decks[:, overflow])
+        _shuffle(rest, rng, positions, DECK_SIZE)
+        scores[:, overflow] = _deal(rest, thresholds[:, overflow] if thresholds.shape[1] > 1 else thresholds,
+                                    DECK_SIZE)[0]
+    return scores, scores > BUST_SCORE
+
+
+def tally(scores: np.ndarray, busted: np.ndarray) -> dict:
+    """
+    Count the wins, ties, busts and points of every seat over a batch. A bust scores 0, and every player on the top
+    score wins, so a shared top score is a tie.
+    """
+    points = np.where(busted, 0, scores)
+    top = points == points.max(axis=0)
+    shared = top.sum(axis=0) > 1
+    return {
+        'games': scores.shape[1],
+        'wins': (top & ~shared).sum(axis=1),
+        'ties': (top & shared).sum(axis=1),
+        'busts': busted.sum(axis=1),
+        'points': points.sum(axis=1, dtype=np.int64),
+    }
+
+
+def simulate(thresholds: list, games: int, seed: int = None, batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Simulate games between threshold players, e.g. [8, 9.5] for a player standing on 8 points or more against one
+    standing on 9.5 or more. Return the win, tie and bust rates and the mean score of every seat.
+    """
+    half_points = to_half_points(thresholds)
+    rng = np.random.default_rng(seed)
+    counts = None
+    started = time.perf_counter()
+    for start in range(0, games, batch_size):
+        batch_counts = tally(*play_batch(half_points, min(batch_size, games - start), rng))
+        counts = batch_counts if counts is None else {key: counts[key] + batch_counts[key] for key in counts}
+    elapsed = time.perf_counter() - started
+    games = counts['games'] if counts else 0
+    return {
+        'thresholds': list(thresholds),
+        'games': games,
+        'seed': seed,
+        'seconds': elapsed,
+        'win': [count / games for count in counts['wins']] if games else [],
+        'tie': [count / games for count in counts['ties']] if games else [],
+        'bust': [count / games for count in counts['busts']] if games else [],
+        'mean_score': [count / 2 / games for count in counts['points']] if games else [],
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Simulate eleven between players standing at fixed thresholds.')
+    parser.add_argument('thresholds', type=float, nargs='+', help='points each player stands on, 2 to 6 players')
+    parser.add_argument('--games', type=int, default=1000000)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE, help='games played at once')
+    args = parser.parse_args()
+
+    result = simulate(args.thresholds, args.games, args.seed, args.batch)
+    print(f"{'Seat':<6}{'Stand on':>10}{'Win':>10}{'Tie':>10}{'Bust':>10}{'Mean':>8}")
+    for seat, threshold in enumerate(result['thresholds']):
+        print(f"{seat + 1:<6}{threshold:>10g}{result['win'][seat]:>10.4%}{result['tie'][seat]:>10.4%}"
+              f"{result['bust'][seat]:>10.4%}{result['mean_score'][seat]:>8.3f}")
+    print(f"{result['games']} games in {result['seconds']:.2f} seconds "
+          f"({result['games'] / result['seconds']:,.0f} games per second)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""
+Multi-core tournament runner comparing strategies for the eleven card game in eleven.py.
+
+A tournament plays a number of games on tables of 2-6 players. Every game picks a table size from the ones asked for,
+then fills each seat with one of the strategies at random, so every strategy meets every other in every seat. The
+games are cut into shards of a fixed size which a ProcessPoolExecutor plays on all the cores. A shard only returns its
+counts of seats, wins, ties, busts and points per strategy and table size, and they are added up as the shards finish,
+so partial standings can be reported while the rest is still being played, and adding cores scales it near-linearly.
+
+Every shard draws all its randomness from its own generator, seeded from the master seed and the shard number, and
+never from the global one. Counts are whole numbers, so adding them up in whatever order the shards finish gives the
+same totals: the same seed, number of games, shard size and engine give exactly the same results on any number of
+cores. A run without a seed picks one and reports it, so it can be played again.
+
+Strategies are given as text so they can be sent to the workers: a number is a player standing on that many points
+or more, and `module:name` is a strategy from an importable module, as taken by eleven.run_game, or a class making one.
+Two engines play the games:
+    python: eleven.run_game with one reused Deck per shard, for any strategy.
+    numpy: the vectorised simulator of eleven_sim.py, a hundred times faster, for threshold strategies only.
+The engines deal the cards in a different order, so they play different games, but with the same odds. The python
+engine plays by default; 'auto' picks numpy whenever it can, so its results depend on whether NumPy is installed.
+
+Rates come with a Wilson score interval, taking every seat as an independent trial.
+
+Usage: python eleven_tournament.py 7 8 9 my_bots:cautious --games 10000000 --tables 2-6 --seed 42
+"""
+
+import hashlib
+import math
+import os
+import random
+import sys
+import time
+
+SHARD_SIZE = 100000
+TABLE_SIZES = (2, 3, 4, 5, 6)
+ENGINES = ('auto', 'python', 'numpy')
+# Columns of the counts kept per strategy and table size; points are in half points so they stay whole numbers
+COUNTS = ('seats', 'wins', 'ties', 'busts', 'points')
+# z score of the confidence intervals, 95 %
+CONFIDENCE_Z = 1.96
+
+
+def threshold_of(spec: str):
+    """
+    Get the points a strategy stands on, or None if it is not a threshold strategy.
+    """
+    try:
+        points = float(spec)
+    except ValueError:
+        return None
+    if points * 2 != int(points * 2):
+        raise Exception(f'The threshold {spec} is INVALID! Thresholds go in steps of 0.5')
+    return points
+
+
+def load_strategy(spec: str):
+    """
+    Get the strategy a spec stands for: stand_on(points) for a number, or the object named by `module:name`,
+    instantiated if it is a class.
+    """
+    from eleven import stand_on
+
+    points = threshold_of(spec)
+    if points is not None:
+        return stand_on(points)
+    module_name, sep, name = spec.partition(':')
+    if not sep or not module_name or not name:
+        raise Exception(f"The strategy {spec} is INVALID! Please give a number or 'module:name'")
+    import importlib
+
+    strategy = getattr(importlib.import_module(module_name), name)
+    return strategy() if isinstance(strategy, type) else strategy
+
+
+def check_tables(table_sizes) -> tuple:
+    table_sizes = tuple(sorted(set(table_sizes)))
+    if not table_sizes or table_sizes[0] < 2 or table_sizes[-1] > 6:
+        raise Exception("This game is designed for 2-6 players. Please try again with valid number of players")
+    return table_sizes
+
+
+def choose_engine(specs: list, engine: str = 'python') -> str:
+    """
+    Check the engine can play the strategies and resolve 'auto': numpy if every strategy is a threshold and NumPy is
+    installed, or else python.
+    """
+    if engine not in ENGINES:
+        raise Exception(f"The engine {engine} is INVALID! Please choose from {', '.join(ENGINES)}")
+    thresholds_only = all(threshold_of(spec) is not None for spec in specs)
+    if engine == 'numpy' and not thresholds_only:
+        raise Exception('The numpy engine only plays threshold strategies! Please use the python engine')
+    if engine == 'auto':
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            return 'python'
+        return 'numpy' if thresholds_only else 'python'
+    return engine
+
+
+def shard_seed(seed: int, shard: int) -> int:
+    """
+    Derive the 64-bit seed of a shard from the master seed, the same on every platform and Python version.
+    """
+    return int.from_bytes(hashlib.sha256(f'{seed}:{shard}'.encode()).digest()[:8], 'big')
+
+
+def new_counts(num_strategies: int, num_tables: int) -> list:
+    """
+    Zeroed counts, indexed by strategy, then table size, then column of COUNTS.
+    """
+    return [[[0] * len(COUNTS) for _ in range(num_tables)] for _ in range(num_strategies)]
+
+
+def add_counts(total: list, counts: list) -> list:
+    for total_tables, tables in zip(total, counts):
+        for total_row, row in zip(total_tables, tables):
+            for i, count in enumerate(row):
+                total_row[i] += count
+    return total
+
+
+def _play_python(specs: list, table_sizes: tuple, games: int, seed: int) -> list:
+    from eleven import Deck, run_game
+
+    rng = random.Random(seed)
+    deck = Deck(rng)
+    strategies = [load_strategy(spec) for spec in specs]
+    counts = new_counts(len(specs), len(table_sizes))
+    names = [str(seat) for seat in range(max(table_sizes))]
+    for _ in range(games):
+        table = rng.randrange(len(table_sizes))
+        seats = [rng.randrange(len(specs)) for _ in range(table_sizes[table])]
+        deck.reshuffle()
+        scores = run_game(names[:len(seats)], [strategies[strategy] for strategy in seats], deck)
+        top = scores[0][1]
+        shared = scores[1][1] == top
+        for name, score in scores:
+            row = counts[seats[int(name)]][table]
+            row[0] += 1
+            if score == top:
+                row[2 if shared else 1] += 1
+            # Standing takes at least one card, worth half a point, so only a bust scores 0
+            if score == 0:
+                row[3] += 1
+            row[4] += int(score * 2)
+    return counts
+
+
+def _play_numpy(specs: list, table_sizes: tuple, games: int, seed: int) -> list:
+    import numpy as np
+
+    from eleven_sim import BATCH_SIZE, play_batch
+
+    rng = np.random.default_rng(seed)
+    half_points = np.array([int(threshold_of(spec) * 2) for spec in specs], dtype=np.int16)
+    counts = new_counts(len(specs), len(table_sizes))
+    for table, table_games in enumerate(rng.multinomial(games, [1 / len(table_sizes)] * len(table_sizes))):
+        for start in range(0, table_games, BATCH_SIZE):
+            batch = min(BATCH_SIZE, table_games - start)
+            seats = rng.integers(len(specs), size=(table_sizes[table], batch))
+            scores, busted = play_batch(half_points[seats], batch, rng)
+            points = np.where(busted, 0, scores)
+            top = points == points.max(axis=0)
+            shared = top.sum(axis=0) > 1
+            columns = (np.ones_like(top), top & ~shared, top & shared, busted, points)
+            for i, column in enumerate(columns):
+                totals = np.bincount(seats.ravel(), weights=column.ravel(), minlength=len(specs))
+                for strategy, total in enumerate(totals):
+                    counts[strategy][table][i] += int(total)
+    return counts
+
+
+def play_shard(engine: str, specs: list, table_sizes: tuple, games: int, seed: int) -> list:
+    """
+    Play one shard of a tournament and get its counts, see new_counts.
+    """
+    return (_play_numpy if engine == 'numpy' else _play_python)(specs, table_sizes, games, seed)
+
+
+def iter_tournament(specs: list, games: int, seed: int, table_sizes=TABLE_SIZES, engine: str = 'python',
+                    workers: int = None, shard_size: int = SHARD_SIZE):
+    """
+    Play a tournament and yield (games played, counts so far) every time a shard finishes. The last counts are the
+    results, the same whatever the number of workers; see run_tournament for the parameters.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    if not specs:
+        raise Exception('The list of strategies is INVALID! Please give at least one strategy')
+    table_sizes = check_tables(table_sizes)
+    engine = choose_engine(specs, engine)
+    for spec in specs:
+        load_strategy(spec)
+    shards = [(min(shard_size, games - start), shard_seed(seed, shard))
+              for shard, start in enumerate(range(0, games, shard_size))]
+    total = new_counts(len(specs), len(table_sizes))
+    played = 0
+    workers = min(workers or os.cpu_count() or 1, len(shards))
+    if workers <= 1:
+        for shard_games, shard_key in shards:
+            played += shard_games
+            yield played, add_counts(total, play_shard(engine, specs, table_sizes, shard_games, shard_key))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(play_shard, engine, specs, table_sizes, shard_games, shard_key): shard_games
+                   for shard_games, shard_key in shards}
+        for future in as_completed(futures):
+            played += futures[future]
+            yield played, add_counts(total, future.result())
+
+
+def wilson_interval(successes: int, trials: int, z: float = CONFIDENCE_Z) -> tuple:
+    """
+    Get the Wilson score interval of a rate, which stays within [0, 1] even for rates near 0 or 1.
+    """
+    if not trials:
+        return 0.0, 1.0
+    rate = successes / trials
+    centre = (rate + z * z / (2 * trials)) / (1 + z * z / trials)
+    margin = z / (1 + z * z / trials) * math.sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials))
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+def summarise(specs: list, table_sizes: tuple, counts: list) -> list:
+    """
+    Get the standings of every strategy, over all tables (table None) and per table size: the seats played, the
+    win, tie and bust rates with their intervals, and the mean score.
+    """
+    standings = []
+    for spec, tables in zip(specs, counts):
+        rows = [(None, [sum(column) for column in zip(*tables)])] + list(zip(table_sizes, tables))
+        for table, (seats, wins, ties, busts, points) in rows:
+            standings.append({
+                'strategy': spec,
+                'table': table,
+                'seats': seats,
+                'win': wins / seats if seats else 0.0,
+                'win_ci': wilson_interval(wins, seats),
+                'tie': ties / seats if seats else 0.0,
+                'tie_ci': wilson_interval(ties, seats),
+                'bust': busts / seats if seats else 0.0,
+                'bust_ci': wilson_interval(busts, seats),
+                'mean_score': points / 2 / seats if seats else 0.0,
+            })
+    return standings
+
+
+def run_tournament(specs: list, games: int, table_sizes=TABLE_SIZES, seed: int = None, engine: str = 'python',
+                   workers: int = None, shard_size: int = SHARD_SIZE, on_progress=None) -> dict:
+    """
+    Play a tournament between strategies and get the standings.
+    :param specs: the strategies, e.g. ['8', '9.5', 'my_bots:cautious'], see load_strategy
+    :param games: the number of games to play
+    :param table_sizes: the numbers of players a table may have, each as likely
+    :param seed: the master seed; a random one is picked and returned without it
+    :param engine: 'python', 'numpy' or 'auto', see choose_engine; 'auto' makes the results depend on NumPy
+    :param workers: the number of processes, all the cores by default
+    :param shard_size: the games played by a worker at a time; changing it changes the games played
+    :param on_progress: called with (games played, standings so far) every time a shard finishes
+    :return: a dictionary of the settings, the counts and the standings, see summarise
+    """
+    seed = random.SystemRandom().getrandbits(32) if seed is None else seed
+    table_sizes = check_tables(table_sizes)
+    engine = choose_engine(specs, engine)
+    counts = new_counts(len(specs), len(table_sizes))
+    started = time.perf_counter()
+    for played, counts in iter_tournament(specs, games, seed, table_sizes, engine, workers, shard_size):
+        if on_progress:
+            on_progress(played, summarise(specs, table_sizes, counts))
+    return {
+        'strategies': list(specs),
+        'table_sizes': table_sizes,
+        'games': games,
+        'seed': seed,
+        'engine': engine,
+        'shard_size': shard_size,
+        'seconds': time.perf_counter() - started,
+        'counts': counts,
+        'standings': summarise(specs, table_sizes, counts),
+    }
+
+
+def parse_tables(text: str) -> tuple:
+    """
+    Parse table sizes such as '2-6' or '2,4,6'.
+    """
+    sizes = []
+    try:
+        for part in text.split(','):
+            low, sep, high = part.partition('-')
+            sizes.extend(range(int(low), int(high) + 1) if sep else [int(low)])
+    except ValueError:
+        raise Exception(f'The table sizes {text} are INVALID! Please give them like 2-6 or 2,4,6')
+    return check_tables(sizes)
+
+
+def print_standings(standings: list) -> None:
+    print(f"{'Strategy':<20}{'Table':>6}{'Seats':>12}{'Win':>20}{'Tie':>20}{'Bust':>20}{'Mean':>8}")
+    for row in standings:
+        rates = ''.join(f"{row[key]:>9.3%} ±{(row[key + '_ci'][1] - row[key + '_ci'][0]) / 2:>7.3%}   "
+                        for key in ('win', 'tie', 'bust'))
+        print(f"{row['strategy']:<20}{row['table'] or 'all':>6}{row['seats']:>12}  {rates}{row['mean_score']:>6.3f}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Play a tournament between eleven strategies on all the cores.')
+    parser.add_argument('strategies', nargs='+', help="points a player stands on, or 'module:name' of a strategy")
+    parser.add_argument('--games', type=int, default=1000000)
+    parser.add_argument('--tables', type=parse_tables, default=TABLE_SIZES, help='table sizes, e.g. 2-6 or 2,4')
+    parser.add_argument('--seed', type=int, help='master seed, picked at random without one')
+    parser.add_argument('--engine', choices=ENGINES, default='python')
+    parser.add_argument('--workers', type=int, help='processes, all the cores by default')
+    parser.add_argument('--shard', type=int, default=SHARD_SIZE, help='games per shard')
+    parser.add_argument('--quiet', action='store_true', help='do not report the partial results')
+    args = parser.parse_args()
+
+    def report(played, standings):
+        overall = ', '.join(f"{row['strategy']} {row['win']:.2%}" for row in standings if row['table'] is None)
+        print(f"{played}/{args.games} games: {overall}", file=sys.stderr)
+
+    result = run_tournament(args.strategies, args.games, args.tables, args.seed, args.engine, args.workers,
+                            args.shard, None if args.quiet else report)
+    print_standings(result['standings'])
+    print(f"{result['games']} games with the {result['engine']} engine and seed {result['seed']} in "
+          f"{result['seconds']:.2f} seconds ({result['games'] / result['seconds']:,.0f} games per second)")
+
+
+if __name__ == '__main__':
+    main()
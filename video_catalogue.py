@@ -0,0 +1,479 @@
+"""
+Shared video catalogue used by the Green, Blue and Red video managers.
+
+The CSV file is parsed once and stored as a compact binary cache next to it. The cache holds one string heap per
+column plus an offset table, so later starts only need to memory-map the file and rows are decoded when accessed.
+The cache is rebuilt whenever the CSV's mtime or size changes.
+
+A running process picks up rows appended to the CSV without a reload: `Catalogue.refresh` parses only the new tail and
+updates the indexes in place, and `CatalogueWatcher` calls it whenever the file changes (through inotify on Linux,
+by polling elsewhere). Any other kind of change to the file reloads the catalogue.
+
+Cache layout (little-endian header, native offsets):
+    header   magic, version, byte order, csv mtime_ns, csv size, row count, column count
+    widths   one unsigned byte per row (number of fields in the row)
+    per column: an offset table of row count + 1 uint64 followed by the NUL-separated UTF-8 heap
+"""
+
+import csv
+import io
+import mmap
+import os
+import re
+import select
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections.abc import Sequence
+
+from video_integrity import is_checksum
+from video_search import SearchIndex
+from video_view import CatalogueView
+
+CACHE_MAGIC = b'VCAT'
+CACHE_VERSION = 2
+CACHE_SUFFIX = '.cache'
+INDEX_SUFFIX = '.idx'
+HEADER = struct.Struct('<4sHBxqqqq')
+FIELD_SEP = '\0'
+# Bytes at the end of the parsed part of the CSV that must be unchanged for new rows to count as appended
+TAIL_CHECK_SIZE = 4096
+
+
+def fix_row(row: list) -> list:
+    """
+    Fix the wrong comma used in the mid of the news title. A checksum in the last column is kept as a fourth column.
+    """
+    checksum = row.pop() if len(row) > 3 and is_checksum(row[-1]) else None
+    if len(row) > 3:
+        row[1:3] = ['，'.join(row[1:3])]
+    if checksum:
+        row.append(checksum)
+    return row
+
+
+def _align(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def _csv_stat(csv_path: str) -> tuple:
+    stat = os.stat(csv_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def build_cache(csv_path: str, cache_path: str) -> None:
+    """
+    Parse the CSV file once and write the binary cache atomically.
+    """
+    mtime_ns, size = _csv_stat(csv_path)
+    rows = []
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            rows.append(fix_row(row))
+
+    num_columns = max((len(row) for row in rows), default=0)
+    widths = bytes(min(len(row), 255) for row in rows)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(CACHE_MAGIC, CACHE_VERSION, sys.byteorder == 'little', mtime_ns, size,
+                            len(rows), num_columns))
+        f.write(widths)
+        f.write(b'\0' * (_align(f.tell()) - f.tell()))
+        for col in range(num_columns):
+            heap = bytearray()
+            offsets = array('Q', [0])
+            for row in rows:
+                if col < len(row):
+                    heap += row[col].encode('utf-8')
+                heap += b'\0'
+                offsets.append(len(heap))
+            f.write(offsets.tobytes())
+            f.write(heap)
+            f.write(b'\0' * (_align(f.tell()) - f.tell()))
+    os.replace(tmp_path, cache_path)
+
+
+class Catalogue(Sequence):
+    """
+    Read-only, lazily decoded view of the video catalogue backed by a memory-mapped cache.
+
+    Rows are returned as lists of strings, just like the rows of the old in-memory `videos` list.
+    """
+
+    def __init__(self, csv_path: str = 'video.csv', cache_path: str = None):
+        self.csv_path = csv_path
+        self.cache_path = cache_path or csv_path + CACHE_SUFFIX
+        self._columns = {}
+        self._search_index = None
+        self._id_index = None
+        self._id_duplicates = {}
+        # Indexes are built lazily and may be asked for from several threads at once, e.g. by GUI search workers
+        self._index_lock = threading.Lock()
+        self.listeners = []
+        if not self._open_cache():
+            build_cache(self.csv_path, self.cache_path)
+            if not self._open_cache():
+                raise Exception(f'The catalogue cache {self.cache_path} is INVALID!')
+
+    def _open_cache(self) -> bool:
+        """
+        Map the cache file and check it still matches the CSV. Return False if it needs rebuilding.
+        """
+        try:
+            with open(self.cache_path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        if len(mm) < HEADER.size:
+            mm.close()
+            return False
+        magic, version, little, mtime_ns, size, num_rows, num_columns = HEADER.unpack_from(mm)
+        if (magic, version, bool(little)) != (CACHE_MAGIC, CACHE_VERSION, sys.byteorder == 'little') \
+                or (mtime_ns, size) != _csv_stat(self.csv_path):
+            mm.close()
+            return False
+
+        view = memoryview(mm)
+        pos = HEADER.size
+        self._widths = view[pos:pos + num_rows]
+        pos = _align(pos + num_rows)
+        self._offsets = []
+        self._heaps = []
+        for _ in range(num_columns):
+            offsets = view[pos:pos + 8 * (num_rows + 1)].cast('Q')
+            pos += 8 * (num_rows + 1)
+            self._offsets.append(offsets)
+            self._heaps.append(view[pos:pos + offsets[num_rows]])
+            pos = _align(pos + offsets[num_rows])
+        self._mmap = mm
+        self.stamp = (mtime_ns, size)
+        self._num_rows = num_rows
+        # Rows appended to the CSV since the cache was built are kept in memory
+        self._extra_rows = []
+        self.parsed_size = size
+        self._tail = self._read_csv(max(0, size - TAIL_CHECK_SIZE), size)
+        return True
+
+    def __len__(self):
+        return self._num_rows + len(self._extra_rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('catalogue index out of range')
+        return self._row(index)
+
+    def __repr__(self):
+        return f"Catalogue({self.csv_path!r}, {len(self)} videos)"
+
+    def _row(self, index: int) -> list:
+        if index >= self._num_rows:
+            return list(self._extra_rows[index - self._num_rows])
+        return [self.field(index, col) for col in range(self._widths[index])]
+
+    def field(self, index: int, col: int) -> str:
+        """
+        Decode a single field without touching the rest of the row.
+        """
+        if col in self._columns:
+            return self._columns[col][index]
+        if index >= self._num_rows:
+            row = self._extra_rows[index - self._num_rows]
+            return row[col] if col < len(row) else ''
+        if col >= len(self._offsets):
+            return ''
+        offsets = self._offsets[col]
+        return str(self._heaps[col][offsets[index]:offsets[index + 1] - 1], 'utf-8')
+
+    def column(self, col: int) -> list:
+        """
+        Decode a whole column at once, e.g. all IDs or all titles. The result is kept for later use.
+        """
+        if col not in self._columns:
+            if col >= len(self._heaps):
+                values = [''] * self._num_rows
+            elif self._num_rows:
+                values = str(self._heaps[col][:-1], 'utf-8').split(FIELD_SEP)
+            else:
+                values = []
+            values.extend(row[col] if col < len(row) else '' for row in self._extra_rows)
+            self._columns[col] = values
+        return self._columns[col]
+
+    @property
+    def ids(self) -> list:
+        return self.column(0)
+
+    @property
+    def titles(self) -> list:
+        return self.column(1)
+
+    @property
+    def search_index(self) -> SearchIndex:
+        """
+        Title search index, loaded from disk or built the first time a search is made.
+        """
+        with self._index_lock:
+            # Only an index of exactly the cached rows is worth keeping on disk
+            if self._search_index is None and self._extra_rows:
+                self._search_index = SearchIndex(self.titles)
+            elif self._search_index is None:
+                index_path = self.cache_path + INDEX_SUFFIX
+                self._search_index = SearchIndex.load(index_path, self.titles, self.stamp)
+                if self._search_index is None:
+                    self._search_index = SearchIndex(self.titles)
+                    self._search_index.save(index_path, self.stamp)
+        return self._search_index
+
+    @property
+    def id_index(self) -> dict:
+        """
+        Map each video ID to the row it first appears in, built the first time an ID is looked up.
+        """
+        with self._index_lock:
+            if self._id_index is None:
+                ids = self.ids
+                # Walk backwards so the first row wins for duplicated IDs, like the old linear search did
+                self._id_index = dict(zip(reversed(ids), range(len(ids) - 1, -1, -1)))
+                self._id_duplicates = {}
+                if len(self._id_index) < len(ids):
+                    for row, video_id in enumerate(ids):
+                        if self._id_index[video_id] != row:
+                            self._id_duplicates.setdefault(video_id, []).append(row)
+        return self._id_index
+
+    def rows_of(self, video_id: str) -> list:
+        """
+        Get every row of the given video ID in order; id_index only keeps the first of a duplicated ID.
+        """
+        row = self.id_index.get(video_id)
+        return [] if row is None else [row] + self._id_duplicates.get(video_id, [])
+
+    def get(self, video_id: str):
+        """
+        Get the row of the given video ID, or None if the ID is unknown.
+        """
+        row = self.id_index.get(video_id)
+        return None if row is None else self._row(row)
+
+    def get_many(self, video_ids) -> tuple:
+        """
+        Resolve a batch of video IDs in one pass.
+        Return a dict of the found IDs to their rows (in request order) and a list of the unknown IDs.
+        """
+        id_index = self.id_index
+        found = {}
+        missing = []
+        for video_id in video_ids:
+            row = id_index.get(video_id)
+            if row is None:
+                missing.append(video_id)
+            elif video_id not in found:
+                found[video_id] = self._row(row)
+        return found, missing
+
+    def count(self, query: str = None) -> int:
+        """
+        Count the videos whose titles match the query, or all of them. This is the query API shared with CatalogueDB,
+        not list.count.
+        """
+        return len(CatalogueView(self, query=query))
+
+    def num_pages(self, page_size: int, query: str = None) -> int:
+        return CatalogueView(self, query=query).num_pages(page_size)
+
+    def page(self, page_num: int, page_size: int, sort: str = None, descending: bool = False,
+             query: str = None) -> list:
+        """
+        Get the videos on a page, counting from 1, sorted by 'id', 'title' or 'url' and filtered by a title search.
+        """
+        return CatalogueView(self, sort, descending, query).page(page_num, page_size)
+
+    def page_after(self, cursor: str, page_size: int, sort: str = None, descending: bool = False,
+                   query: str = None) -> tuple:
+        """
+        Get the videos after the cursor, or from the start without one, and the cursor of the next page.
+        """
+        return CatalogueView(self, sort, descending, query).page_after(cursor, page_size)
+
+    def search(self, pattern: str) -> list:
+        """
+        Get the videos whose titles match the pattern, in catalogue order.
+        """
+        return [self._row(index) for index in self.search_index.search(pattern, re.IGNORECASE)]
+
+    def subscribe(self, callback) -> None:
+        """
+        Call `callback(old_len, new_len, reloaded)` after every refresh that changed the catalogue.
+        """
+        self.listeners.append(callback)
+
+    def _read_csv(self, start: int, end: int) -> bytes:
+        with open(self.csv_path, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def refresh(self) -> bool:
+        """
+        Pick up changes to the CSV file. Appended rows are parsed and indexed on their own; any other change reloads
+        the whole catalogue. Return True if anything changed.
+        """
+        with self._index_lock:
+            stamp = _csv_stat(self.csv_path)
+            if stamp == self.stamp:
+                return False
+            old_len = len(self)
+            size = stamp[1]
+            tail_start = max(0, self.parsed_size - TAIL_CHECK_SIZE)
+            appended = size >= self.parsed_size and (self.parsed_size == 0 or self._tail.endswith(b'\n')) \
+                and self._read_csv(tail_start, self.parsed_size) == self._tail
+            if appended:
+                self._append_tail(size)
+                self.stamp = stamp
+            else:
+                build_cache(self.csv_path, self.cache_path)
+                if not self._open_cache():
+                    raise Exception(f'The catalogue cache {self.cache_path} is INVALID!')
+                self._columns = {}
+                self._search_index = None
+                self._id_index = None
+                self._id_duplicates = {}
+        for callback in self.listeners:
+            callback(old_len, len(self), not appended)
+        return True
+
+    def _append_tail(self, size: int) -> None:
+        """
+        Parse the complete lines added after the parsed part of the CSV and add them to the indexes already built.
+        """
+        data = self._read_csv(self.parsed_size, size)
+        # A line still being written is left for the next refresh
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return
+        text = data[:end].decode('utf-8')
+        rows = [fix_row(row) for row in csv.reader(io.StringIO(text, newline=''))]
+
+        start = len(self)
+        self._extra_rows.extend(rows)
+        for col, values in self._columns.items():
+            values.extend(row[col] if col < len(row) else '' for row in rows)
+        if self._id_index is not None:
+            for index, row in enumerate(rows, start):
+                video_id = row[0] if row else ''
+                if self._id_index.setdefault(video_id, index) != index:
+                    self._id_duplicates.setdefault(video_id, []).append(index)
+        if self._search_index is not None:
+            self._search_index.extend(start)
+        self.parsed_size += end
+        self._tail = self._read_csv(max(0, self.parsed_size - TAIL_CHECK_SIZE), self.parsed_size)
+
+
+# inotify events meaning a file in the watched folder was written or replaced
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def _inotify_watch(folder: str):
+    """
+    Get an inotify file descriptor watching the folder, or None where inotify is not available.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes
+    import ctypes.util
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    if libc.inotify_add_watch(fd, os.fsencode(folder), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class CatalogueWatcher:
+    """
+    Background thread calling back whenever the CSV file of a catalogue changes.
+
+    The callback defaults to `catalogue.refresh`. GUI front ends should instead pass a callback that makes their own
+    thread call `refresh`, so that the listeners updating their widgets run on the GUI thread.
+    """
+
+    def __init__(self, catalogue: Catalogue, callback=None, interval: float = 1.0):
+        self.catalogue = catalogue
+        self.callback = callback or catalogue.refresh
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._watch, daemon=True)
+        self.fd = None
+
+    def start(self) -> 'CatalogueWatcher':
+        # Watch before the thread starts so no change made right after this call is missed
+        self.fd = _inotify_watch(os.path.dirname(os.path.abspath(self.catalogue.csv_path)))
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def _watch(self):
+        name = os.fsencode(os.path.basename(self.catalogue.csv_path))
+        fd = self.fd
+        last_stamp = self.catalogue.stamp
+        try:
+            while not self.stopped.is_set():
+                if fd is None:
+                    # Polling fallback: compare the mtime and size every interval
+                    self.stopped.wait(self.interval)
+                    try:
+                        stamp = _csv_stat(self.catalogue.csv_path)
+                    except OSError:
+                        continue
+                    changed = stamp != last_stamp
+                    last_stamp = stamp
+                else:
+                    changed = False
+                    readable, _, _ = select.select([fd], [], [], self.interval)
+                    if readable:
+                        data = os.read(fd, 65536)
+                        pos = 0
+                        while pos < len(data):
+                            _, _, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+                            pos += INOTIFY_EVENT.size
+                            changed = changed or data[pos:pos + length].rstrip(b'\0') == name
+                            pos += length
+                        # Let a burst of writes settle before reacting to it
+                        time.sleep(0.05)
+                if changed:
+                    self.callback()
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+
+_catalogues = {}
+
+
+def load_catalogue(csv_path: str = 'video.csv') -> Catalogue:
+    """
+    Return the catalogue for the given CSV file, mapping it only once per process.
+    """
+    key = os.path.abspath(csv_path)
+    if key not in _catalogues:
+        _catalogues[key] = Catalogue(csv_path)
+    return _catalogues[key]
@@ -0,0 +1,232 @@
+"""
+Core shared by the Green, Blue and Red video managers.
+
+The managers page through, search and save videos from the same catalogue, so that part lives here and needs only
+the standard library. The catalogue is the memory-mapped cache of video.csv, or the SQLite database imported from it
+(see video_db.py) once video.db exists; display_videos, search_videos and the downloads only use the query API both
+of them share. The heavy packages are imported when they are first needed: `requests` when the first download
+opens the shared session, tqdm when Blue draws a progress bar and PyQt6 when Red opens its window. Displaying or
+searching the catalogue from a script therefore starts in tens of milliseconds, however the downloads are made.
+
+Run it to use the catalogue from the command line, or to check that the managers still import within IMPORT_BUDGET:
+    python video_core.py display 3
+    python video_core.py display --sort title --query news --after v42
+    python video_core.py search "cat.*video"
+    python video_core.py download 1 2 3
+    python video_core.py gui
+    python video_core.py budget
+"""
+
+import os
+import sys
+import threading
+import time
+
+from download_metrics import DownloadMetrics
+from video_catalogue import load_catalogue
+from video_download import find_partial
+from video_integrity import CHECKSUM_SUFFIX, load_checksums
+
+VIDEO_FILE = 'video.csv'
+VIDEO_DB = 'video.db'
+DOWNLOAD_FOLDER = 'files'
+# Seconds importing a manager may take, catalogue included, before any download or window is requested
+IMPORT_BUDGET = 0.05
+# Packages that must not be imported until a download or window needs them
+HEAVY_MODULES = ('PyQt6', 'requests', 'tqdm', 'aiohttp', 'numpy')
+FRONT_ENDS = ('video_core', 'video_manager_green', 'video_manager_blue')
+
+
+def load_videos():
+    """
+    Get the catalogue database if video.csv was imported into one, or else the catalogue cache. Either is rebuilt only
+    when the CSV file changes.
+    """
+    if os.path.exists(VIDEO_DB):
+        from video_db import load_catalogue_db
+
+        return load_catalogue_db(VIDEO_DB, VIDEO_FILE)
+    return load_catalogue(VIDEO_FILE)
+
+
+videos = load_videos()
+# Expected checksums from the sidecar manifest, if there is one
+checksums = load_checksums(VIDEO_FILE + CHECKSUM_SUFFIX)
+
+# Record every download for the metrics option of the menus
+metrics = DownloadMetrics()
+_session = None
+_session_lock = threading.Lock()
+_caches = {}
+
+
+def get_session():
+    """
+    Get the session shared by every download, so threads reuse keep-alive connections instead of handshaking for
+    every file. It is created, and `requests` imported, with the first download.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+
+            _session = requests.Session()
+    return _session
+
+
+def get_cache(download_folder: str):
+    """
+    Get the download cache of a folder, shared by every download of the session, so its index is read only once.
+    """
+    folder = os.path.abspath(download_folder)
+    with _session_lock:
+        if folder not in _caches:
+            from download_cache import DownloadCache
+
+            _caches[folder] = DownloadCache(folder)
+    return _caches[folder]
+
+
+def get_dest_path(download_folder: str = "downloads", file_name: str = "my_video.mp4"):
+    """
+    Get the destination path to save videos.
+    """
+    # Define the download folder
+    download_path = os.path.join(os.getcwd(), download_folder)
+
+    # Create the download folder if it doesn't exist
+    if not os.path.exists(download_path):
+        os.mkdir(download_path)
+
+    # Set the destination path for the file
+    dest_path = os.path.join(download_path, file_name)
+
+    return dest_path
+
+
+def get_download_path(video_id, resume: bool = False, download_folder: str = DOWNLOAD_FOLDER):
+    """
+    Get a timestamped path to save the video to, or the path of its interrupted download when resuming.
+    """
+    file_name = f"{video_id}-{time.strftime('%Y-%m-%d-%H-%M-%S')}.mp4"
+    download_path = get_dest_path(download_folder, file_name)
+    if resume:
+        download_path = find_partial(os.path.dirname(download_path), video_id) or download_path
+    return download_path
+
+
+def display_videos(page_num: int = 1, items_per_page: int = 10, catalogue=None, sort: str = None,
+                   descending: bool = False, query: str = None, after: str = None):
+    """
+    Display items by page and show Page 1 if the page_num is invalid.
+    The videos can be sorted by 'id', 'title' or 'url' and filtered by a title search. With a cursor in `after`, the
+    page starts right after that video instead, and the cursor of the next page is shown.
+    """
+    catalogue = videos if catalogue is None else catalogue
+    if after:
+        page, cursor = catalogue.page_after(after, items_per_page, sort, descending, query)
+        print(f"Displaying the videos after {after} below:")
+        for video in page:
+            print(', '.join(video))
+        if cursor:
+            print(f"The next page starts after {cursor}.")
+        return
+
+    if page_num < 1 or page_num > catalogue.num_pages(items_per_page, query):
+        print("Invalid page number! Will display Page 1 instead:")
+        page_num = 1
+
+    print(f"Displaying Page {page_num} below:")
+    for video in catalogue.page(page_num, items_per_page, sort, descending, query):
+        print(', '.join(video))
+
+
+def search_videos(search_pattern, catalogue=None):
+    """
+    Find videos whose names match the search pattern.
+    """
+    catalogue = videos if catalogue is None else catalogue
+    for video in catalogue.search(search_pattern):
+        print(', '.join(video))
+
+
+def measure_import(module: str) -> tuple:
+    """
+    Import the module in a fresh interpreter and get the seconds it took, as reported by `python -X importtime`, with
+    the heavy packages it pulled in.
+    """
+    import subprocess
+
+    code = f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                         cwd=os.getcwd(), env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__))))
+    if res.returncode:
+        raise Exception(f'Importing {module} FAILED!\n{res.stderr}')
+    seconds = 0
+    for line in res.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            seconds = int(fields[1]) / 1000000
+    return seconds, [m for m in res.stdout.strip().split(',') if m]
+
+
+def check_import_budget(modules=FRONT_ENDS, budget: float = IMPORT_BUDGET) -> bool:
+    """
+    Print the import time of every manager, best of three, and tell whether all of them stay within the budget
+    without importing a heavy package.
+    """
+    ok = True
+    for module in modules:
+        results = [measure_import(module) for _ in range(3)]
+        seconds = min(seconds for seconds, _ in results)
+        heavy = results[0][1]
+        passed = seconds <= budget and not heavy
+        ok = ok and passed
+        print(f"{module:<24}{seconds * 1000:8.1f} ms  {'OK' if passed else 'OVER BUDGET'}"
+              + (f"  imports {', '.join(heavy)}" if heavy else ''))
+    print(f"Budget: {budget * 1000:.0f} ms per manager")
+    return ok
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Page through, search and download videos from the catalogue.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    display = commands.add_parser('display', help='Display a page of the catalogue')
+    display.add_argument('page_num', type=int, nargs='?', default=1)
+    display.add_argument('--items', type=int, default=10, help='Videos per page')
+    display.add_argument('--sort', choices=('id', 'title', 'url'), help='Sort the videos by this column')
+    display.add_argument('--desc', action='store_true', help='Sort in descending order')
+    display.add_argument('--query', help='Only display the videos whose titles match this pattern')
+    display.add_argument('--after', help='Display the page after this cursor or video ID instead of a page number')
+    search = commands.add_parser('search', help='Find videos whose names match a pattern')
+    search.add_argument('pattern')
+    download = commands.add_parser('download', help='Download videos with the Blue manager')
+    download.add_argument('video_ids', nargs='+')
+    download.add_argument('--threads', type=int, default=8)
+    commands.add_parser('gui', help='Open the Red manager')
+    budget = commands.add_parser('budget', help='Check the import time of the managers')
+    budget.add_argument('--budget', type=float, default=IMPORT_BUDGET, help='Seconds allowed per manager')
+    args = parser.parse_args()
+
+    if args.command == 'display':
+        display_videos(args.page_num, args.items, sort=args.sort, descending=args.desc, query=args.query,
+                       after=args.after)
+    elif args.command == 'search':
+        search_videos(args.pattern)
+    elif args.command == 'download':
+        from video_manager_blue import download_videos
+
+        download_videos(list(dict.fromkeys(args.video_ids)), args.threads)
+    elif args.command == 'gui':
+        import video_manager_red
+
+        video_manager_red.main(video_manager_red.videos)
+    elif not check_import_budget(budget=args.budget):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
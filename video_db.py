@@ -0,0 +1,373 @@
+"""
+SQLite backend for the video catalogue.
+
+`python video_db.py video.csv video.db` imports the CSV into an SQLite database. The import streams the rows in
+batches, so it never holds the catalogue in memory. The database keeps the rows with indexes on ID, title and URL, and
+a trigram FTS5 index on the titles. CatalogueDB answers the same queries as the memory-mapped Catalogue: get,
+get_many, page, page_after, search and count. None of them loads more than the rows it returns, so memory stays flat
+however large the catalogue grows.
+
+A title search is a regular expression, as with the Catalogue. The literal substrings every match must contain are
+looked up in the FTS5 index, and only the titles found there are checked against the pattern itself. Rows appended to
+the CSV are imported on their own by `refresh`, so a CatalogueWatcher can keep the database up to date. Any other
+change to the CSV imports it again.
+"""
+
+import csv
+import io
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from video_catalogue import TAIL_CHECK_SIZE, fix_row
+from video_search import required_literals
+from video_view import make_cursor, parse_cursor
+
+DB_VERSION = 1
+IMPORT_BATCH = 10000
+SORT_COLUMNS = {'id': 'id', 'title': 'title', 'url': 'url'}
+# The FTS5 trigram tokenizer only indexes substrings of three characters or more
+MIN_LITERAL = 3
+# Batches of IDs up to SQLite's lowest limit on parameters are looked up with IN, larger ones through a temporary table
+MAX_PARAMS = 999
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE videos (row INTEGER PRIMARY KEY, id TEXT NOT NULL, title TEXT NOT NULL, url TEXT NOT NULL, checksum TEXT);
+CREATE VIRTUAL TABLE titles USING fts5(title, content='videos', content_rowid='row', tokenize='trigram');
+'''
+INDEXES = '''
+CREATE INDEX videos_id ON videos (id, row);
+CREATE INDEX videos_title ON videos (title, row);
+CREATE INDEX videos_url ON videos (url, row);
+'''
+
+
+def _csv_stat(csv_path: str) -> tuple:
+    stat = os.stat(csv_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _to_record(row_num: int, row: list) -> tuple:
+    fields = row[:3] + [''] * (3 - len(row[:3]))
+    return (row_num, *fields, row[3] if len(row) > 3 else None)
+
+
+def _to_row(record) -> list:
+    row = list(record[1:4])
+    if record[4]:
+        row.append(record[4])
+    return row
+
+
+def _insert(db, rows: list, start: int) -> None:
+    records = [_to_record(row_num, row) for row_num, row in enumerate(rows, start)]
+    db.executemany('INSERT INTO videos VALUES (?, ?, ?, ?, ?)', records)
+    db.executemany('INSERT INTO titles (rowid, title) VALUES (?, ?)', [(r[0], r[2]) for r in records])
+
+
+def import_csv(csv_path: str, db_path: str, batch_size: int = IMPORT_BATCH) -> int:
+    """
+    Import the CSV file into a new database, replacing the old one atomically. Return the number of rows imported.
+    """
+    mtime_ns, size = _csv_stat(csv_path)
+    tmp_path = f"{db_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    try:
+        # Nothing has to survive a crash of the import but the finished file
+        db.execute('PRAGMA journal_mode = OFF')
+        db.execute('PRAGMA synchronous = OFF')
+        db.executescript(SCHEMA)
+        num_rows = 0
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            batch = []
+            for row in csv.reader(f):
+                batch.append(fix_row(row))
+                if len(batch) >= batch_size:
+                    _insert(db, batch, num_rows)
+                    num_rows += len(batch)
+                    batch = []
+            _insert(db, batch, num_rows)
+            num_rows += len(batch)
+        db.executescript(INDEXES)
+        with open(csv_path, 'rb') as f:
+            f.seek(max(0, size - TAIL_CHECK_SIZE))
+            tail = f.read(size - max(0, size - TAIL_CHECK_SIZE))
+        db.executemany('INSERT INTO meta VALUES (?, ?)', [('version', DB_VERSION), ('mtime_ns', mtime_ns),
+                                                          ('size', size), ('parsed_size', size), ('tail', tail)])
+        db.commit()
+    finally:
+        db.close()
+    os.replace(tmp_path, db_path)
+    return num_rows
+
+
+def _regexp(pattern, text) -> bool:
+    # re keeps the compiled patterns cached, so the pattern is not compiled again for every row
+    return text is not None and re.search(pattern, text, re.IGNORECASE) is not None
+
+
+class CatalogueDB:
+    """
+    Video catalogue stored in an SQLite database, with the same query API as the memory-mapped Catalogue.
+    Rows are returned as lists of strings: ID, title, URL and, when there is one, the checksum.
+    """
+
+    def __init__(self, db_path: str = 'video.db', csv_path: str = 'video.csv'):
+        self.db_path = db_path
+        self.csv_path = csv_path
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.db = None
+        if not self._open() or self._stale():
+            import_csv(csv_path, db_path)
+            if not self._open():
+                raise Exception(f'The catalogue database {db_path} is INVALID!')
+
+    def _open(self) -> bool:
+        """
+        Connect to the database and read its metadata. Return False if it has to be imported again.
+        """
+        if not os.path.exists(self.db_path):
+            return False
+        db = sqlite3.connect(self.db_path, check_same_thread=False)
+        db.create_function('regexp', 2, _regexp, deterministic=True)
+        try:
+            meta = dict(db.execute('SELECT key, value FROM meta'))
+        except sqlite3.DatabaseError:
+            db.close()
+            return False
+        if meta.get('version') != DB_VERSION:
+            db.close()
+            return False
+        if self.db is not None:
+            self.db.close()
+        self.db = db
+        self.stamp = (meta['mtime_ns'], meta['size'])
+        self.parsed_size = meta['parsed_size']
+        self._tail = meta['tail']
+        # Rows are numbered from 0 without gaps, and the last one is found through the primary key without a scan
+        self._num_rows = db.execute('SELECT coalesce(max(row) + 1, 0) FROM videos').fetchone()[0]
+        return True
+
+    def _stale(self) -> bool:
+        # Without its CSV the database is the catalogue itself
+        return os.path.exists(self.csv_path) and _csv_stat(self.csv_path) != self.stamp
+
+    def __len__(self):
+        return self._num_rows
+
+    def __repr__(self):
+        return f"CatalogueDB({self.db_path!r}, {len(self)} videos)"
+
+    def _query(self, sql: str, params=()) -> list:
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def get(self, video_id: str):
+        """
+        Get the row of the given video ID, or None if the ID is unknown.
+        """
+        records = self._query('SELECT * FROM videos WHERE id = ? ORDER BY row LIMIT 1', (video_id,))
+        return _to_row(records[0]) if records else None
+
+    def get_many(self, video_ids) -> tuple:
+        """
+        Resolve a batch of video IDs in one pass.
+        Return a dict of the found IDs to their rows (in request order) and a list of the unknown IDs.
+        """
+        video_ids = list(video_ids)
+        wanted = list(dict.fromkeys(video_ids))
+        first_rows = 'SELECT * FROM videos WHERE row IN (SELECT min(row) FROM videos WHERE id IN {} GROUP BY id)'
+        if len(wanted) <= MAX_PARAMS:
+            records = self._query(first_rows.format(f"({', '.join('?' * len(wanted))})"), wanted)
+        else:
+            with self.lock:
+                self.db.execute('CREATE TEMP TABLE IF NOT EXISTS wanted_ids (id TEXT PRIMARY KEY)')
+                self.db.executemany('INSERT INTO wanted_ids VALUES (?)', [(video_id,) for video_id in wanted])
+                try:
+                    records = self.db.execute(first_rows.format('wanted_ids')).fetchall()
+                finally:
+                    self.db.execute('DELETE FROM wanted_ids')
+                    self.db.commit()
+        rows = {record[1]: _to_row(record) for record in records}
+        found = {}
+        missing = []
+        for video_id in video_ids:
+            if video_id in rows:
+                found.setdefault(video_id, rows[video_id])
+            else:
+                missing.append(video_id)
+        return found, missing
+
+    def _filter(self, query: str = None) -> tuple:
+        """
+        Get the WHERE clause and its parameters selecting the videos whose titles match the query.
+        """
+        if not query:
+            return '', []
+        # Fail on an invalid pattern here rather than inside SQLite
+        re.compile(query, re.IGNORECASE)
+        literals = [literal for literal in required_literals(query, re.IGNORECASE) if len(literal) >= MIN_LITERAL]
+        if not literals:
+            return 'WHERE title REGEXP ?', [query]
+        phrases = ' AND '.join('"' + literal.replace('"', '""') + '"' for literal in literals)
+        # The index folds case its own way, so even a plain substring is confirmed with the pattern
+        return 'WHERE row IN (SELECT rowid FROM titles WHERE titles MATCH ?) AND title REGEXP ?', [phrases, query]
+
+    def _order(self, sort: str = None, descending: bool = False) -> tuple:
+        if sort is not None and sort.lower() not in SORT_COLUMNS:
+            raise Exception(f"The sort key {sort} is INVALID! Please choose from {', '.join(SORT_COLUMNS)}")
+        direction = 'DESC' if descending else 'ASC'
+        column = SORT_COLUMNS[sort.lower()] if sort else None
+        if column is None:
+            return f'ORDER BY row {direction}', None
+        return f'ORDER BY {column} {direction}, row {direction}', column
+
+    def count(self, query: str = None) -> int:
+        """
+        Count the videos whose titles match the query, or all of them.
+        """
+        where, params = self._filter(query)
+        return self._query(f'SELECT count(*) FROM videos {where}', params)[0][0] if where else len(self)
+
+    def num_pages(self, page_size: int, query: str = None) -> int:
+        return max(1, (self.count(query) - 1) // page_size + 1)
+
+    def page(self, page_num: int, page_size: int, sort: str = None, descending: bool = False,
+             query: str = None) -> list:
+        """
+        Get the videos on a page, counting from 1, sorted by 'id', 'title' or 'url' and filtered by a title search.
+        """
+        where, params = self._filter(query)
+        order, _ = self._order(sort, descending)
+        records = self._query(f'SELECT * FROM videos {where} {order} LIMIT ? OFFSET ?',
+                              params + [page_size, (page_num - 1) * page_size])
+        return [_to_row(record) for record in records]
+
+    def page_after(self, cursor: str, page_size: int, sort: str = None, descending: bool = False,
+                   query: str = None) -> tuple:
+        """
+        Get the videos after the cursor, or from the start without one, and the cursor of the next page, which is None
+        on the last page. Cursors are the same as those of the Catalogue. The rows before the cursor are skipped
+        through the index rather than counted.
+        """
+        where, params = self._filter(query)
+        order, column = self._order(sort, descending)
+        if cursor:
+            keys = f'{column}, row' if column else 'row'
+            video_id, row = parse_cursor(cursor)
+            records = self._query(f'SELECT {keys} FROM videos WHERE row = ? AND id = ?', (row, video_id)) \
+                if row is not None else []
+            # Like the Catalogue, fall back to the first row of a bare ID or of a cursor whose row has changed
+            for key in (cursor, video_id):
+                if records:
+                    break
+                records = self._query(f'SELECT {keys} FROM videos WHERE id = ? ORDER BY row LIMIT 1', (key,))
+            if not records:
+                raise Exception(f'The cursor {cursor} is INVALID!')
+            key = list(records[0])
+            after = f"({keys}) {'<' if descending else '>'} ({', '.join('?' * len(key))})"
+            where = f'{where} AND {after}' if where else f'WHERE {after}'
+            params = params + key
+        records = self._query(f'SELECT * FROM videos {where} {order} LIMIT ?', params + [page_size + 1])
+        videos = [_to_row(record) for record in records[:page_size]]
+        last = records[page_size - 1] if len(records) > page_size else None
+        return videos, make_cursor(last[1], last[0]) if last else None
+
+    def search(self, pattern: str) -> list:
+        """
+        Get the videos whose titles match the pattern, in catalogue order.
+        """
+        where, params = self._filter(pattern)
+        return [_to_row(record) for record in self._query(f'SELECT * FROM videos {where} ORDER BY row', params)]
+
+    def subscribe(self, callback) -> None:
+        """
+        Call `callback(old_len, new_len, reloaded)` after every refresh that changed the catalogue.
+        """
+        self.listeners.append(callback)
+
+    def refresh(self) -> bool:
+        """
+        Pick up changes to the CSV file. Appended rows are imported on their own; any other change imports the whole
+        file again. Return True if anything changed.
+        """
+        with self.lock:
+            try:
+                stamp = _csv_stat(self.csv_path)
+            except OSError:
+                return False
+            if stamp == self.stamp:
+                return False
+            old_len = len(self)
+            size = stamp[1]
+            with open(self.csv_path, 'rb') as f:
+                f.seek(max(0, self.parsed_size - TAIL_CHECK_SIZE))
+                tail = f.read(self.parsed_size - max(0, self.parsed_size - TAIL_CHECK_SIZE))
+                f.seek(self.parsed_size)
+                data = f.read(size - self.parsed_size) if size >= self.parsed_size else b''
+            appended = size >= self.parsed_size and (self.parsed_size == 0 or self._tail.endswith(b'\n')) \
+                and tail == self._tail
+            if appended:
+                self._append(data, stamp)
+            else:
+                import_csv(self.csv_path, self.db_path)
+                if not self._open():
+                    raise Exception(f'The catalogue database {self.db_path} is INVALID!')
+        for callback in self.listeners:
+            callback(old_len, len(self), not appended)
+        return True
+
+    def _append(self, data: bytes, stamp: tuple) -> None:
+        """
+        Import the complete lines added after the parsed part of the CSV.
+        """
+        # A line still being written is left for the next refresh
+        end = data.rfind(b'\n') + 1
+        rows = [fix_row(row) for row in csv.reader(io.StringIO(data[:end].decode('utf-8'), newline=''))]
+        _insert(self.db, rows, self._num_rows)
+        self.parsed_size += end
+        self._tail = (self._tail + data[:end])[-TAIL_CHECK_SIZE:]
+        self.stamp = stamp
+        self.db.executemany('UPDATE meta SET value = ? WHERE key = ?',
+                            [(stamp[0], 'mtime_ns'), (stamp[1], 'size'), (self.parsed_size, 'parsed_size'),
+                             (self._tail, 'tail')])
+        self.db.commit()
+        self._num_rows += len(rows)
+
+
+_databases = {}
+
+
+def load_catalogue_db(db_path: str = 'video.db', csv_path: str = 'video.csv') -> CatalogueDB:
+    """
+    Return the catalogue database for the given path, connecting only once per process.
+    """
+    key = os.path.abspath(db_path)
+    if key not in _databases:
+        _databases[key] = CatalogueDB(db_path, csv_path)
+    return _databases[key]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Import the video catalogue CSV into an SQLite database.')
+    parser.add_argument('csv_path', nargs='?', default='video.csv')
+    parser.add_argument('db_path', nargs='?', default='video.db')
+    parser.add_argument('--batch', type=int, default=IMPORT_BATCH, help='Rows inserted per statement batch')
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    num_rows = import_csv(args.csv_path, args.db_path, args.batch)
+    print(f"Imported {num_rows} videos from {args.csv_path} into {args.db_path} in "
+          f"{time.monotonic() - started:.1f} seconds.")
+
+
+if __name__ == '__main__':
+    main()
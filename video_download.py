@@ -0,0 +1,334 @@
+"""
+Download engines shared by the video managers.
+
+The asyncio engine runs every download on one thread over a pool of keep-alive connections, bounded per host, so a
+large batch pays one TCP+TLS handshake per connection instead of one per file.
+
+Every engine streams with large read sizes that grow with the measured throughput, into a reusable buffer, and reports
+progress through a rate-limited callback instead of on every chunk.
+
+The resumable engine splits a large file into byte ranges fetched over several connections and records its progress in
+a sidecar state file, so an interrupted download carries on from the completed bytes.
+
+Every engine raises DownloadError on an error status instead of saving the error page as the video, and gives up on a
+server that does not connect or stops sending for REQUEST_TIMEOUT seconds.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+# A read that fills the buffer faster than this means the buffer is too small for the link
+FAST_READ_TIME = 0.05
+PROGRESS_INTERVAL = 0.25
+# Seconds to wait for a connection, and then for every read
+REQUEST_TIMEOUT = (10, 60)
+
+
+class DownloadError(Exception):
+    """
+    Raised when the server answers a download with an error status.
+    """
+
+    def __init__(self, url: str, status: int):
+        super().__init__(f'The response to {url} is INVALID! The server answered with HTTP status {status}')
+        self.url = url
+        self.status = status
+
+
+def check_response(res, url: str) -> None:
+    """
+    Raise DownloadError, after closing the response, unless its status is a success. Takes a `requests` or an aiohttp
+    response.
+    """
+    status = res.status_code if hasattr(res, 'status_code') else res.status
+    if not 200 <= status < 300:
+        res.close()
+        raise DownloadError(url, status)
+
+
+class RateLimitedProgress:
+    """
+    Collect byte counts and pass them on to the callback at most once per interval.
+    Safe to call from several threads, e.g. the segments of one resumable download.
+    """
+
+    def __init__(self, callback, interval: float = PROGRESS_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self.pending = 0
+        self.last_report = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __call__(self, n_bytes: int):
+        with self.lock:
+            self.pending += n_bytes
+            now = time.monotonic()
+            if now - self.last_report < self.interval:
+                return
+            self.last_report = now
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, 0
+        if pending:
+            self.callback(pending)
+
+
+class HashingWriter:
+    """
+    File wrapper that feeds every written block to a hashlib object on the way through.
+    """
+
+    def __init__(self, f, hasher):
+        self.f = f
+        self.hasher = hasher
+
+    def write(self, data) -> int:
+        self.hasher.update(data)
+        return self.f.write(data)
+
+
+def stream_to_file(res, f, on_chunk=None) -> int:
+    """
+    Copy the body of a streamed `requests` response into an open file and return the number of bytes copied.
+
+    The body is read into one reusable buffer whose size starts at MIN_CHUNK_SIZE and doubles, up to MAX_CHUNK_SIZE,
+    whenever a read fills it quickly. `on_chunk(n_bytes)` is called after every write.
+    """
+    raw = res.raw
+    raw.decode_content = True
+    chunk_size = MIN_CHUNK_SIZE
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        started = time.monotonic()
+        n_bytes = raw.readinto(view)
+        if not n_bytes:
+            break
+        f.write(view[:n_bytes])
+        total += n_bytes
+        if on_chunk:
+            on_chunk(n_bytes)
+        if n_bytes == chunk_size and chunk_size < MAX_CHUNK_SIZE and time.monotonic() - started < FAST_READ_TIME:
+            chunk_size *= 2
+            view.release()
+            buffer = bytearray(chunk_size)
+            view = memoryview(buffer)
+    return total
+
+
+async def _fetch(session, url: str, dest_path: str, on_chunk=None, record=None, checksum: str = None) -> str:
+    """
+    Stream one URL to the destination path, verifying it like video_integrity.fetch_verified does.
+    """
+    from video_integrity import StreamVerifier, expected_length
+
+    verifier = StreamVerifier(checksum)
+    size = 0
+    async with session.get(url) as res:
+        if record:
+            record.response(res.status)
+        check_response(res, url)
+        with open(dest_path, 'wb') as f:
+            writer = verifier.wrap(f)
+            # Take whatever the connection has buffered rather than slicing it into small chunks
+            async for chunk in res.content.iter_any():
+                writer.write(chunk)
+                size += len(chunk)
+                if record:
+                    record.chunk(len(chunk))
+                if on_chunk:
+                    on_chunk(len(chunk))
+        verifier.check(dest_path, size, expected_length(res.headers))
+    return dest_path
+
+
+async def _fetch_all(jobs: list, limit: int, limit_per_host: int, on_done=None, on_chunk=None, metrics=None) -> list:
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host)
+    timeout = aiohttp.ClientTimeout(sock_connect=REQUEST_TIMEOUT[0], sock_read=REQUEST_TIMEOUT[1])
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def run(url, dest_path, checksum=None):
+            from video_integrity import REFETCH_ATTEMPTS, IntegrityError
+
+            record = metrics.track(url, 'asyncio') if metrics is not None else None
+            for attempt in range(REFETCH_ATTEMPTS + 1):
+                try:
+                    result = await _fetch(session, url, dest_path, on_chunk, record, checksum)
+                except Exception as e:
+                    result = e
+                # Fetch a file that failed verification again; it has been quarantined already
+                if not isinstance(result, IntegrityError) or attempt == REFETCH_ATTEMPTS:
+                    break
+                if record:
+                    record.retry()
+            if record:
+                record.finish(result if isinstance(result, Exception) else None)
+            if on_done:
+                on_done(dest_path, result)
+            return result
+
+        import asyncio
+
+        return await asyncio.gather(*(run(*job) for job in jobs))
+
+
+def download_all_async(jobs: list, limit: int = 256, limit_per_host: int = 32, on_done=None, on_chunk=None,
+                       metrics=None) -> list:
+    """
+    Download (url, dest_path) or (url, dest_path, checksum) jobs concurrently on one thread.
+
+    At most `limit` connections are open in total and `limit_per_host` to any single host; connections are kept alive
+    and reused across files. `on_done(dest_path, result)` is called as each file finishes and `on_chunk(n_bytes)` as
+    bytes arrive. With a DownloadMetrics registry, every download is recorded in it. Return the destination path, or
+    the exception raised, for every job in order.
+    """
+    import asyncio
+
+    return asyncio.run(_fetch_all(jobs, limit, limit_per_host, on_done, on_chunk, metrics))
+
+
+STATE_SUFFIX = '.state'
+MIN_SEGMENT_SIZE = 1024 * 1024
+CHECKPOINT_SIZE = 4 * 1024 * 1024
+
+
+def probe(url: str, session=None) -> tuple:
+    """
+    Get the size of the file behind the URL and whether the server accepts byte ranges for it. An error status gives
+    size 0, so the download falls back to a single stream, which reports the error.
+    """
+    import requests
+
+    res = (session or requests).head(url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+    if res.status_code >= 400:
+        return 0, False
+    size = int(res.headers.get('Content-Length', 0))
+    accepts_ranges = res.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    return size, accepts_ranges and size > 0
+
+
+def find_partial(download_folder: str, video_id: str):
+    """
+    Find an interrupted download of the video, named `<video ID>-<timestamp>.mp4`, so it can be resumed under the same
+    name. The ID must match exactly: the partial file of `a-b` is not one of `a`.
+    """
+    if not os.path.isdir(download_folder):
+        return None
+    pattern = re.compile(re.escape(f'{video_id}-') + r'\d{4}(?:-\d{2}){5}\.mp4' + re.escape(STATE_SUFFIX))
+    for name in sorted(os.listdir(download_folder)):
+        if pattern.fullmatch(name):
+            return os.path.join(download_folder, name[:-len(STATE_SUFFIX)])
+    return None
+
+
+def _load_state(state_path: str, url: str, size: int):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('url') != url or state.get('size') != size:
+        return None
+    return state
+
+
+def _save_state(state_path: str, state: dict) -> None:
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+
+def download_resumable(url: str, dest_path: str, segments: int = 4, session=None, on_chunk=None, on_size=None,
+                       on_resume=None) -> str:
+    """
+    Download a file as several byte ranges fetched in parallel into a preallocated file.
+
+    The progress of every segment is kept in a sidecar state file, so calling this again with the same destination
+    path after a crash or cancel only fetches the missing bytes. Servers that do not accept ranges get a plain
+    single-stream download instead. `on_chunk(n_bytes)` is called as bytes arrive, `on_size(size)` once the size of
+    the file is known and `on_resume(n_bytes)` with the bytes already done when a download carries on, so progress
+    can start from there without counting them as transferred.
+    """
+    import requests
+
+    session = session or requests.Session()
+    state_path = dest_path + STATE_SUFFIX
+    size, accepts_ranges = probe(url, session)
+    if size and on_size:
+        on_size(size)
+    if not accepts_ranges:
+        res = session.get(url, stream=True, timeout=REQUEST_TIMEOUT)
+        check_response(res, url)
+        with open(dest_path, 'wb') as f:
+            stream_to_file(res, f, on_chunk)
+        return dest_path
+
+    state = _load_state(state_path, url, size) if os.path.exists(dest_path) else None
+    if state is None:
+        # Split the file evenly, but never into segments too small to be worth a connection
+        segments = max(1, min(segments, size // MIN_SEGMENT_SIZE))
+        bounds = [size * i // segments for i in range(segments + 1)]
+        state = {'url': url, 'size': size, 'segments': [[bounds[i], bounds[i + 1], 0] for i in range(segments)]}
+        with open(dest_path, 'wb') as f:
+            f.truncate(size)
+        _save_state(state_path, state)
+    elif on_resume:
+        on_resume(sum(done for _, _, done in state['segments']))
+
+    lock = threading.Lock()
+
+    def checkpoint(segment: list, done: int):
+        with lock:
+            segment[2] = done
+            _save_state(state_path, state)
+
+    def fetch(segment: list):
+        start, end, done = segment
+        if start + done >= end:
+            return
+        res = session.get(url, headers={'Range': f'bytes={start + done}-{end - 1}'}, stream=True,
+                          timeout=REQUEST_TIMEOUT)
+        check_response(res, url)
+        if res.status_code != 206:
+            res.close()
+            raise Exception(f'The server ignored the byte range request for {url}!')
+        with open(dest_path, 'r+b') as f:
+            f.seek(start + done)
+            progress = {'done': done, 'unsaved': 0}
+
+            def on_segment_chunk(n_bytes):
+                progress['done'] += n_bytes
+                progress['unsaved'] += n_bytes
+                if on_chunk:
+                    on_chunk(n_bytes)
+                # Only record bytes as done once they have left our buffers
+                if progress['unsaved'] >= CHECKPOINT_SIZE:
+                    f.flush()
+                    checkpoint(segment, progress['done'])
+                    progress['unsaved'] = 0
+
+            try:
+                stream_to_file(res, f, on_segment_chunk)
+            finally:
+                f.flush()
+                checkpoint(segment, progress['done'])
+            done = progress['done']
+        if start + done < end:
+            raise Exception(f'The connection was closed before the byte range ended for {url}!')
+
+    from multiprocessing.pool import ThreadPool
+
+    with ThreadPool(processes=len(state['segments'])) as pool:
+        pool.map(fetch, state['segments'])
+    os.remove(state_path)
+    return dest_path
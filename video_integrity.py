@@ -0,0 +1,186 @@
+"""
+Integrity checks for downloaded videos.
+
+The expected checksum of a video comes from an optional fourth column of video.csv, or from a sidecar manifest next
+to it (video.csv.checksums) in the format written by sha256sum/b2sum. A checksum is either `algorithm:hexdigest`,
+e.g. `blake2b:...`, or a bare hex digest: 64 digits mean SHA-256 and 128 digits BLAKE2b.
+
+Streamed downloads are hashed on their way to disk, so verifying costs no second pass over the file, and the number of
+bytes received is compared with Content-Length. A file that fails either check is moved to a quarantine folder next
+to it and fetched again. Segmented downloads write their ranges out of order, so they are hashed after the fact, and
+only when a checksum is expected.
+"""
+
+import hashlib
+import os
+import time
+
+from video_download import REQUEST_TIMEOUT, HashingWriter, check_response, stream_to_file
+
+CHECKSUM_SUFFIX = '.checksums'
+# Bare hex digests are told apart by their length
+HEX_ALGORITHMS = {64: 'sha256', 128: 'blake2b'}
+QUARANTINE_FOLDER = '.quarantine'
+# Times a file that failed verification is fetched again
+REFETCH_ATTEMPTS = 2
+READ_SIZE = 1024 * 1024
+
+
+class IntegrityError(Exception):
+    """
+    Raised when a downloaded file does not match its checksum or announced length.
+    """
+
+
+def parse_checksum(text: str):
+    """
+    Get (algorithm, hexdigest) from a checksum, or None if the text is not one.
+    """
+    text = text.strip()
+    name, sep, digest = text.partition(':')
+    if sep:
+        name = name.strip().lower()
+    else:
+        name, digest = HEX_ALGORITHMS.get(len(text)), text
+    digest = digest.strip().lower()
+    if name not in hashlib.algorithms_available or not digest:
+        return None
+    try:
+        int(digest, 16)
+    except ValueError:
+        return None
+    return (name, digest) if hashlib.new(name).digest_size * 2 == len(digest) else None
+
+
+def is_checksum(text: str) -> bool:
+    return parse_checksum(text) is not None
+
+
+def load_checksums(path: str) -> dict:
+    """
+    Map video IDs to checksums from a manifest of `<checksum> <video ID or file name>` lines. A missing manifest is
+    just empty.
+    """
+    checksums = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split(None, 1)
+                if len(parts) < 2 or line.startswith('#') or not is_checksum(parts[0]):
+                    continue
+                # sha256sum marks binary mode with a '*' before the file name
+                name = os.path.basename(parts[1].strip().lstrip('*'))
+                video_id = name[:-len('.mp4')] if name.endswith('.mp4') else name
+                checksums[video_id] = parts[0]
+    except OSError:
+        pass
+    return checksums
+
+
+def checksum_of(video_info: list, checksums: dict = None):
+    """
+    Get the expected checksum of a catalogue row, preferring the manifest over the checksum column, or None.
+    """
+    checksum = (checksums or {}).get(video_info[0])
+    if not checksum and len(video_info) > 3 and is_checksum(video_info[3]):
+        checksum = video_info[3]
+    return checksum or None
+
+
+def quarantine(path: str) -> str:
+    """
+    Move a bad file into the quarantine folder next to it and return its new path.
+    """
+    import uuid
+
+    folder = os.path.join(os.path.dirname(path), QUARANTINE_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    new_path = os.path.join(folder, f"{os.path.basename(path)}.{time.strftime('%Y-%m-%d-%H-%M-%S')}-"
+                                    f"{uuid.uuid4().hex[:8]}")
+    os.replace(path, new_path)
+    return new_path
+
+
+class StreamVerifier:
+    """
+    Hash bytes on their way to a file and check them against the expected checksum and length once done.
+    """
+
+    def __init__(self, checksum: str = None):
+        parsed = parse_checksum(checksum) if checksum else None
+        if checksum and parsed is None:
+            raise Exception(f'The checksum {checksum} is INVALID!')
+        self.algorithm, self.digest = parsed or (None, None)
+        self.hasher = hashlib.new(self.algorithm) if parsed else None
+
+    def wrap(self, f):
+        return HashingWriter(f, self.hasher) if self.hasher else f
+
+    def check(self, path: str, size: int, expected_size: int = None) -> None:
+        """
+        Raise IntegrityError, after quarantining the file, if the size or the hash is not the expected one.
+        """
+        if expected_size is not None and size != expected_size:
+            _mismatch(path, f'{size} bytes were received but {expected_size} were announced')
+        if self.hasher and self.hasher.hexdigest() != self.digest:
+            _mismatch(path, f'the {self.algorithm} checksum is {self.hasher.hexdigest()} instead of {self.digest}')
+
+
+def _mismatch(path: str, message: str):
+    raise IntegrityError(f'The download is INVALID: {message}. It was moved to {quarantine(path)}!')
+
+
+def expected_length(headers):
+    """
+    Get the body length announced in the headers, or None if the decoded body may not have that length.
+    """
+    # A body compressed on the wire is longer once decoded
+    if headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        return None
+    length = headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+def fetch_verified(url: str, dest_path: str, checksum: str = None, session=None, on_chunk=None, on_size=None) -> int:
+    """
+    Stream the URL to dest_path, hashing it on the way when a checksum is expected, and check it. Return the number of
+    bytes written, or raise IntegrityError after quarantining a bad file. An error status raises DownloadError before
+    anything is written.
+    """
+    import requests
+
+    res = (session or requests).get(url, stream=True, timeout=REQUEST_TIMEOUT)
+    check_response(res, url)
+    length = expected_length(res.headers)
+    if length and on_size:
+        on_size(length)
+    verifier = StreamVerifier(checksum)
+    with open(dest_path, 'wb') as f:
+        size = stream_to_file(res, verifier.wrap(f), on_chunk)
+    verifier.check(dest_path, size, length)
+    return size
+
+
+def verify_file(path: str, checksum: str = None, expected_size: int = None) -> None:
+    """
+    Check a file already on disk, for downloads that could not be hashed as they streamed.
+    """
+    size = os.path.getsize(path)
+    verifier = StreamVerifier(checksum)
+    if verifier.hasher:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(READ_SIZE), b''):
+                verifier.hasher.update(block)
+    verifier.check(path, size, expected_size)
+
+
+def refetching(download, attempts: int = REFETCH_ATTEMPTS):
+    """
+    Call `download()` and call it again, up to `attempts` more times, while it raises IntegrityError.
+    """
+    for attempt in range(attempts + 1):
+        try:
+            return download()
+        except IntegrityError:
+            if attempt == attempts:
+                raise
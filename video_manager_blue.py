@@ -6,123 +6,190 @@ Blue version: does what Green version does and also:
     - Apply multi-threading to speed up the download
 """
 
-import csv
 import os
-import re
-import time
-from multiprocessing.pool import ThreadPool
+import threading
 
-import requests
-from tqdm import tqdm
+from download_probe import DiskSpaceError, ProbeCache, check_disk_space, probe_all
+from download_scheduler import DownloadScheduler
+from video_catalogue import CatalogueWatcher
+from video_core import DOWNLOAD_FOLDER, checksums, display_videos, get_cache, get_dest_path, get_download_path, \
+    get_session, metrics, search_videos, videos
+from video_download import RateLimitedProgress, download_all_async, download_resumable
+from video_integrity import checksum_of, fetch_verified, refetching, verify_file
 
-VIDEO_FILE = 'video.csv'
-DOWNLOAD_FOLDER = 'files'
+BACKENDS = ('threads', 'asyncio')
 
-# Get video info from the file
-videos = []
-with open(VIDEO_FILE, 'r', encoding='utf-8') as f:
-    reader = csv.reader(f)
-    for row in reader:
-        # Fix the wrong comma used in the mid of the news title
-        if len(row) > 3:
-            row[1:3] = ['，'.join(row[1:3])]
-        videos.append(row)
 
-
-def get_dest_path(download_folder: str = "downloads", file_name: str = "my_video.mp4"):
-    """
-    Get the destination path to save videos.
-    """
-
-    # Define the download folder
-    download_path = os.path.join(os.getcwd(), download_folder)
-
-    # Create the download folder if it doesn't exist
-    if not os.path.exists(download_path):
-        os.mkdir(download_path)
-
-    # Set the destination path for the file
-    destination_path = os.path.join(download_path, file_name)
-
-    return destination_path
-
-
-def display_videos(page_num: int = 1, items_per_page: int = 10):
-    """
-    Display items by page and show Page 1 if the page_num is invalid.
-    """
-    exact_page = len(videos) / items_per_page
-    total_page = int(exact_page) + (float(exact_page) > int(exact_page))
-    if page_num < 0 or page_num > total_page:
-        print("Invalid page number! Will display Page 1 instead:")
-        page_num = 1
-
-    print(f"Displaying Page {page_num} below:")
-    start_index = (page_num - 1) * items_per_page
-    end_index = start_index + items_per_page
-    for video in videos[start_index:end_index]:
-        print(', '.join(video))
-
-
-def search_videos(search_pattern):
-    """
-    Find videos whose names match the search pattern.
-    """
-    for video in videos:
-        if re.search(search_pattern, video[1], re.IGNORECASE):
-            print(', '.join(video))
-
-
-def download_video(video_id, pbar):
+def download_video(video_id, pbar, segments: int = 0, cache: bool = True):
     """
     Download the desired video and save it to the destination folder.
+    With `segments` set, fetch the video over that many connections and resume any interrupted download of it.
+    Otherwise, with `cache` set, skip the transfer if the video has not changed since it was last downloaded.
     """
     # Find video info for given ID
-    video_info = None
-    for video in videos:
-        if video[0] == video_id:
-            video_info = video
-            break
+    video_info = videos.get(video_id)
     if not video_info:
         print('Video ID NOT found!')
         return
 
     # Construct filename and download path
-    file_name = f"{video_id}-{time.strftime('%Y-%m-%d-%H-%M-%S')}.mp4"
-    download_path = get_dest_path(DOWNLOAD_FOLDER, file_name)
+    download_path = get_download_path(video_id, resume=bool(segments))
+    file_name = os.path.basename(download_path)
 
     # Download video and display progress
     url = video_info[2]
-    res = requests.get(url, stream=True)
     pbar.set_description(f"Downloading {file_name}")
-    with open(download_path, 'wb') as f:
-        pbar.update()
-        for chunk in res.iter_content(128):
-            f.write(chunk)
-
-
-def download_videos(video_ids: list, threads_num: int = 8):
+    checksum = checksum_of(video_info, checksums)
+    engine = 'segmented' if segments else 'cache' if cache else 'stream'
+    with metrics.track(url, engine, video_id) as record:
+        session = record.session(get_session())
+
+        def fetch():
+            if segments:
+                download_resumable(url, download_path, segments, session=session, on_chunk=record.wrap())
+                if checksum:
+                    verify_file(download_path, checksum)
+            elif cache:
+                get_cache(os.path.dirname(download_path)).fetch(video_id, url, download_path, session,
+                                                                record.wrap(), checksum)
+            else:
+                fetch_verified(url, download_path, checksum, session, record.wrap())
+
+        refetching(fetch)
+    pbar.update()
+
+
+def download_videos(video_ids: list, threads_num: int = 8, backend: str = 'threads', connections_per_host: int = 32,
+                    segments: int = 0, bandwidth: float = None, host_bandwidth: float = None, priorities: dict = None,
+                    sizes: dict = None, cache: bool = None, retries: int = 0, preflight: bool = True):
     """
-    Download the specified videos using multi-threads.
+    Download the specified videos using multi-threads, or with asyncio running many concurrent downloads on one
+    thread over a pool of at most `connections_per_host` keep-alive connections per host.
+
+    The threads backend runs on a DownloadScheduler, so it also supports:
+        - `segments`: fetch every video as that many resumable byte ranges;
+        - `bandwidth` / `host_bandwidth`: caps in bytes per second for the whole batch and for each host;
+        - `priorities` / `sizes`: per video ID, lower priorities first and then the smallest known sizes first;
+        - `cache`: revalidate videos downloaded before and skip the unchanged ones instead of fetching them again
+          (on unless set to False);
+        - `retries`: try a failed video again up to that many times, backing off exponentially.
+    Setting any of these with the asyncio backend raises a ValueError.
+    With `preflight` set, every URL is probed concurrently before the batch starts: the batch is refused if the disk
+    cannot hold it, the progress bar counts bytes once all the sizes are known, and the smallest videos go first.
+    Videos with a known checksum are verified as they arrive, and fetched again if they do not match.
+    Every download is recorded in the DownloadMetrics shared through video_core.
     """
-    # Reset threads number when number of videos is less than that of threads
-    if threads_num < len(list(video_ids)):
-        threads_num = min(threads_num, len(list(video_ids)))
+    from tqdm import tqdm
+
+    if backend not in BACKENDS:
+        raise Exception(f"The backend is INVALID! Please choose from {', '.join(BACKENDS)}")
+    if backend == 'asyncio':
+        unsupported = [name for name, value in (('segments', segments), ('bandwidth', bandwidth),
+                                                ('host_bandwidth', host_bandwidth), ('priorities', priorities),
+                                                ('cache', cache), ('retries', retries)) if value]
+        if unsupported:
+            raise ValueError(f"The asyncio backend does not support {', '.join(unsupported)}!")
+    elif cache is None:
+        cache = True
+
+    # Resolve all IDs up front and report the unknown ones together
+    found, missing = videos.get_many(video_ids)
+    if missing:
+        print(f"Video IDs NOT found: {', '.join(missing)}")
+    video_ids = list(found)
+    if not video_ids:
+        return
 
-    # Set up multi-thread to download multiple videos faster.
-    with ThreadPool(processes=threads_num) as pool:
-        # Create a progress bar for total number of threads
-        with tqdm(desc=f"Downloading videos...", total=len(video_ids),
-                  bar_format= '{l_bar}{bar:10}{r_bar}|Total Time: {elapsed}', ncols = 200) as pbar:
-            pool.starmap(download_video, [(video_id, pbar) for video_id in video_ids])
+    # Ask for every size up front, then check the disk can hold the whole batch
+    download_folder = os.path.dirname(get_dest_path(DOWNLOAD_FOLDER))
+    sizes = dict(sizes or {})
+    if preflight:
+        probed = probe_all([found[video_id][2] for video_id in video_ids], cache=ProbeCache(download_folder))
+        # Videos the content cache still holds unchanged are only linked again and need no space
+        download_cache = get_cache(download_folder) if cache and backend == 'threads' and not segments else None
+        needed = 0
+        for video_id in video_ids:
+            info = probed[found[video_id][2]]
+            if not sizes.get(video_id):
+                sizes[video_id] = info['size'] or None
+            if not download_cache or not download_cache.unchanged(video_id, found[video_id][2], info['etag'],
+                                                                  info['last_modified']):
+                needed += sizes[video_id] or 0
+        try:
+            check_disk_space(download_folder, needed)
+        except DiskSpaceError as e:
+            print(f"Download cancelled: {e}")
+            return
+    by_bytes = preflight and all(sizes[video_id] for video_id in video_ids)
+
+    # Create a progress bar for the total size of the videos if known, or else for their number
+    if by_bytes:
+        bar = tqdm(desc=f"Downloading videos...", total=sum(sizes[video_id] for video_id in video_ids), unit='B',
+                   unit_scale=True, unit_divisor=1024, ncols=200)
+    else:
+        bar = tqdm(desc=f"Downloading videos...", total=len(video_ids),
+                   bar_format= '{l_bar}{bar:10}{r_bar}|Total Time: {elapsed}', ncols = 200)
+    with bar as pbar:
+        bar_lock = threading.Lock()
+
+        def update_bar(n_bytes):
+            with bar_lock:
+                pbar.update(n_bytes)
+
+        on_chunk = RateLimitedProgress(update_bar) if by_bytes else None
+
+        if backend == 'asyncio':
+            jobs = [(found[video_id][2], get_download_path(video_id), checksum_of(found[video_id], checksums))
+                    for video_id in video_ids]
+            results = download_all_async(jobs, limit_per_host=connections_per_host,
+                                         on_done=None if by_bytes else lambda dest_path, result: pbar.update(),
+                                         on_chunk=on_chunk, metrics=metrics)
+            if on_chunk:
+                on_chunk.flush()
+            for video_id, result in zip(video_ids, results):
+                if isinstance(result, Exception):
+                    print(f"Failed to download video {video_id}: {result}")
+            return
+
+        # Never start more threads than there are videos
+        threads_num = max(1, min(threads_num, len(video_ids)))
+        priorities = priorities or {}
+
+        def on_done(job):
+            pbar.set_description(f"Downloaded {os.path.basename(job.dest_path)}")
+            if not by_bytes:
+                pbar.update()
+            elif job.cached:
+                # Nothing was transferred for an unchanged video, but it is done all the same
+                update_bar(sizes[job.key])
+
+        download_cache = get_cache(download_folder) if cache else None
+        with DownloadScheduler(workers=threads_num, per_host=min(threads_num, connections_per_host),
+                               bandwidth=bandwidth, host_bandwidth=host_bandwidth, cache=download_cache,
+                               retries=retries, metrics=metrics) as scheduler:
+            jobs = {}
+            for video_id in video_ids:
+                download_path = get_download_path(video_id, resume=bool(segments))
+                jobs[video_id] = scheduler.submit(found[video_id][2], download_path, priorities.get(video_id, 0),
+                                                  sizes.get(video_id), segments, on_chunk, on_done, video_id,
+                                                  checksum_of(found[video_id], checksums))
+            scheduler.join()
+        if on_chunk:
+            on_chunk.flush()
+        for video_id, job in jobs.items():
+            if job.error:
+                print(f"Failed to download video {video_id}: {job.error}")
 
 
 def main():
     """
     Run the video manager.
     """
+    # Pick up videos added to the CSV while the manager is running
+    CatalogueWatcher(videos).start()
     while True:
-        choice = input("Select an option: 1) View Page, 2) Search Videos, 3) Download Video, q) Quit\n")
+        choice = input("Select an option: 1) View Page, 2) Search Videos, 3) Download Video, 4) Download Metrics, "
+                       "q) Quit\n")
         if choice == '1':
             page_num = int(input("Enter page number: "))
             display_videos(page_num, items_per_page=10)
@@ -133,6 +200,8 @@ def main():
             video_ids_str = input("Enter video IDs (separated by ','): ")
             video_ids = list(set([v.strip() for v in video_ids_str.split(',')]))
             download_videos(video_ids)
+        elif choice == '4':
+            print(metrics.to_prometheus(), end='')
         elif choice.lower() == 'q':
             break
         else:
@@ -3,110 +3,82 @@
 Green version: is the vanilla version that does the basics as requested.
 """
 
-import csv
 import os
-import re
-import time
 
-import requests
+from video_catalogue import CatalogueWatcher
+from video_core import checksums, display_videos, get_cache, get_download_path, get_session, metrics, search_videos, \
+    videos
+from video_download import RateLimitedProgress, download_resumable
+from video_integrity import checksum_of, fetch_verified, refetching, verify_file
 
-VIDEO_FILE = 'video.csv'
-DOWNLOAD_FOLDER = 'files'
 
-# Get video info from the file
-videos = []
-with open(VIDEO_FILE, 'r', encoding='utf-8') as f:
-    reader = csv.reader(f)
-    for row in reader:
-        # Fix the wrong comma used in the mid of the news title
-        if len(row) > 3:
-            row[1:3] = ['，'.join(row[1:3])]
-        videos.append(row)
-
-
-def get_dest_path(download_folder: str = "downloads", file_name: str = "my_video.mp4"):
-    """
-    Get the destination path to save videos.
-    """
-    # Define the download folder
-    download_path = os.path.join(os.getcwd(), download_folder)
-
-    # Create the download folder if it doesn't exist
-    if not os.path.exists(download_path):
-        os.mkdir(download_path)
-
-    # Set the destination path for the file
-    dest_path = os.path.join(download_path, file_name)
-
-    return dest_path
-
-
-def display_videos(page_num: int = 1, items_per_page: int = 10):
-    """
-    Display items by page and show Page 1 if the page_num is invalid.
-    """
-    exact_page = len(videos) / items_per_page
-    total_page = int(exact_page) + (float(exact_page) > int(exact_page))
-    if page_num < 0 or page_num > total_page:
-        print("Invalid page number! Will display Page 1 instead:")
-        page_num = 1
-
-    print(f"Displaying Page {page_num} below:")
-    start_index = (page_num - 1) * items_per_page
-    end_index = start_index + items_per_page
-    for video in videos[start_index:end_index]:
-        print(', '.join(video))
-
-
-def search_videos(search_pattern):
-    """
-    Find videos whose names match the search pattern.
-    """
-    for video in videos:
-        if re.search(search_pattern, video[1], re.IGNORECASE):
-            print(', '.join(video))
-
-
-def download_video(video_id):
+def download_video(video_id, segments: int = 0, cache: bool = True):
     """
     Download the desired video and save it to the destination folder.
+    With `segments` set, fetch the video over that many connections and resume any interrupted download of it.
+    Otherwise, with `cache` set, skip the transfer if the video has not changed since it was last downloaded.
+    A video with a known checksum is verified, and fetched again if it does not match.
     """
     # Find video info for given ID
-    video_info = None
-    for video in videos:
-        if video[0] == video_id:
-            video_info = video
-            break
+    video_info = videos.get(video_id)
     if not video_info:
         print('Video ID NOT found!')
         return
 
-    # Construct filename and download path
-    file_name = f"{video_id}-{time.strftime('%Y-%m-%d-%H-%M-%S')}.mp4"
-    download_path = get_dest_path(DOWNLOAD_FOLDER, file_name)
+    # Construct filename and download path, reusing the name of an interrupted download when resuming
+    download_path = get_download_path(video_id, resume=bool(segments))
 
-    # Download video and display progress
+    # Download video and display progress a few times per second rather than on every chunk
     url = video_info[2]
     print(f"Downloading video {video_id} from {url}...")
-    res = requests.get(url, stream=True)
-    file_size = int(res.headers.get('Content-Length', 0))
-    download_size = 0
+    progress = {'size': 0, 'total': 0}
+
+    def show_progress(n_bytes):
+        progress['size'] += n_bytes
+        if progress['total']:
+            percent = progress['size'] * 100 / progress['total']
+            print(f"\rDownloaded {progress['size']}/{progress['total']} bytes ({percent:.2f}%)", end="")
+        else:
+            print(f"\rDownloaded {progress['size']} bytes", end="")
+
+    def on_size(size):
+        progress['size'] = 0
+        progress['total'] = size
+
+    on_chunk = RateLimitedProgress(show_progress)
+    checksum = checksum_of(video_info, checksums)
     print("Downloading...")
-    with open(download_path, 'wb') as f:
-        for chunk in res.iter_content(128):
-            f.write(chunk)
-            download_size += len(chunk)
-            percent = download_size * 100 / file_size
-            print(f"\rDownloaded {download_size}/{file_size} bytes ({percent:.2f}%)", end="")
-        print(f"\nThe video was successfully saved as {download_path}.")
+    engine = 'segmented' if segments else 'cache' if cache else 'stream'
+    with metrics.track(url, engine, video_id) as record:
+        session = record.session(get_session())
+
+        def fetch():
+            if segments:
+                download_resumable(url, download_path, segments, session, record.wrap(on_chunk), on_size,
+                                   on_chunk)
+                if checksum:
+                    verify_file(download_path, checksum)
+            elif cache:
+                return get_cache(os.path.dirname(download_path)).fetch(video_id, url, download_path, session,
+                                                                       record.wrap(on_chunk), checksum)
+            else:
+                fetch_verified(url, download_path, checksum, session, record.wrap(on_chunk), on_size)
+
+        if refetching(fetch):
+            print("The video has not changed since it was last downloaded.", end="")
+    on_chunk.flush()
+    print(f"\nThe video was successfully saved as {download_path}.")
 
 
 def main():
     """
     Run the video manager.
     """
+    # Pick up videos added to the CSV while the manager is running
+    CatalogueWatcher(videos).start()
     while True:
-        choice = input("Select an option: 1) View Page, 2) Search Videos, 3) Download Video, q) Quit\n")
+        choice = input("Select an option: 1) View Page, 2) Search Videos, 3) Download Video, 4) Download Metrics, "
+                       "q) Quit\n")
         if choice == '1':
             page_num = int(input("Enter page number: "))
             display_videos(page_num, items_per_page=10)
@@ -116,6 +88,8 @@ def main():
         elif choice == '3':
             video_id = input("Enter video ID: ")
             download_video(video_id)
+        elif choice == '4':
+            print(metrics.to_prometheus(), end='')
         elif choice.lower() == 'q':
             break
         else:
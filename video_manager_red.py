@@ -3,29 +3,127 @@
 Red version: does what Green version does with PyQt6 GUI
 """
 
-import csv
 import os
 import re
 import sys
 import time
+from bisect import bisect_right
 
-import requests
+from PyQt6.QtCore import QAbstractListModel, QAbstractTableModel, QModelIndex, QObject, QRunnable, Qt, QThreadPool, \
+    QTimer, pyqtSignal
 from PyQt6.QtGui import QIntValidator
 from PyQt6.QtWidgets import QApplication, QLabel, QMainWindow, QPushButton, QTextEdit, QLineEdit, QWidget, \
-    QGridLayout, QHBoxLayout, QVBoxLayout, QTabWidget
-
-VIDEO_FILE = 'video.csv'
-DOWNLOAD_FOLDER = 'files'
+    QGridLayout, QHBoxLayout, QVBoxLayout, QTabWidget, QProgressBar, QScrollArea, QTableView, QHeaderView, QSpinBox, \
+    QListView
+
+from download_scheduler import DownloadScheduler
+from video_catalogue import CatalogueWatcher, load_catalogue
+from video_core import VIDEO_FILE, checksums, get_download_path
+from video_download import RateLimitedProgress
+from video_integrity import checksum_of
+from video_view import CatalogueView
+
+SEGMENTS = 4
+MAX_DOWNLOADS = 4
+PROGRESS_INTERVAL = 0.1
+PAGE_SIZE = 10
+COLUMNS = ['ID', 'Title', 'URL']
+SEARCH_DELAY = 250  # milliseconds to wait after the last keystroke
+SEARCH_BATCH = 2000
+
+# The models read rows and columns straight from the memory-mapped catalogue, even when video.db exists
+videos = load_catalogue(VIDEO_FILE)
+
+
+class VideoTableModel(QAbstractTableModel):
+    """
+    Table model over a sorted and filtered view of the catalogue. Rows are decoded only when the view paints them and
+    are made visible one page at a time through canFetchMore/fetchMore, so the memory used for rendering does not grow
+    with the catalogue.
+    """
+    def __init__(self, videos, page_size: int = PAGE_SIZE):
+        super().__init__()
 
-# Get video info from the file
-videos = []
-with open(VIDEO_FILE, 'r', encoding='utf-8') as f:
-    reader = csv.reader(f)
-    for row in reader:
-        # Fix the wrong comma used in the mid of the news title
-        if len(row) > 3:
-            row[1:3] = ['，'.join(row[1:3])]
-        videos.append(row)
+        self.videos = videos
+        self.view = CatalogueView(videos)
+        self.page_size = page_size
+        self.loaded = 0
+        self.sort_column = -1
+        self.sort_order = Qt.SortOrder.AscendingOrder
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return COLUMNS[section]
+        return section + 1
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        return self.videos.field(self.source_row(index.row()), index.column())
+
+    def source_row(self, row: int) -> int:
+        return self.view[row]
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.loaded < len(self.view)
+
+    def fetchMore(self, parent=QModelIndex()):
+        self.fetch_until(self.loaded + self.page_size)
+
+    def fetch_until(self, rows: int):
+        """
+        Make at least the given number of rows visible to the view.
+        """
+        rows = min(rows, len(self.view))
+        if rows > self.loaded:
+            self.beginInsertRows(QModelIndex(), self.loaded, rows - 1)
+            self.loaded = rows
+            self.endInsertRows()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        # The permutation of each column is cached with the catalogue; descending order just reads it backwards
+        self.sort_column = column
+        self.sort_order = order
+        self.layoutAboutToBeChanged.emit()
+        self.view = CatalogueView(self.videos, column if column >= 0 else None,
+                                  order == Qt.SortOrder.DescendingOrder, self.view.query)
+        self.layoutChanged.emit()
+
+    def set_query(self, query: str):
+        """
+        Show only the videos whose titles match the query, or all of them for an empty one. An invalid query raises
+        re.error and leaves the view as it was.
+        """
+        view = CatalogueView(self.videos, self.view.column, self.view.descending, query)
+        # Run the query now, so an invalid one fails before the model is touched
+        len(view)
+        self.beginResetModel()
+        self.view = view
+        self.loaded = min(self.page_size, len(view))
+        self.endResetModel()
+
+    def catalogue_changed(self, old_len: int, new_len: int, reloaded: bool):
+        """
+        Follow a refresh of the catalogue. The view reads its rows from the catalogue's cache, which is rebuilt for the
+        new rows; in file order they are fetched like any others as the view scrolls down. A reload resets the model.
+        """
+        if reloaded:
+            self.beginResetModel()
+            self.loaded = min(max(self.loaded, self.page_size), len(self.view))
+            self.endResetModel()
+        elif self.view.column is not None or self.view.query:
+            # New rows may be sorted or filtered in anywhere among the loaded ones
+            self.layoutAboutToBeChanged.emit()
+            self.loaded = min(self.loaded, len(self.view))
+            self.layoutChanged.emit()
 
 
 class VideoCatalogue(QMainWindow):
@@ -33,27 +131,47 @@ class VideoCatalogue(QMainWindow):
         super().__init__()
 
         self.videos = videos
+        self.model = VideoTableModel(videos)
+        self.model.fetchMore()
+        self.table_view = QTableView()
+        self.table_view.setModel(self.model)
+        # Start in file order; enabling sorting would otherwise sort by the first column straight away
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        self.table_view.setSortingEnabled(True)
+        self.table_view.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Stretch)
+        # Fixed row heights let the view skip measuring rows it does not show
+        self.table_view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+
+        self.filter_label = QLabel('Filter:')
+        self.filter_edit = QLineEdit()
+        self.filter_edit.returnPressed.connect(self.filter)
         self.page_label = QLabel('Page:')
         self.page_edit = QLineEdit()
-        self.page_edit.setValidator(QIntValidator(1, (len(self.videos) - 1) // 10 + 1))
         self.page_edit.returnPressed.connect(self.show_page)
+        self.page_size_label = QLabel('Page Size:')
+        self.page_size_box = QSpinBox()
+        self.page_size_box.setRange(1, 10000)
+        self.page_size_box.setValue(PAGE_SIZE)
+        self.page_size_box.valueChanged.connect(self.set_page_size)
         self.page_button = QPushButton('Display')
         self.page_button.clicked.connect(self.show_page)
         self.clear_button = QPushButton('Clear')
         self.clear_button.clicked.connect(self.clear_form)
+        self.set_page_size(PAGE_SIZE)
+        videos.subscribe(self.catalogue_changed)
 
         hbox = QHBoxLayout()
+        hbox.addWidget(self.filter_label)
+        hbox.addWidget(self.filter_edit)
         hbox.addWidget(self.page_label)
         hbox.addWidget(self.page_edit)
+        hbox.addWidget(self.page_size_label)
+        hbox.addWidget(self.page_size_box)
         hbox.addWidget(self.page_button)
         hbox.addWidget(self.clear_button)
 
         vbox = QVBoxLayout()
-
-        self.result_edit = QTextEdit()
-        self.result_edit.setReadOnly(True)
-        vbox.addWidget(self.result_edit)
-
+        vbox.addWidget(self.table_view)
         vbox.addLayout(hbox)
 
         central_widget = QWidget()
@@ -61,28 +179,131 @@ class VideoCatalogue(QMainWindow):
 
         self.setCentralWidget(central_widget)
 
+    def num_pages(self) -> int:
+        return self.model.view.num_pages(self.model.page_size)
+
+    def set_page_size(self, page_size: int):
+        self.model.page_size = page_size
+        self.page_edit.setValidator(QIntValidator(1, self.num_pages()))
+
     def show_page(self):
         # Ensure only a valid page be displayed.
         if not self.page_edit.text().isdigit():
             page = 1
         else:
             page = int(self.page_edit.text())
-        num_pages = (len(self.videos) - 1) // 10 + 1
-        page = max(1, min(page, num_pages))
+        page = max(1, min(page, self.num_pages()))
         self.page_edit.setText(str(page))
-        start = (page - 1) * 10
-        end = start + 10
+        start = (page - 1) * self.model.page_size
+
+        # Load rows up to the end of the page, or of the screen if that is longer, and scroll the page to the top
+        visible_rows = self.table_view.viewport().height() // self.table_view.verticalHeader().defaultSectionSize() + 1
+        self.model.fetch_until(start + max(self.model.page_size, visible_rows))
+        self.table_view.doItemsLayout()
+        if start < self.model.rowCount():
+            self.table_view.scrollTo(self.model.index(start, 0), QTableView.ScrollHint.PositionAtTop)
+
+    def filter(self):
+        try:
+            self.model.set_query(self.filter_edit.text().strip())
+        except re.error as e:
+            self.statusBar().showMessage(f'Invalid filter pattern: {e}')
+            return
+        self.statusBar().showMessage(f'{len(self.model.view)} videos')
+        self.page_edit.setValidator(QIntValidator(1, self.num_pages()))
+        self.table_view.scrollToTop()
+
+    def catalogue_changed(self, old_len, new_len, reloaded):
+        self.model.catalogue_changed(old_len, new_len, reloaded)
+        self.page_edit.setValidator(QIntValidator(1, self.num_pages()))
 
-        videos = self.videos[start:end]
+    def clear_form(self):
+        if self.filter_edit.text():
+            self.filter_edit.clear()
+            self.filter()
+        self.page_edit.clear()
+        self.table_view.clearSelection()
+        self.table_view.scrollToTop()
+
+
+class SearchSignals(QObject):
+    """
+    Signals a search worker uses to stream its results back to the GUI thread, tagged with the query generation.
+    """
+    batch = pyqtSignal(int, object)
+    finished = pyqtSignal(int, int)
+    failed = pyqtSignal(int, str)
+
+
+class SearchWorker(QRunnable):
+    """
+    Run one query on the thread pool, giving up as soon as a newer query has been started.
+    """
+    def __init__(self, videos, generation, id_search, text_search, is_current, signals):
+        super().__init__()
 
-        text = ''
-        for video in videos:
-            text += f'{video[0]} {video[1]}\n'
+        self.videos = videos
+        self.generation = generation
+        self.id_search = id_search
+        self.text_search = text_search
+        self.is_current = is_current
+        self.signals = signals
+
+    def run(self):
+        total = 0
+        # Every row with the ID, merged into the text matches so the results stay in catalogue order
+        id_rows = self.videos.rows_of(self.id_search) if self.id_search else []
+        if self.text_search:
+            try:
+                batches = self.videos.search_index.iter_search(self.text_search, 0, SEARCH_BATCH)
+            except re.error as e:
+                self.signals.failed.emit(self.generation, f'Invalid search pattern: {e}')
+                return
+            for batch in batches:
+                if not self.is_current(self.generation):
+                    return
+                if id_rows and id_rows[0] <= batch[-1]:
+                    end = bisect_right(id_rows, batch[-1])
+                    batch = sorted(set(batch).union(id_rows[:end]))
+                    id_rows = id_rows[end:]
+                self.signals.batch.emit(self.generation, batch)
+                total += len(batch)
+        if id_rows:
+            self.signals.batch.emit(self.generation, id_rows)
+            total += len(id_rows)
+        self.signals.finished.emit(self.generation, total)
+
+
+class SearchResultModel(QAbstractListModel):
+    """
+    List model holding only the row numbers of the matches; the text is decoded when a row is painted.
+    """
+    def __init__(self, videos):
+        super().__init__()
+
+        self.videos = videos
+        self.rows = []
 
-        self.result_edit.setText(text)
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
 
-    def clear_form(self):
-        self.result_edit.clear()
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        row = self.rows[index.row()]
+        return f'{self.videos.field(row, 0)} {self.videos.field(row, 1)} {self.videos.field(row, 2)}'
+
+    def add_rows(self, rows):
+        if not rows:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+        self.rows.extend(rows)
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []
+        self.endResetModel()
 
 
 class VideoSearch(QWidget):
@@ -90,12 +311,30 @@ class VideoSearch(QWidget):
         super().__init__()
 
         self.videos = videos
+        self.generation = 0
         self.search_button = QPushButton('Search')
         self.clear_button = QPushButton('Clear')
         self.id_edit = QLineEdit()
         self.text_edit = QLineEdit()
-        self.result_edit = QTextEdit()
-        self.result_edit.setReadOnly(True)
+        self.model = SearchResultModel(videos)
+        self.result_view = QListView()
+        self.result_view.setModel(self.model)
+        # All rows have the same height, so the view only lays out the ones on screen
+        self.result_view.setUniformItemSizes(True)
+        self.count_label = QLabel('')
+
+        # Search as the user types, once the typing pauses
+        self.search_timer = QTimer()
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.search)
+        self.id_edit.textChanged.connect(self.search_timer.start)
+        self.text_edit.textChanged.connect(self.search_timer.start)
+
+        self.signals = SearchSignals()
+        self.signals.batch.connect(self.add_results)
+        self.signals.finished.connect(self.show_total)
+        self.signals.failed.connect(self.show_error)
 
         grid = QGridLayout()
         grid.addWidget(QLabel('ID:'), 0, 0)
@@ -109,46 +348,199 @@ class VideoSearch(QWidget):
 
         vbox = QVBoxLayout()
         vbox.addLayout(grid)
-        vbox.addWidget(self.result_edit)
+        vbox.addWidget(self.count_label)
+        vbox.addWidget(self.result_view)
         vbox.addLayout(hbox)
 
         self.setLayout(vbox)
 
         self.search_button.clicked.connect(self.search)
         self.clear_button.clicked.connect(self.clear)
+        videos.subscribe(self.catalogue_changed)
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def catalogue_changed(self, old_len, new_len, reloaded):
+        # Run the current query again so new videos show up and reloaded row numbers are not shown stale
+        if self.id_edit.text() or self.text_edit.text():
+            self.search_timer.start()
+        elif reloaded:
+            self.model.clear()
 
     def search(self):
+        self.search_timer.stop()
+        # Starting a new generation makes any running worker stop and drop its results
+        self.generation += 1
+        self.model.clear()
         id_search = self.id_edit.text()
         text_search = self.text_edit.text()
+        if not id_search and not text_search:
+            self.count_label.setText('')
+            return
 
-        results = []
-        for video in self.videos:
-            if id_search and id_search == video[0]:
-                results.append(video)
-            elif text_search and re.search(text_search, video[1]):
-                results.append(video)
-
-        if results:
-            self.result_edit.setText('')
-            for result in results:
-                self.result_edit.append(f'{result[0]} {result[1]} {result[2]}')
-        else:
-            self.result_edit.setText('No Match Found')
+        self.count_label.setText('Searching...')
+        worker = SearchWorker(self.videos, self.generation, id_search, text_search, self.is_current, self.signals)
+        QThreadPool.globalInstance().start(worker)
+
+    def add_results(self, generation, rows):
+        if self.is_current(generation):
+            self.model.add_rows(rows)
+            self.count_label.setText(f'Searching... {self.model.rowCount()} matches so far')
+
+    def show_total(self, generation, total):
+        if self.is_current(generation):
+            self.count_label.setText(f'{total} matches' if total else 'No Match Found')
+
+    def show_error(self, generation, message):
+        if self.is_current(generation):
+            self.count_label.setText(message)
 
     def clear(self):
         self.id_edit.setText('')
         self.text_edit.setText('')
-        self.result_edit.setText('')
+        self.search()
+
+
+class DownloadSignals(QObject):
+    """
+    Signals the download worker threads use to hand their jobs back to the GUI thread.
+    """
+    progress = pyqtSignal(str)
+    finished = pyqtSignal(object)
+
+
+class DownloadRow(QWidget):
+    """
+    One download in the list: file name, progress bar, throughput and Pause/Cancel buttons.
+
+    Pausing ends the job rather than holding its connections open, which the server could time out; the partial file
+    and its state file stay, so resuming queues the download again and it carries on from the bytes already done.
+    `requeue(video_id, job)` submits a job like the given one and returns it.
+    """
+    def __init__(self, video_id, job, requeue):
+        super().__init__()
+
+        self.video_id = video_id
+        self.job = job
+        self.requeue = requeue
+        self.paused = False
+        # The current job was cancelled to pause it, not by the user
+        self.stopping = False
+        self.cancelled = False
+        self.last_bytes = 0
+        self.last_time = time.monotonic()
+        self.name_label = QLabel(os.path.basename(job.dest_path))
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.speed_label = QLabel('Queued')
+        self.speed_label.setMinimumWidth(120)
+        self.pause_button = QPushButton('Pause')
+        self.pause_button.clicked.connect(self.toggle_pause)
+        self.cancel_button = QPushButton('Cancel')
+        self.cancel_button.clicked.connect(self.cancel)
+
+        hbox = QHBoxLayout()
+        hbox.setContentsMargins(0, 0, 0, 0)
+        hbox.addWidget(self.name_label)
+        hbox.addWidget(self.progress_bar, 1)
+        hbox.addWidget(self.speed_label)
+        hbox.addWidget(self.pause_button)
+        hbox.addWidget(self.cancel_button)
+        self.setLayout(hbox)
+
+    def update_progress(self):
+        now = time.monotonic()
+        bytes_done = self.job.bytes_done
+        if self.job.size:
+            # Show kilobytes so multi-GB files stay within the int range of the progress bar
+            self.progress_bar.setRange(0, self.job.size // 1024)
+            self.progress_bar.setValue(bytes_done // 1024)
+        if self.paused:
+            self.speed_label.setText('Paused')
+        elif now > self.last_time:
+            speed = (bytes_done - self.last_bytes) / (now - self.last_time)
+            self.speed_label.setText(f'{speed / 1024 / 1024:.2f} MB/s')
+        self.last_bytes = bytes_done
+        self.last_time = now
+
+    def update_finished(self):
+        if self.stopping and self.job.status == 'cancelled' and not self.cancelled:
+            self.stopping = False
+            if not self.paused:
+                # Resumed before the paused job had ended
+                self.restart()
+            return
+        self.stopping = False
+        self.paused = False
+        self.pause_button.setEnabled(False)
+        self.cancel_button.setEnabled(False)
+        if self.job.status == 'done':
+            self.progress_bar.setRange(0, 1)
+            self.progress_bar.setValue(1)
+            self.speed_label.setText('Completed')
+        else:
+            self.speed_label.setText(self.job.status.capitalize())
+
+    def is_active(self) -> bool:
+        return self.paused or not self.job.finished.is_set()
+
+    def toggle_pause(self):
+        if not self.paused:
+            self.paused = True
+            if not self.job.finished.is_set():
+                self.stopping = True
+                self.job.cancel()
+            self.pause_button.setText('Resume')
+            self.speed_label.setText('Paused')
+        else:
+            self.paused = False
+            self.pause_button.setText('Pause')
+            # A job still stopping is queued again once it has ended
+            if not self.stopping:
+                self.restart()
+
+    def restart(self):
+        self.job = self.requeue(self.video_id, self.job)
+        self.last_bytes = self.job.bytes_done
+        self.last_time = time.monotonic()
+        self.speed_label.setText('Queued')
+
+    def cancel(self):
+        self.cancelled = True
+        if self.job.finished.is_set():
+            # Paused: there is no job running to end
+            self.update_finished()
+        else:
+            self.job.cancel()
 
 
 class VideoDownloader(QWidget):
     def __init__(self):
         super().__init__()
 
+        # Transfers run on the scheduler's worker threads and report back through signals, so the GUI never blocks
+        self.scheduler = DownloadScheduler(workers=MAX_DOWNLOADS, per_host=MAX_DOWNLOADS * SEGMENTS)
+        self.signals = DownloadSignals()
+        self.signals.progress.connect(self.update_progress)
+        self.signals.finished.connect(self.update_finished)
+        self.rows = {}
+
         self.download_button = QPushButton('Download')
         self.id_edit = QLineEdit()
+        self.id_edit.setPlaceholderText("Video IDs separated by ','")
+        self.id_edit.returnPressed.connect(self.download)
         self.result_edit = QTextEdit()
         self.result_edit.setReadOnly(True)
+        self.result_edit.setMaximumHeight(80)
+
+        self.rows_layout = QVBoxLayout()
+        self.rows_layout.addStretch()
+        rows_widget = QWidget()
+        rows_widget.setLayout(self.rows_layout)
+        scroll_area = QScrollArea()
+        scroll_area.setWidgetResizable(True)
+        scroll_area.setWidget(rows_widget)
 
         grid = QGridLayout()
         grid.addWidget(QLabel('ID:'), 0, 0)
@@ -156,6 +548,7 @@ class VideoDownloader(QWidget):
 
         vbox = QVBoxLayout()
         vbox.addLayout(grid)
+        vbox.addWidget(scroll_area)
         vbox.addWidget(self.result_edit)
         vbox.addWidget(self.download_button)
 
@@ -164,27 +557,52 @@ class VideoDownloader(QWidget):
         self.download_button.clicked.connect(self.download)
 
     def download(self):
-        video_id = self.id_edit.text()
-
-        video = None
-        for v in videos:
-            if v[0] == video_id:
-                video = v
-                break
-
-        if video:
-            filename = os.path.join(DOWNLOAD_FOLDER, f"{video[0]}-{time.strftime('%Y-%m-%d-%H-%M-%S')}.mp4")
-            url = video[2]
-
-            response = requests.get(url, stream=True)
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        f.write(chunk)
-
-            self.result_edit.setText(f'Download Completed: {os.path.abspath(filename)}')
-        else:
-            self.result_edit.setText('The video does NOT exist!')
+        video_ids = [v.strip() for v in self.id_edit.text().split(',') if v.strip()]
+        found, missing = videos.get_many(video_ids)
+        if missing:
+            self.result_edit.append(f"The video does NOT exist! {', '.join(missing)}")
+
+        for video_id, video in found.items():
+            if video_id in self.rows and self.rows[video_id].is_active():
+                self.result_edit.append(f'Video {video_id} is already being downloaded.')
+                continue
+
+            # Resume an interrupted download of the same video under its old name
+            filename = get_download_path(video[0], resume=True)
+            job = self.submit(video_id, video[2], filename, checksum_of(video, checksums))
+            if video_id in self.rows:
+                self.rows.pop(video_id).deleteLater()
+            row = DownloadRow(video_id, job, self.requeue)
+            self.rows[video_id] = row
+            self.rows_layout.insertWidget(self.rows_layout.count() - 1, row)
+
+    def submit(self, video_id, url, filename, checksum):
+        on_chunk = RateLimitedProgress(lambda n_bytes: self.signals.progress.emit(video_id), PROGRESS_INTERVAL)
+        return self.scheduler.submit(url, filename, segments=SEGMENTS, key=video_id, on_chunk=on_chunk,
+                                     on_done=self.signals.finished.emit, checksum=checksum)
+
+    def requeue(self, video_id, job):
+        return self.submit(video_id, job.url, job.dest_path, job.checksum)
+
+    def update_progress(self, video_id):
+        if video_id in self.rows:
+            self.rows[video_id].update_progress()
+
+    def update_finished(self, job):
+        row = self.rows.get(job.key)
+        if row and row.job is job:
+            row.update_finished()
+        if job.status == 'done':
+            self.result_edit.append(f'Download Completed: {os.path.abspath(job.dest_path)}')
+        elif job.status == 'failed':
+            self.result_edit.append(f'Download Failed: {job.error}')
+
+
+class CatalogueSignals(QObject):
+    """
+    Signal the catalogue watcher uses to have the catalogue refreshed on the GUI thread, where its listeners live.
+    """
+    changed = pyqtSignal()
 
 
 def main(videos):
@@ -207,6 +625,10 @@ def main(videos):
     window.setCentralWidget(tab_widget)
     window.show()
 
+    catalogue_signals = CatalogueSignals()
+    catalogue_signals.changed.connect(videos.refresh)
+    CatalogueWatcher(videos, catalogue_signals.changed.emit).start()
+
     sys.exit(app.exec())
 
 
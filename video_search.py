@@ -0,0 +1,291 @@
+"""
+Inverted index over video titles for fast keyword and regex search.
+
+Every title is indexed by its case-folded characters and character bigrams, so titles without spaces (e.g. Chinese
+news titles) can be searched as well as English ones. A plain keyword query is answered by intersecting posting lists.
+A regex query only scans the titles that contain all the literal substrings the pattern requires. In both cases the
+candidates are confirmed with the real regex, so the results are exactly the ones `re.search` would return.
+
+The index can be saved next to the catalogue cache and memory-mapped back, so it is only built once per CSV version.
+"""
+
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+# The regex parser is internal to re; without it every title is scanned instead of only the candidates
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    try:
+        import sre_parse
+    except ImportError:
+        sre_parse = None
+
+INDEX_MAGIC = b'VIDX'
+INDEX_VERSION = 3
+INDEX_HEADER = struct.Struct('<4sHBxqqq')
+
+_META_CHARS = set('.^$*+?{}[]\\|()')
+# Characters re.IGNORECASE matches with another that their one-character upper and lower cases do not lead to: the
+# dotted capital I, the two code points of iota and upsilon with dialytika and tonos, and the two st ligatures
+_EXTRA_CASES = {'\u0130': 'i', '\u1fd3': '\u0390', '\u1fe3': '\u03b0', '\ufb05': '\ufb06'}
+
+
+class _FoldTable(dict):
+    """
+    str.translate table sending every character to one representative of the characters re.IGNORECASE matches with
+    it: the lower case of its upper case, which brings together e.g. σ and ς or µ and μ, unless either case takes
+    more than one character, then the few cases of _EXTRA_CASES. Entries are added as characters are first met.
+    """
+
+    def __missing__(self, code: int) -> int:
+        char = chr(code)
+        for case in (str.upper, str.lower):
+            changed = case(char)
+            if len(changed) == 1:
+                char = changed
+        self[code] = folded = ord(_EXTRA_CASES.get(char, char))
+        return folded
+
+
+_FOLD = _FoldTable()
+
+
+def fold(text: str) -> str:
+    """
+    Normalise the text the same way the index does. Every character stays one character, so a text matching a literal
+    with re.IGNORECASE contains the folded literal once folded itself.
+    """
+    return text.translate(_FOLD)
+
+
+def grams(text: str) -> set:
+    """
+    Get the characters and character bigrams of an already folded text.
+    """
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def query_grams(literal: str) -> set:
+    """
+    Get the grams to look up for a literal. Bigrams already cover every character of a longer literal.
+    """
+    literal = fold(literal)
+    if len(literal) < 2:
+        return set(literal)
+    return {literal[i:i + 2] for i in range(len(literal) - 1)}
+
+
+def is_literal(pattern: str) -> bool:
+    """
+    Tell whether the pattern only matches itself, having no special characters.
+    """
+    return _META_CHARS.isdisjoint(pattern)
+
+
+def required_literals(pattern: str, flags: int = 0) -> list:
+    """
+    Get the literal substrings every match of the pattern must contain.
+
+    Only literals found at the top level of the pattern are collected, which is always safe: anything inside groups,
+    alternations or repeats is treated as unknown and simply breaks the current literal run. The pattern must have
+    been compiled already: if the parser fails, e.g. because it changed in another Python version, there are no
+    literals and the whole catalogue is scanned.
+    """
+    literals = []
+    run = []
+    try:
+        for op, arg in sre_parse.parse(pattern, flags):
+            if op is sre_parse.LITERAL:
+                run.append(chr(arg))
+                continue
+            if run:
+                literals.append(''.join(run))
+                run = []
+    except Exception:
+        return []
+    if run:
+        literals.append(''.join(run))
+    return literals
+
+
+def build_postings(titles: list) -> dict:
+    """
+    Map every gram to the sorted list of rows whose titles contain it.
+    """
+    postings = defaultdict(list)
+    for row, title in enumerate(titles):
+        for gram in grams(fold(title)):
+            postings[gram].append(row)
+    return dict(postings)
+
+
+class SearchIndex:
+    """
+    Character and bigram inverted index over a list of titles.
+    """
+
+    def __init__(self, titles: list, postings: dict = None):
+        self.titles = titles
+        self.postings = build_postings(titles) if postings is None else postings
+
+    def __len__(self):
+        return len(self.titles)
+
+    def extend(self, start: int) -> None:
+        """
+        Index the titles appended to the title list from row `start` on.
+        """
+        postings = self.postings
+        for row in range(start, len(self.titles)):
+            for gram in grams(fold(self.titles[row])):
+                posting = postings.get(gram)
+                # Postings mapped from disk are read-only, so copy them the first time they grow
+                if not isinstance(posting, list):
+                    posting = postings[gram] = list(posting) if posting is not None else []
+                posting.append(row)
+
+    def candidates(self, literals: list):
+        """
+        Get the rows whose titles contain all the literals, or None if every row is a candidate.
+        """
+        needed = set()
+        for literal in literals:
+            needed |= query_grams(literal)
+        if not needed:
+            return None
+
+        lists = []
+        for gram in needed:
+            posting = self.postings.get(gram)
+            if not posting:
+                return []
+            lists.append(posting)
+        lists.sort(key=len)
+
+        rows = lists[0]
+        for posting in lists[1:]:
+            rows = _intersect(rows, posting)
+            if not rows:
+                break
+        return rows
+
+    def _plan(self, pattern: str, flags: int) -> tuple:
+        """
+        Compile the pattern and get the candidate rows it has to be checked against.
+        """
+        matcher = re.compile(pattern, flags).search
+        if is_literal(pattern):
+            literals = [pattern]
+        else:
+            literals = required_literals(pattern, flags)
+        rows = self.candidates(literals)
+        if rows is None:
+            rows = range(len(self.titles))
+        return rows, matcher
+
+    def search(self, pattern: str, flags: int = re.IGNORECASE) -> list:
+        """
+        Get the indices of the titles matching the pattern, in catalogue order.
+        """
+        rows, matcher = self._plan(pattern, flags)
+        titles = self.titles
+        return [row for row in rows if matcher(titles[row])]
+
+    def iter_search(self, pattern: str, flags: int = re.IGNORECASE, batch_size: int = 1000):
+        """
+        Like search, but yield the matching rows in batches so the caller can show them early or stop at any time.
+        An invalid pattern raises re.error straight away rather than on the first batch.
+        """
+        rows, matcher = self._plan(pattern, flags)
+        return self._iter_matches(rows, matcher, batch_size)
+
+    def _iter_matches(self, rows, matcher, batch_size: int):
+        titles = self.titles
+        batch = []
+        for row in rows:
+            if matcher(titles[row]):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def save(self, path: str, stamp: tuple) -> None:
+        """
+        Write the postings to disk, tagged with the (mtime_ns, size) stamp of the CSV they were built from.
+        """
+        names = list(self.postings)
+        offsets = array('Q', [0])
+        for name in names:
+            offsets.append(offsets[-1] + len(self.postings[name]))
+        heap = '\0'.join(names).encode('utf-8')
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, sys.byteorder == 'little', *stamp, len(names)))
+            f.write(struct.pack('<q', len(heap)))
+            f.write(heap)
+            f.write(b'\0' * (-f.tell() % 8))
+            f.write(offsets.tobytes())
+            for name in names:
+                f.write(array('I', self.postings[name]).tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, titles: list, stamp: tuple):
+        """
+        Map a saved index back in. Return None if it is missing or was built from another version of the CSV.
+        """
+        try:
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(mm) < INDEX_HEADER.size:
+            mm.close()
+            return None
+        magic, version, little, mtime_ns, size, num_grams = INDEX_HEADER.unpack_from(mm)
+        if (magic, version, bool(little), (mtime_ns, size)) != \
+                (INDEX_MAGIC, INDEX_VERSION, sys.byteorder == 'little', tuple(stamp)):
+            mm.close()
+            return None
+
+        view = memoryview(mm)
+        pos = INDEX_HEADER.size
+        heap_size, = struct.unpack_from('<q', mm, pos)
+        pos += 8
+        names = str(view[pos:pos + heap_size], 'utf-8').split('\0') if num_grams else []
+        pos += heap_size + (-(pos + heap_size) % 8)
+        offsets = view[pos:pos + 8 * (num_grams + 1)].cast('Q')
+        data = view[pos + 8 * (num_grams + 1):].cast('I')
+        postings = {name: data[offsets[i]:offsets[i + 1]] for i, name in enumerate(names)}
+        return cls(titles, postings)
+
+
+def _intersect(rows, posting) -> list:
+    """
+    Get the rows also in the posting, both sorted and the rows no longer, keeping the order so nothing is re-sorted.
+    When the posting is much longer every row is looked up by bisection from where the previous one was found, and the
+    cost follows the shorter list; otherwise one pass over the posting keeps the rows it shares.
+    """
+    size = len(posting)
+    if len(rows) * size.bit_length() >= size:
+        return list(filter(set(rows).__contains__, posting))
+    found = []
+    lo = 0
+    for row in rows:
+        lo = bisect_left(posting, row, lo)
+        if lo == size:
+            break
+        if posting[lo] == row:
+            found.append(row)
+            lo += 1
+    return found
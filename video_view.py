@@ -0,0 +1,211 @@
+"""
+Sorted and filtered views of the video catalogue.
+
+A CatalogueView lists the catalogue rows matching an optional title search, sorted by ID, title or URL, ascending or
+descending. Sorting a large catalogue and scanning it for a query are the expensive parts, so they are done once and
+cached per catalogue: the ascending permutation of every sorted column, and the matching rows of the latest queries,
+already in each sort order. Every view over the same catalogue shares them, and a descending view reads the ascending
+rows backwards. Turning to any page then only slices the cached rows, which costs O(page size) on a million-row
+catalogue. The cache is dropped as soon as the catalogue changes.
+
+Pages can be addressed by number or by a cursor naming the last video of the previous page by its ID and row, so it
+stays unique when IDs are duplicated. A cursor keeps its place when videos are added to the catalogue, where page
+numbers would shift. A bare video ID is taken as a cursor too, at the first row with that ID.
+"""
+
+import re
+import threading
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from collections.abc import Sequence
+
+SORT_COLUMNS = {'id': 0, 'title': 1, 'url': 2}
+# Filtered views kept per catalogue, most recently used first out last
+VIEW_CACHE_SIZE = 16
+# Matches fewer than 1 / SORT_MATCHES_RATIO of the catalogue are sorted on their own rather than picked out of the
+# cached permutation
+SORT_MATCHES_RATIO = 8
+# Separates the video ID from the row in a cursor
+CURSOR_SEPARATOR = '@'
+
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+class ViewCache:
+    """
+    Sort permutations and filtered rows of one catalogue, valid for as long as the catalogue is unchanged.
+    """
+
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.sort_orders = {}
+        self.views = OrderedDict()
+
+    def _check(self):
+        stamp = (self.catalogue.stamp, len(self.catalogue))
+        if stamp != self.stamp:
+            self.stamp = stamp
+            self.sort_orders = {}
+            self.views = OrderedDict()
+
+    def sort_order(self, column: int):
+        """
+        Get the catalogue rows sorted by the column, equal values staying in catalogue order.
+        """
+        with self.lock:
+            self._check()
+            if column not in self.sort_orders:
+                values = self.catalogue.column(column)
+                self.sort_orders[column] = array('l', sorted(range(len(values)), key=values.__getitem__))
+            return self.sort_orders[column]
+
+    def rows(self, column: int = None, query: str = None):
+        """
+        Get the rows matching the query, sorted by the column or in catalogue order if the column is None.
+        An invalid query raises re.error.
+        """
+        if query is None:
+            return range(len(self.catalogue)) if column is None else self.sort_order(column)
+        key = (column, query)
+        with self.lock:
+            self._check()
+            if key in self.views:
+                self.views.move_to_end(key)
+                return self.views[key]
+        if column is None:
+            rows = array('l', self.catalogue.search_index.search(query, re.IGNORECASE))
+        else:
+            matches = self.rows(None, query)
+            if len(matches) * SORT_MATCHES_RATIO < len(self.catalogue):
+                values = self.catalogue.column(column)
+                rows = array('l', sorted(matches, key=values.__getitem__))
+            else:
+                keep = bytearray(len(self.catalogue))
+                for row in matches:
+                    keep[row] = 1
+                rows = array('l', (row for row in self.sort_order(column) if keep[row]))
+        with self.lock:
+            self._check()
+            self.views[key] = rows
+            while len(self.views) > VIEW_CACHE_SIZE:
+                self.views.popitem(last=False)
+        return rows
+
+
+def make_cursor(video_id: str, row: int) -> str:
+    return f'{video_id}{CURSOR_SEPARATOR}{row}'
+
+
+def parse_cursor(cursor: str) -> tuple:
+    """
+    Split a cursor into its video ID and row; the row is None for a bare video ID.
+    """
+    video_id, separator, row = cursor.rpartition(CURSOR_SEPARATOR)
+    if separator and row.isdigit():
+        return video_id, int(row)
+    return cursor, None
+
+
+def view_cache(catalogue) -> ViewCache:
+    with _caches_lock:
+        if catalogue not in _caches:
+            _caches[catalogue] = ViewCache(catalogue)
+        return _caches[catalogue]
+
+
+class CatalogueView(Sequence):
+    """
+    Read-only sequence of the catalogue row numbers in the view, following the catalogue as it changes.
+    """
+
+    def __init__(self, catalogue, sort=None, descending: bool = False, query: str = None):
+        if isinstance(sort, str):
+            if sort.lower() not in SORT_COLUMNS:
+                raise Exception(f"The sort key {sort} is INVALID! Please choose from {', '.join(SORT_COLUMNS)}")
+            sort = SORT_COLUMNS[sort.lower()]
+        self.catalogue = catalogue
+        self.column = sort
+        self.descending = descending
+        self.query = query or None
+        self.cache = view_cache(catalogue)
+
+    @property
+    def rows(self):
+        """
+        The rows of the view in ascending order, from the cache.
+        """
+        return self.cache.rows(self.column, self.query)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        rows = self.rows
+        if isinstance(index, slice):
+            indices = range(len(rows))[index]
+            if self.descending:
+                return [rows[len(rows) - 1 - i] for i in indices]
+            return list(rows[index]) if indices.step == 1 else [rows[i] for i in indices]
+        if index < 0:
+            index += len(rows)
+        if not 0 <= index < len(rows):
+            raise IndexError('view index out of range')
+        return rows[len(rows) - 1 - index] if self.descending else rows[index]
+
+    def __repr__(self):
+        return f"CatalogueView({self.catalogue!r}, sort={self.column}, descending={self.descending}, " \
+               f"query={self.query!r}, {len(self)} videos)"
+
+    def num_pages(self, page_size: int) -> int:
+        return max(1, (len(self) - 1) // page_size + 1)
+
+    def page(self, page_num: int, page_size: int) -> list:
+        """
+        Get the videos on a page, counting from 1.
+        """
+        start = (page_num - 1) * page_size
+        return [self.catalogue[row] for row in self[start:start + page_size]]
+
+    def _key(self, row: int):
+        return row if self.column is None else (self.catalogue.field(row, self.column), row)
+
+    def cursor_row(self, cursor: str) -> int:
+        """
+        Get the catalogue row a cursor points at. A cursor whose row no longer holds its video, e.g. after the CSV was
+        rewritten, falls back to the first row with the video ID.
+        """
+        video_id, row = parse_cursor(cursor)
+        if row is not None and row < len(self.catalogue) and self.catalogue.field(row, 0) == video_id:
+            return row
+        for key in (cursor, video_id):
+            row = self.catalogue.id_index.get(key)
+            if row is not None:
+                return row
+        raise Exception(f'The cursor {cursor} is INVALID!')
+
+    def position_after(self, cursor: str) -> int:
+        """
+        Get the position in the view right after the cursor's video, whether the video matches the view's query or not.
+        """
+        row = self.cursor_row(cursor)
+        rows = self.rows
+        target = self._key(row)
+        if self.descending:
+            return len(rows) - bisect_left(rows, target, key=self._key)
+        return bisect_right(rows, target, key=self._key)
+
+    def page_after(self, cursor: str, page_size: int) -> tuple:
+        """
+        Get the videos after the cursor, or from the start without one, and the cursor of the next page, which is
+        None on the last page.
+        """
+        start = self.position_after(cursor) if cursor else 0
+        rows = self[start:start + page_size]
+        videos = [self.catalogue[row] for row in rows]
+        more = start + page_size < len(self)
+        return videos, make_cursor(videos[-1][0], rows[-1]) if more and videos else None